@@ -0,0 +1,168 @@
+"""Convert saved drawings (JSON shape lists) to .tex files without opening the editor.
+
+Usage:
+    python batch_convert.py drawings/ "more/*.json" -o tex/ -j 4
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from scene import SceneModel
+from tikz import TikzExporter
+
+# Bump when the TikZ output changes so previously generated files are rebuilt
+FORMAT_VERSION = 3
+HASH_PREFIX = '% batch_convert sha256='
+
+
+def load_scene(path):
+    """Read a drawing saved as a JSON list of shapes, or an object with a "shapes" list."""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    records = data['shapes'] if isinstance(data, dict) else data
+    return SceneModel.from_records(records)
+
+
+def save_scene(scene, path):
+    """Write a scene as a JSON shape list that load_scene can read back."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'shapes': scene.to_records()}, f)
+
+
+def source_hash(path, color, precision=3):
+    """Hash the drawing together with everything else that affects the output."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    digest.update(f"{FORMAT_VERSION}:{color}:{precision}".encode())
+    return digest.hexdigest()
+
+
+def recorded_hash(tex_path):
+    """Return the source hash stored in the first line of a previously generated file."""
+    try:
+        with open(tex_path, encoding='utf-8') as f:
+            first = f.readline().strip()
+    except OSError:
+        return None
+    return first[len(HASH_PREFIX):] if first.startswith(HASH_PREFIX) else None
+
+
+def convert_file(path, tex_path, color=None, force=False, precision=3):
+    """Convert one drawing. Returns (status, seconds, message).
+
+    precision=None writes one command per shape at full precision instead of the optimized output.
+    """
+    start = time.perf_counter()
+    try:
+        digest = source_hash(path, color, precision)
+        if not force and recorded_hash(tex_path) == digest:
+            return 'skipped', time.perf_counter() - start, 'unchanged'
+        scene = load_scene(path)
+        tmp_path = tex_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f"{HASH_PREFIX}{digest}\n")
+            TikzExporter(scene, optimize=precision is not None, precision=precision).write(f, color=color)
+            f.write("\n")
+        os.replace(tmp_path, tex_path)
+        return 'converted', time.perf_counter() - start, f"{len(scene)} shapes"
+    except Exception as e:
+        if os.path.exists(tex_path + '.tmp'):
+            os.remove(tex_path + '.tmp')
+        return 'failed', time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def named_inputs(patterns):
+    """Expand directories and glob patterns into a sorted list of (drawing file, name) pairs.
+
+    The name is the file's path relative to the directory it was found in, or to the part of
+    the glob pattern before its first wildcard, so the layout of the inputs can be mirrored.
+    """
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            root = pattern
+            paths = glob.glob(os.path.join(pattern, '**', '*.json'), recursive=True)
+        else:
+            root = os.path.dirname(pattern)
+            while glob.has_magic(root):
+                root = os.path.dirname(root)
+            paths = [p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p)]
+        for path in paths:
+            found.setdefault(os.path.normpath(path), os.path.relpath(path, root or os.curdir))
+    return sorted(found.items())
+
+
+def find_inputs(patterns):
+    """Expand directories and glob patterns into a sorted list of drawing files."""
+    return [path for path, _ in named_inputs(patterns)]
+
+
+def output_path(path, name, out_dir, extension='.tex'):
+    """Where the output for a drawing goes: next to it, or at its name under out_dir."""
+    if out_dir:
+        return os.path.join(out_dir, os.path.splitext(name)[0] + extension)
+    return os.path.splitext(path)[0] + extension
+
+
+def duplicate_outputs(sources):
+    """Return messages for outputs that more than one input would write, from (input, output) pairs."""
+    writers = {}
+    for path, out_path in sources:
+        writers.setdefault(os.path.normcase(os.path.abspath(out_path)), []).append(path)
+    return [f"{', '.join(paths)} would all write {out_path}"
+            for out_path, paths in writers.items() if len(paths) > 1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert saved drawings to TikZ .tex files.")
+    parser.add_argument('inputs', nargs='+', help="drawing files, directories or glob patterns")
+    parser.add_argument('-o', '--out-dir', help="write .tex files here instead of next to the inputs, mirroring their layout")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument('--color', help="draw every shape in this color, overriding the colors stored in the drawing")
+    parser.add_argument('--force', action='store_true', help="convert even if the input is unchanged")
+    parser.add_argument('--precision', type=int, default=3, help="decimal places kept in coordinates (default 3)")
+    parser.add_argument('--exact', action='store_true',
+                        help="write one command per shape at full precision instead of optimized output")
+    args = parser.parse_args(argv)
+
+    inputs = named_inputs(args.inputs)
+    if not inputs:
+        print("no drawings found", file=sys.stderr)
+        return 1
+    precision = None if args.exact else args.precision
+    jobs = [(path, output_path(path, name, args.out_dir), args.color, args.force, precision) for path, name in inputs]
+    duplicates = duplicate_outputs((path, tex_path) for path, tex_path, *_ in jobs)
+    if duplicates:
+        for message in duplicates:
+            print(message, file=sys.stderr)
+        return 1
+    for directory in {os.path.dirname(tex_path) for _, tex_path, *_ in jobs}:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    start = time.perf_counter()
+    if args.jobs <= 1 or len(jobs) == 1:
+        results = [convert_file(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(pool.map(convert_file, *zip(*jobs), chunksize=max(1, len(jobs) // (4 * args.jobs))))
+
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    for (path, tex_path, *_), (status, seconds, message) in zip(jobs, results):
+        counts[status] += 1
+        stream = sys.stderr if status == 'failed' else sys.stdout
+        print(f"{status:9} {path} -> {tex_path} ({seconds * 1000:.1f} ms, {message})", file=stream)
+    print(f"{counts['converted']} converted, {counts['skipped']} skipped, {counts['failed']} failed "
+          f"in {time.perf_counter() - start:.2f} s")
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""Draw static shapes as one collection per style instead of one artist per shape."""
+import numpy as np
+from matplotlib.artist import Artist
+from matplotlib.collections import EllipseCollection, LineCollection, PolyCollection
+from matplotlib.transforms import Affine2D
+
+from scene import ARROW_LENGTH, ARROW_WIDTH
+
+
+class RefreshHook(Artist):
+    """Invisible artist drawn before everything else that brings the collections up to date.
+
+    The axes list what to draw before drawing it, so collections created by this refresh,
+    for a color seen for the first time, would miss the frame; they are drawn here instead.
+    """
+
+    def __init__(self, batches):
+        super().__init__()
+        self.batches = batches
+        self.set_zorder(-1e9)
+
+    def draw(self, renderer):
+        for collection in self.batches.refresh() or ():
+            if not collection.get_animated():
+                collection.draw(renderer)
+
+
+class BatchRenderer:
+    """Keeps one LineCollection, EllipseCollection and PolyCollection per color.
+
+    Shapes that currently have their own artists (the one being drawn or moved, text,
+    smooth paths) are excluded from the batches. The collections are rebuilt from the
+    scene tables, vectorized, only when the scene, the excluded set or the zoom has
+    changed, or the view has been panned out of the region they cover.
+
+    Only shapes within margin view-widths of the view are batched, so small pans reuse
+    the collections. Shapes smaller than min_pixels on screen are skipped, and arrows
+    are drawn without heads once a head would be shorter than min_head_pixels.
+
+    With a subset, only the shapes in it are batched, and none are culled. The editor keeps
+    a second renderer over the selection this way: while the group is dragged, its
+    collections are shifted by translate() instead of being rebuilt on every motion event.
+    """
+
+    def __init__(self, ax, scene, linewidth=1, margin=0.5, min_pixels=0.5, min_head_pixels=3.0, subset=None):
+        self.ax = ax
+        self.scene = scene
+        self.subset = subset
+        self.linewidth = linewidth
+        self.margin = margin
+        self.min_pixels = min_pixels
+        self.min_head_pixels = min_head_pixels
+        self.groups = {}
+        self.excluded = set()
+        self.excluded_version = 0
+        self.drawn_state = None
+        self.drawn_scale = None
+        self.cull_box = None
+        self.shifted = False
+        # Collections created since the last draw, which the axes do not know to draw yet
+        self.created = []
+        ax.add_artist(RefreshHook(self))
+
+    def accepts(self, sid):
+        """Whether a shape can be drawn as part of a batch."""
+        kind = self.scene.kind(sid)
+        if kind == 'text':
+            return False
+        if kind == 'path':
+            return not self.scene.values(sid)[2]
+        return True
+
+    def exclude(self, sid):
+        """Take a shape out of the batches while it has its own artists."""
+        self.excluded.add(sid)
+        self.excluded_version += 1
+
+    def include(self, sid):
+        """Put a shape back into the batches."""
+        self.excluded.discard(sid)
+        self.excluded_version += 1
+
+    def set_subset(self, ids):
+        """Batch only the given shapes from now on."""
+        self.subset = set(ids)
+        self.excluded_version += 1
+
+    def translate(self, dx, dy):
+        """Draw the collections shifted by (dx, dy) until the next rebuild, without touching their geometry."""
+        transform = Affine2D().translate(dx, dy) + self.ax.transData
+        for lines, ellipses, polygons in self.groups.values():
+            lines.set_transform(transform)
+            polygons.set_transform(transform)
+            ellipses.set_offset_transform(transform)
+        self.shifted = (dx, dy) != (0, 0)
+
+    def collections(self):
+        """Return every collection created so far."""
+        return [collection for group in self.groups.values() for collection in group]
+
+    def group(self, color):
+        """Return the collections for a color, creating them on first use."""
+        group = self.groups.get(color)
+        if group is None:
+            lines = LineCollection([], colors=color, linewidths=self.linewidth)
+            ellipses = EllipseCollection([], [], [], units='xy', offsets=np.zeros((0, 2)),
+                                         offset_transform=self.ax.transData,
+                                         facecolors='none', edgecolors=color, linewidths=self.linewidth)
+            polygons = PolyCollection([], facecolors=color, edgecolors=color)
+            for collection in (lines, ellipses, polygons):
+                self.ax.add_collection(collection, autolim=False)
+            self.created.extend((lines, ellipses, polygons))
+            group = self.groups[color] = (lines, ellipses, polygons)
+        return group
+
+    def take_created(self):
+        created, self.created = self.created, []
+        return created
+
+    def refresh(self):
+        """Rebuild the collections if anything changed since they were last drawn.
+
+        Returns the collections created since the last refresh.
+        """
+        state = (self.scene.revision, self.excluded_version)
+        view, scale = view_box(self.ax)
+        cull = self.cull_box
+        if (state == self.drawn_state and abs(scale / self.drawn_scale - 1) < 1e-9
+                and cull[0] <= view[0] and cull[1] <= view[1] and view[2] <= cull[2] and view[3] <= cull[3]):
+            return self.take_created()
+        if self.shifted:
+            self.translate(0, 0)
+        self.drawn_state = state
+        self.drawn_scale = scale
+        margin = self.margin * (view[2] - view[0])
+        self.cull_box, _ = view_box(self.ax, margin)
+        segments, ellipses, polygons = {}, {}, {}
+
+        def add(target, codes, items):
+            for code in np.unique(codes):
+                target.setdefault(int(code), []).append(items[codes == code])
+
+        excluded = np.fromiter(self.excluded, dtype=np.int64, count=len(self.excluded))
+        if self.subset is None:
+            tables = {kind: table.live_rows() for kind, table in self.scene.tables.items()}
+        else:
+            tables = self.scene.group_rows([sid for sid in self.subset if sid in self.scene])
+        for kind, rows in tables.items():
+            table = self.scene.tables[kind]
+            if len(excluded):
+                rows = rows[~np.isin(table.ids[rows], excluded)]
+            if self.subset is None:
+                rows = cull_rows(self.scene, kind, rows, self.cull_box, scale, self.min_pixels)
+            if not len(rows):
+                continue
+            v = table.values[rows]
+            codes = table.colors[rows]
+            if kind == 'line':
+                add(segments, codes, v.reshape(-1, 2, 2))
+            elif kind == 'arrow' and ARROW_LENGTH * scale < self.min_head_pixels:
+                add(segments, codes, v.reshape(-1, 2, 2))
+            elif kind == 'arrow':
+                shafts, heads, has_head = arrow_geometry(v)
+                add(segments, codes, shafts)
+                add(polygons, codes[has_head], heads[has_head])
+            elif kind == 'rectangle':
+                x0, y0 = v[:, 0], v[:, 1]
+                x1, y1 = x0 + v[:, 2], y0 + v[:, 3]
+                corners = np.stack([np.column_stack([x0, y0]), np.column_stack([x1, y0]),
+                                    np.column_stack([x1, y1]), np.column_stack([x0, y1])], axis=1)
+                edges = np.stack([corners, np.roll(corners, -1, axis=1)], axis=2).reshape(-1, 2, 2)
+                add(segments, np.repeat(codes, 4), edges)
+            elif kind in ('ellipse', 'cone'):
+                add(ellipses, codes, v[:, :4])
+                if kind == 'cone':
+                    sides = np.stack([v[:, [4, 5, 8, 9]], v[:, [6, 7, 8, 9]]], axis=1).reshape(-1, 2, 2)
+                    add(segments, np.repeat(codes, 2), sides)
+            elif kind in ('polygon', 'path'):
+                # Variable-length shapes, kept as lists; smooth paths are never batched
+                for code, (start, count, *rest) in zip(codes, v.astype(int)):
+                    if kind == 'path' and rest[0]:
+                        continue
+                    xy = self.scene.vertices[start:start + count]
+                    if kind == 'polygon':
+                        polygons.setdefault(int(code), []).append([xy.copy()])
+                    else:
+                        segments.setdefault(int(code), []).append(np.stack([xy[:-1], xy[1:]], axis=1))
+
+        palette = self.scene.palette
+        for code in set(segments) | set(ellipses) | set(polygons):
+            self.group(palette[code])
+        used = {palette[code] for code in set(segments) | set(ellipses) | set(polygons)}
+        for color, (line_collection, ellipse_collection, poly_collection) in self.groups.items():
+            code = self.scene.palette_index.get(color)
+            if color not in used:
+                line_collection.set_segments([])
+                ellipse_collection.set_offsets(np.zeros((0, 2)))
+                ellipse_collection.set_widths([])
+                ellipse_collection.set_heights([])
+                ellipse_collection.set_angles([])
+                poly_collection.set_verts([])
+                continue
+            parts = segments.get(code, [])
+            line_collection.set_segments(np.concatenate(parts) if parts else [])
+            parts = ellipses.get(code, [])
+            e = np.concatenate(parts) if parts else np.zeros((0, 4))
+            ellipse_collection.set_offsets(e[:, :2])
+            ellipse_collection.set_widths(e[:, 2])
+            ellipse_collection.set_heights(e[:, 3])
+            ellipse_collection.set_angles(np.zeros(len(e)))
+            verts = []
+            for part in polygons.get(code, []):
+                verts.extend(part)
+            poly_collection.set_verts(verts)
+        return self.take_created()
+
+
+def arrow_geometry(v):
+    """Vectorized arrow shafts and heads for rows of the arrow table.
+
+    Returns (shafts (n, 2, 2), heads (n, 3, 2), has_head (n,)); arrows too short for a
+    head keep their full length, matching scene.arrow_parts.
+    """
+    x0, y0, x1, y1 = v.T
+    angle = np.arctan2(y1 - y0, x1 - x0)
+    cos, sin = np.cos(angle), np.sin(angle)
+    has_head = np.hypot(x1 - x0, y1 - y0) > ARROW_LENGTH
+    ex = np.where(has_head, x1 - ARROW_LENGTH * cos, x1)
+    ey = np.where(has_head, y1 - ARROW_LENGTH * sin, y1)
+    shafts = np.stack([np.column_stack([x0, y0]), np.column_stack([ex, ey])], axis=1)
+    heads = np.stack([np.column_stack([ex - ARROW_WIDTH * sin, ey + ARROW_WIDTH * cos]),
+                      np.column_stack([ex + ARROW_WIDTH * sin, ey - ARROW_WIDTH * cos]),
+                      np.column_stack([x1, y1])], axis=1)
+    return shafts, heads, has_head
+
+
+def view_box(ax, margin=0.0):
+    """Return the visible data box (x0, y0, x1, y1) grown by margin on every side, and pixels per data unit."""
+    x0, x1 = sorted(ax.get_xlim())
+    y0, y1 = sorted(ax.get_ylim())
+    scale = ax.bbox.width / (x1 - x0)
+    return (x0 - margin, y0 - margin, x1 + margin, y1 + margin), scale
+
+
+def boxes_overlap(boxes, box):
+    """Which rows of an (n, 4) box array intersect box."""
+    return (boxes[:, 2] >= box[0]) & (boxes[:, 0] <= box[2]) & (boxes[:, 3] >= box[1]) & (boxes[:, 1] <= box[3])
+
+
+def cull_rows(scene, kind, rows, box, scale, min_pixels):
+    """Keep the rows of one table that intersect box and span at least min_pixels on screen."""
+    if not len(rows):
+        return rows
+    boxes = scene.table_bounds(kind, rows)
+    size = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]) * scale
+    return rows[boxes_overlap(boxes, box) & (size >= min_pixels)]
@@ -0,0 +1,293 @@
+"""Headless benchmarks for the editor's hot paths on synthetic scenes.
+
+Runs DrawToLatexApp on the Agg backend with the Tk widgets replaced by plain
+variables, so it needs no display. Results are written as JSON and can be
+compared against a stored baseline:
+
+    python benchmarks/bench_scene.py --output results.json
+    python benchmarks/bench_scene.py --save-baseline
+    python benchmarks/bench_scene.py --compare benchmarks/baselines.json --tolerance 2
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+from matplotlib.backend_bases import MouseEvent
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from final_working_drawer import DrawToLatexApp  # noqa: E402
+from history import AddCommand  # noqa: E402
+from journal import write_snapshot  # noqa: E402
+
+SIZES = (10, 100, 1000, 10000)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+MIX = ('line', 'arrow', 'ellipse', 'rectangle', 'cone', 'text')
+
+
+class Variable:
+    """Stand-in for tk.StringVar."""
+
+    def __init__(self, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class HeadlessApp(DrawToLatexApp):
+    """DrawToLatexApp drawing into an Agg canvas with no Tk window or controls."""
+
+    def __init__(self, batch_rendering=True, drawing_path=None):
+        super().__init__(root=None, batch_rendering=batch_rendering, drawing_path=drawing_path)
+
+    def setup_window(self):
+        pass
+
+    def setup_canvas(self):
+        self.fig = Figure(figsize=(8, 6), dpi=100)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self.setup_axes()
+
+    def build_controls(self):
+        self.shape_var = Variable('Line')
+        self.color_var = Variable('black')
+        self.guides_var = Variable(True)
+        self.grid_var = Variable(False)
+
+    def bind_keys(self):
+        pass
+
+    def start_export(self, job):
+        # There is no event loop to poll from, so the export runs on this thread
+        job.run()
+        self.poll_export(job)
+
+    def show_latex_code(self, latex_code):
+        self.latex_code = latex_code
+
+
+def mouse_event(app, name, x, y):
+    """Build a real matplotlib mouse event at data coordinates (x, y)."""
+    px, py = app.ax.transData.transform((x, y))
+    return MouseEvent(name, app.canvas, px, py, button=1)
+
+
+def build_scene(app, n, rng):
+    """Fill the app with n shapes of the benchmark mix, the way the drawing tools create them."""
+    span = max(10.0, np.sqrt(n) * 2)
+    app.ax.set_xlim(0, span)
+    app.ax.set_ylim(0, span)
+    for i in range(n):
+        kind = MIX[i % len(MIX)]
+        # Every shape lies fully in view, so a click anywhere on it lands on the axes
+        x, y = rng.uniform(0, span - 2, 2)
+        w, h = rng.uniform(0.2, 1.5, 2)
+        app.color = 'black'
+        if kind in ('line', 'arrow'):
+            sid = app.scene.add('line', (x, y, x + w, y + h), app.color)
+            app.create_artists(sid)
+            if kind == 'arrow':
+                sid = app.add_arrowhead(sid)
+        elif kind == 'ellipse':
+            sid = app.scene.add('ellipse', (x, y, w, h / 2), app.color)
+            app.create_artists(sid)
+        elif kind == 'rectangle':
+            sid = app.scene.add('rectangle', (x, y, w, h), app.color)
+            app.create_artists(sid)
+        elif kind == 'cone':
+            ellipse = app.scene.add('ellipse', (x, y, w, h / 4), app.color)
+            app.create_artists(ellipse)
+            sid = app.draw_cone(ellipse, (x - w / 2, y), (x + w / 2, y), (x, y + 3 * h / 4), app.color)
+        else:
+            sid = app.scene.add('text', (x, y), app.color, text=f"t{i}")
+            app.create_artists(sid)
+        app.history.push(AddCommand([sid]))
+        app.release_artists(sid)
+    return span
+
+
+def outline_point(scene, sid):
+    """A point on a shape's outline, so a click there always hits it wherever the shape has moved."""
+    kind, v = scene.kind(sid), scene.values(sid)
+    if kind in ('line', 'arrow'):
+        return (v[0] + v[2]) / 2, (v[1] + v[3]) / 2
+    if kind in ('ellipse', 'cone'):
+        return v[0] + v[2] / 2, v[1]
+    if kind == 'rectangle':
+        return v[0], v[1] + v[3] / 2
+    return v[0], v[1]
+
+
+def check_hits():
+    """Fail early if clicks on the outline of an ellipse or a cone's base and sides miss the shape."""
+    app = HeadlessApp()
+    app.ax.set_xlim(0, 10)
+    app.ax.set_ylim(0, 10)
+    ellipse = app.scene.add('ellipse', (7, 6, 2, 1), 'black')
+    base = app.scene.add('ellipse', (5.5, 8, 1, 0.5), 'black')
+    cone = app.draw_cone(base, (5, 8), (6, 8), (5.5, 9.5), 'black')
+    clicks = [(8, 6, ellipse), (7.98, 6, ellipse), (6, 6, ellipse), (7, 6.5, ellipse),
+              (5.5, 7.75, cone), (5.25, 8.75, cone)]
+    for x, y, sid in clicks:
+        found = app.select_shape(mouse_event(app, 'button_press_event', x, y))
+        if found != sid:
+            raise SystemExit(f"a click at ({x}, {y}) selected {found} instead of shape {sid}")
+
+
+def timed(func, repeat):
+    """Run func repeat times and return the per-call wall times in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def bench_size(n, seed=0, batch_rendering=True):
+    rng = np.random.default_rng(seed)
+    app = HeadlessApp(batch_rendering)
+    results = {}
+
+    start = time.perf_counter()
+    span = build_scene(app, n, rng)
+    results['build'] = [(time.perf_counter() - start) * 1000]
+    points = rng.uniform(0, span, (50, 2))
+    ids = app.scene.ids().tolist()
+    # Select, drag and erase click on known shapes, so they never time a click on empty space
+    targets = [ids[i] for i in np.linspace(0, len(ids) - 1, 50).astype(int)]
+    erased = ids[::max(1, len(ids) // 10)][:10]
+    # The leftmost target, which stays in view while the drags below push it right
+    dragged = min(targets, key=lambda sid: outline_point(app.scene, sid)[0])
+
+    results['full_redraw'] = timed(app.canvas.draw, 3)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'drawing.ltxd')
+        write_snapshot(app.scene, path)
+        results['reopen_drawing'] = timed(lambda: HeadlessApp(batch_rendering, path).store.close(), 3)
+
+    def drag():
+        # Select a known shape and drag it through 20 motion events
+        app.shape_var.set('Select')
+        x, y = outline_point(app.scene, dragged)
+        app.on_click(mouse_event(app, 'button_press_event', x, y))
+        for step in range(1, 21):
+            app.on_motion(mouse_event(app, 'motion_notify_event', x + step * 0.05, y))
+        app.on_release(mouse_event(app, 'button_release_event', x + 1.0, y))
+        app.clear_selection()
+    results['drag_20_motions'] = timed(drag, 3)
+
+    group = sorted(app.scene.index.query_box(0, 0, span / 2, span / 2))
+
+    def drag_group():
+        # Drag every shape in the lower left quarter through 20 motion events
+        app.set_selection(group)
+        x, y = span / 4, span / 4
+        app.start_group_drag(mouse_event(app, 'button_press_event', x, y))
+        for step in range(1, 21):
+            app.on_motion(mouse_event(app, 'motion_notify_event', x + step * 0.05, y))
+        app.on_release(mouse_event(app, 'button_release_event', x + 1.0, y))
+        app.clear_selection()
+    results['drag_group_20_motions'] = timed(drag_group, 3)
+
+    events = [mouse_event(app, 'button_press_event', *outline_point(app.scene, sid)) for sid in targets]
+    results['select_shape'] = timed(lambda: [app.select_shape(e) for e in events], 3)
+    app.clear_selection()
+
+    line = app.scene.add('line', (0, 0, 0, 0), 'black')
+    app.create_artists(line)
+    motion = [mouse_event(app, 'motion_notify_event', x, y) for x, y in points]
+    original_draw = app.canvas.draw
+    app.canvas.draw = lambda: None  # time the lookup, not the redraw snap_to_closest triggers
+    results['snap_to_closest'] = timed(lambda: [app.snap_to_closest(line, e) for e in motion], 3)
+    app.canvas.draw = original_draw
+    app.delete_shape(line)
+
+    app.exporter.cache.clear()
+    results['generate_latex_cold'] = timed(app.generate_latex, 1)
+    results['generate_latex_warm'] = timed(app.generate_latex, 3)
+
+    events = [mouse_event(app, 'button_press_event', *outline_point(app.scene, sid)) for sid in erased]
+    results['erase_shape'] = timed(lambda: [app.erase_shape(e) for e in events], 1)
+    results['undo_last_action'] = timed(app.undo_last_action, 5)
+
+    return {name: {'median_ms': statistics.median(times), 'min_ms': min(times), 'runs': len(times)}
+            for name, times in results.items()}
+
+
+def run(sizes, batch_rendering=True):
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'matplotlib': matplotlib.__version__,
+            'platform': platform.platform(),
+            'batch_rendering': batch_rendering,
+        },
+        'results': {},
+    }
+    for n in sizes:
+        report['results'][str(n)] = bench_size(n, batch_rendering=batch_rendering)
+        for name, stats in report['results'][str(n)].items():
+            print(f"{n:>6} {name:22} {stats['median_ms']:10.2f} ms")
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """Return (operations whose best time slowed down by more than tolerance times, operations with no baseline)."""
+    regressions, unchecked = [], []
+    for n, ops in report['results'].items():
+        for name, stats in ops.items():
+            base = baseline['results'].get(n, {}).get(name)
+            if not base:
+                unchecked.append(f"{n} {name}")
+            # The minimum is the least noisy estimate; sub-millisecond timings are ignored
+            elif stats['min_ms'] > max(base['min_ms'] * tolerance, 1.0):
+                regressions.append(f"{n} {name}: {base['min_ms']:.2f} ms -> {stats['min_ms']:.2f} ms")
+    return regressions, unchecked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark scene operations at increasing scene sizes.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--save-baseline', action='store_true', help=f"overwrite {BASELINE_PATH}")
+    parser.add_argument('--compare', metavar='BASELINE', help="fail if any operation regressed against this file")
+    parser.add_argument('--individual-artists', action='store_true',
+                        help="draw every shape with its own artist instead of batching by style")
+    parser.add_argument('--tolerance', type=float, default=2.0, help="allowed slowdown factor when comparing")
+    args = parser.parse_args(argv)
+
+    check_hits()
+    report = run(args.sizes, batch_rendering=not args.individual_artists)
+    for path in filter(None, [args.output, BASELINE_PATH if args.save_baseline else None]):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions, unchecked = compare(report, json.load(f), args.tolerance)
+        for line in unchecked:
+            print("NO BASELINE", line)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
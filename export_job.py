@@ -0,0 +1,62 @@
+"""TikZ export on a worker thread, so a large drawing never blocks the Tk mainloop."""
+import queue
+import threading
+import time
+
+from tikz import TikzExporter
+
+
+class ExportJob:
+    """Builds a tikzpicture from a scene snapshot on a background thread.
+
+    The worker only reports through a queue: ('progress', (done, total)) after every
+    progress_every shapes or so, then one of ('done', code), ('cancelled', None) or
+    ('failed', message). The Tk thread collects them with poll(), e.g. from root.after.
+    seconds is how long a finished export took on the worker.
+    """
+
+    def __init__(self, scene, cache=None, color=None, precision=3, progress_every=500):
+        self.exporter = TikzExporter(scene, cache, precision=precision)
+        self.color = color
+        self.progress_every = progress_every
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = None
+        self.seconds = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='tikz-export', daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        """Ask the worker to stop before its next chunk."""
+        self.cancelled.set()
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            total = len(self.exporter.scene)
+            parts = []
+            reported = -self.progress_every
+            for chunk in self.exporter.iter_chunks(self.color):
+                if self.cancelled.is_set():
+                    self.messages.put(('cancelled', None))
+                    return
+                if self.exporter.done - reported >= self.progress_every:
+                    reported = self.exporter.done
+                    self.messages.put(('progress', (reported, total)))
+                parts.append(chunk)
+            code = "".join(parts)
+            self.seconds = time.perf_counter() - start
+            self.messages.put(('done', code))
+        except Exception as e:
+            self.messages.put(('failed', f"{type(e).__name__}: {e}"))
+
+    def poll(self):
+        """Return the messages the worker has sent since the last poll, without waiting."""
+        messages = []
+        while True:
+            try:
+                messages.append(self.messages.get_nowait())
+            except queue.Empty:
+                return messages
@@ -1,70 +1,285 @@
+import time
+STARTED = time.perf_counter()
 import tkinter as tk
-from tkinter import ttk
-import matplotlib.pyplot as plt
+from tkinter import ttk, filedialog
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.patches import Ellipse, Rectangle, Polygon
+from matplotlib.patches import Ellipse, Rectangle, Polygon, PathPatch
 from matplotlib.lines import Line2D
-from matplotlib.text import Text
-from collections import deque
+from matplotlib.path import Path
+from matplotlib.transforms import Bbox
 import numpy as np
 import sys
+from scene import SceneModel, arrow_parts
+from tikz import TikzExporter
+from snapping import Snapper, AlignmentGuides, snap_to_grid
+from batch_render import BatchRenderer, view_box
+from history import CommandHistory, AddCommand, DeleteCommand, ClearCommand, RecolorCommand, TransformCommand
+from viewport import Viewport
+from text_extents import TextExtents
+# Saving, journaling, export, import, pen smoothing and profiling are imported where first used,
+# so none of them delay the first frame
+
+class LatexWindow:
+    """Window that shows export progress, then the generated code loaded a chunk at a time."""
+
+    def __init__(self, root, on_close, chunk_size=1 << 16):
+        self.code = None
+        self.on_close = on_close
+        self.chunk_size = chunk_size
+        self.window = tk.Toplevel(root)
+        self.window.title("Generated LaTeX Code")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.status = ttk.Label(self.window, text="Generating...")
+        self.status.pack(fill=tk.X, padx=5, pady=5)
+        self.progress = ttk.Progressbar(self.window, maximum=1.0)
+        self.progress.pack(fill=tk.X, padx=5)
+
+        # No wrapping: Tk lays out very long wrapped lines slowly
+        text_frame = ttk.Frame(self.window)
+        text_frame.pack(expand=True, fill=tk.BOTH)
+        self.text_widget = tk.Text(text_frame, wrap='none', state=tk.DISABLED)
+        y_scroll = ttk.Scrollbar(text_frame, orient=tk.VERTICAL, command=self.text_widget.yview)
+        x_scroll = ttk.Scrollbar(text_frame, orient=tk.HORIZONTAL, command=self.text_widget.xview)
+        self.text_widget.config(yscrollcommand=y_scroll.set, xscrollcommand=x_scroll.set)
+        y_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        x_scroll.pack(side=tk.BOTTOM, fill=tk.X)
+        self.text_widget.pack(expand=True, fill=tk.BOTH)
+
+        buttons = ttk.Frame(self.window)
+        buttons.pack(pady=5)
+        self.save_button = ttk.Button(buttons, text="Save to File", command=self.save, state=tk.DISABLED)
+        self.save_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text="Close", command=self.close).pack(side=tk.LEFT, padx=5)
+
+    def set_progress(self, done, total):
+        self.progress.config(value=done / max(total, 1))
+        self.status.config(text=f"Generating... {done} of {total} shapes")
+
+    def set_status(self, text):
+        self.status.config(text=text)
+
+    def show(self, code):
+        """Display the code, inserting it in chunks so the window stays responsive."""
+        self.code = code
+        self.progress.pack_forget()
+        self.status.config(text=f"{len(code.splitlines())} lines")
+        self.save_button.config(state=tk.NORMAL)
+        self.insert_chunk(0)
+
+    def insert_chunk(self, start):
+        if self.window is None:
+            return
+        self.text_widget.config(state=tk.NORMAL)
+        self.text_widget.insert(tk.END, self.code[start:start + self.chunk_size])
+        self.text_widget.config(state=tk.DISABLED)
+        if start + self.chunk_size < len(self.code):
+            self.window.after(1, self.insert_chunk, start + self.chunk_size)
+
+    def save(self):
+        """Write the whole code straight to a .tex file, without going through the text widget."""
+        path = filedialog.asksaveasfilename(defaultextension='.tex', filetypes=[("LaTeX", "*.tex")])
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.code)
+            self.status.config(text=f"Saved to {path}")
+
+    def close(self):
+        self.on_close()
+        self.window.destroy()
+        self.window = None
+
 
 class DrawToLatexApp:
-    def __init__(self, root):
+    def __init__(self, root, profiler=None, profile_path=None, show_overlay=False, batch_rendering=True,
+                 history_budget=4 << 20, drawing_path=None):
         self.root = root
-        self.root.title("Draw to LaTeX Vector Code")
+        self.setup_window()
+        self.setup_canvas()
+
+        # Optional latency instrumentation; handlers are wrapped before anything binds to them
+        self.profiler = profiler
+        self.profile_path = profile_path
+        self.overlay = None
+        self.capturing_background = False
+        if self.profiler is not None:
+            self.instrument(show_overlay)
+
+        self.linewidth = 1
+        # Label sizes are measured once per string and reused for hit testing and partial redraws
+        self.text_extents = TextExtents(fontsize=12)
+        self.build_controls()
+
+        self.canvas.mpl_connect('button_press_event', self.on_click)
+        self.canvas.mpl_connect('motion_notify_event', self.on_motion)
+        self.canvas.mpl_connect('button_release_event', self.on_release)
+        self.canvas.mpl_connect('resize_event', self.invalidate_background)
+        self.canvas.mpl_connect('scroll_event', self.on_scroll)
+
+        # The scene model is the source of truth; shapes are referred to by their scene id
+        # and self.views maps each id to the matplotlib artists that display it
+        # With a drawing path every scene edit is journaled to disk and the drawing is reopened from there
+        self.store = None
+        if drawing_path is not None:
+            from journal import DrawingStore
+            self.store = DrawingStore(drawing_path)
+            self.scene = self.store.load(cell_size=1.0)
+        else:
+            self.scene = SceneModel(cell_size=1.0)
+        self.views = {}
+        self.exporter = TikzExporter(self.scene)
+        # Decimal places kept in exported coordinates
+        self.latex_precision = 3
+        # Clicks pick shapes within hit_pixels on screen, whatever the zoom
+        self.hit_pixels = 8
+
+        # With batch rendering, finished shapes are drawn through one collection per color and
+        # only the shape being drawn, moved or typed into keeps its own artists in self.views
+        self.batch_rendering = batch_rendering
+        self.renderer = BatchRenderer(self.ax, self.scene, self.linewidth) if batch_rendering else None
+
+        # Selected shapes are dragged as a group through a renderer of their own. One outline,
+        # updated in place, marks the selection or the rubber band being dragged out
+        self.selection = []
+        self.selection_renderer = BatchRenderer(self.ax, self.scene, self.linewidth, subset=()) if batch_rendering else None
+        self.selection_outline = self.add_selection_outline()
+        self.band_start = None
+        self.drag_origin = None
+        # Keyboard steps for scaling (+/-) and rotating (r/R) the selection
+        self.scale_step = 1.1
+        self.rotate_step = 15.0
+
+        # The mouse wheel zooms and dragging with the middle or right button pans; artists
+        # of shapes outside the view are hidden before each full draw
+        self.viewport = Viewport(self)
+
+        # Line endpoints snap to ellipse outlines and rectangle corners within snap_pixels;
+        # the snapper's threshold is set in data units at the current zoom before each snap
+        self.snap_enabled = True
+        self.snap_pixels = 8
+        self.snapper = Snapper(self.scene)
+        # Drawn and dragged shapes line up with the edges and centers of other shapes within
+        # guide_pixels, shown by a dashed guide line, or else, with the grid on, with the grid
+        self.guides = AlignmentGuides(self.scene)
+        self.guide_pixels = 6
+        self.grid_spacing = 0.5
+        self.guide_lines = self.add_guide_lines()
+        self.drag_bounds = None
+        self.drag_offset = (0.0, 0.0)
+        self.dragged = set()
+
+        # Pen strokes are simplified to within stroke_pixels while drawing and
+        # optionally smoothed into Bezier segments when the mouse is released
+        self.stroke = None
+        self.stroke_preview = None
+        self.stroke_pixels = 2
+        self.smooth_strokes = True
 
-        # Handle window close event
+        self.start_x = None
+        self.start_y = None
+        self.current_shape = None
+        self.textbox = None
+        # Undo/redo log of invertible commands; its depth is bounded by history_budget bytes
+        self.history = CommandHistory(budget_bytes=history_budget)
+        self.is_moving = False
+
+        # Blitting state: the static background is cached when a drag starts and only
+        # the animated artists (shape being drawn, dragged shape, selection box) are redrawn
+        self.use_blit = True
+        self.background = None
+        self.animated_artists = []
+
+        # LaTeX export runs on a worker thread; its progress and result are shown in latex_window
+        self.export_job = None
+        self.latex_window = None
+
+        self.bind_keys()
+        if len(self.scene):
+            self.show_loaded_shapes()
+
+    def setup_window(self):
+        """Title the window and handle its close event."""
+        self.root.title("Draw to LaTeX Vector Code")
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-        # Canvas setup
-        self.fig, self.ax = plt.subplots()
-        self.canvas = FigureCanvasTkAgg(self.fig, master=root)
+    def setup_canvas(self):
+        """Create the figure and embed it in the window."""
+        # Built directly rather than through pyplot, which would also set up a figure manager
+        # and its own window that the embedded canvas never uses
+        self.fig = Figure()
+        self.ax = self.fig.add_subplot()
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.root)
         self.canvas.get_tk_widget().pack(side=tk.LEFT, fill=tk.BOTH, expand=1)
+        self.setup_axes()
+
+    def setup_axes(self):
         self.ax.set_aspect('equal', adjustable='box')
         self.ax.set_xlim(0, 10)
         self.ax.set_ylim(0, 10)
         self.ax.axis('off')
 
-        # Controls frame
-        controls_frame = ttk.Frame(root)
+    def build_controls(self):
+        """Create the tool, color and action controls beside the canvas."""
+        controls_frame = ttk.Frame(self.root)
         controls_frame.pack(side=tk.RIGHT, fill=tk.Y)
 
         self.shape_var = tk.StringVar(value='Line')
-        shapes = ['Line', 'Arrow Line', 'Ellipse', 'Rectangle', 'Text', 'Select', 'Erase', 'Cone', 'Upside-down Cone']
+        shapes = ['Line', 'Arrow Line', 'Ellipse', 'Rectangle', 'Text', 'Pen', 'Select', 'Erase', 'Cone', 'Upside-down Cone']
         for shape in shapes:
             ttk.Radiobutton(controls_frame, text=shape, variable=self.shape_var, value=shape).pack(anchor=tk.W)
 
         self.color_var = tk.StringVar(value='black')
         colors = ['white', 'black', 'red', 'green', 'blue', 'cyan', 'magenta', 'yellow']
         ttk.Label(controls_frame, text="Choose Color").pack(pady=5)
-        color_menu = ttk.OptionMenu(controls_frame, self.color_var, *colors)
+        color_menu = ttk.OptionMenu(controls_frame, self.color_var, *colors, command=self.change_selected_shape_color)
         color_menu.pack(pady=5)
 
-        self.linewidth = 1
+        self.guides_var = tk.BooleanVar(value=True)
+        self.grid_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(controls_frame, text="Alignment guides", variable=self.guides_var).pack(anchor=tk.W)
+        ttk.Checkbutton(controls_frame, text="Snap to grid", variable=self.grid_var).pack(anchor=tk.W)
 
         ttk.Button(controls_frame, text="Clear", command=self.clear_canvas).pack(pady=5)
         ttk.Button(controls_frame, text="Generate LaTeX", command=self.generate_latex).pack(pady=5)
+        ttk.Button(controls_frame, text="Save Drawing", command=self.save_drawing).pack(pady=5)
+        ttk.Button(controls_frame, text="Import TikZ", command=self.import_tikz).pack(pady=5)
 
-        self.canvas.mpl_connect('button_press_event', self.on_click)
-        self.canvas.mpl_connect('motion_notify_event', self.on_motion)
-        self.canvas.mpl_connect('button_release_event', self.on_release)
-
-        self.start_x = None
-        self.start_y = None
-        self.current_shape = None
-        self.textbox = None
-        self.selected_shape = None
-        self.selection_rectangle = None
-        self.history = deque(maxlen=20)
-        self.is_moving = False
-        self.arrowheads = []
-
+    def bind_keys(self):
         self.root.bind("<Control-z>", self.undo_last_action)
-        self.canvas.get_tk_widget().bind("<Key>", self.on_text_key_press)
+        self.root.bind("<Control-y>", self.redo_last_action)
+        self.root.bind("<Control-Z>", self.redo_last_action)
+        self.canvas.get_tk_widget().bind("<Key>", self.on_key_press)
         self.canvas.get_tk_widget().focus_set()
 
+    def instrument(self, show_overlay):
+        """Time the event handlers and redraws with the profiler; exports are timed by poll_export."""
+        for name in ['on_click', 'on_motion', 'on_release', 'on_scroll', 'on_key_press', 'undo_last_action', 'redo_last_action']:
+            setattr(self, name, self.profiler.wrap(name, getattr(self, name)))
+        self.canvas.draw = self.profiler.wrap('draw', self.canvas.draw, frame=True)
+        self.canvas.blit = self.profiler.wrap('blit', self.canvas.blit, frame=True)
+        if show_overlay:
+            # Drawn on top of each frame rather than as part of it, so it is never baked into
+            # the blitting background and updating it never forces a redraw of its own
+            self.overlay = self.fig.text(0.01, 0.99, "", va='top', fontsize=8, color='gray', animated=True)
+            self.canvas.mpl_connect('draw_event', self.draw_overlay)
+            self.refresh_overlay()
+
+    def refresh_overlay(self):
+        """Update the FPS and latency readout twice a second; it is shown with the next frame."""
+        self.overlay.set_text(self.profiler.overlay_text())
+        self.root.after(500, self.refresh_overlay)
+
+    def draw_overlay(self, event=None):
+        """Draw the readout over a finished full draw, except one taken as the blitting background."""
+        if not self.capturing_background:
+            self.fig.draw_artist(self.overlay)
+
     def on_closing(self):
+        if self.profiler is not None and self.profile_path:
+            self.profiler.dump(self.profile_path)
+        if self.store is not None:
+            self.store.close()
         self.root.quit()
         self.root.destroy()
         sys.exit(0)
@@ -73,71 +288,116 @@ class DrawToLatexApp:
         """Handle mouse click events for drawing and selecting shapes."""
         if event.inaxes != self.ax:
             return
+        self.finish_text_entry()
+        if event.button in (2, 3):
+            self.viewport.start_pan(event)
+            return
         if self.shape_var.get() == 'Select':
-            if self.selected_shape:
-                self.deselect_shape()
-            else:
-                self.select_shape(event)
-                if self.selected_shape:
-                    self.draw_selection_rectangle()
-        elif self.shape_var.get() == 'Erase':
+            self.select_at(event)
+            return
+        if self.selection:
+            self.clear_selection()
+        if self.shape_var.get() == 'Erase':
             self.erase_shape(event)
         else:
             self.start_x, self.start_y = event.xdata, event.ydata
             shape = self.shape_var.get()
             self.color = self.color_var.get()
+            x, y = self.start_x, self.start_y
+            if shape == 'Pen':
+                from freehand import StrokeBuffer
+                self.stroke = StrokeBuffer(tolerance=self.data_distance(self.stroke_pixels))
+                self.stroke.add_point(x, y)
+                self.stroke_preview = Line2D([x], [y], color=self.color, linewidth=self.linewidth)
+                self.ax.add_line(self.stroke_preview)
+                self.begin_blit(self.stroke_preview)
+                return
+            if shape in ['Line', 'Arrow Line']:
+                self.start_x, self.start_y = x, y = self.snap_point(x, y, endpoints=True)
+            else:
+                self.start_x, self.start_y = x, y = self.snap_point(x, y)
             if shape == 'Ellipse':
-                self.current_shape = Ellipse((self.start_x, self.start_y), 0.1, 0.1, edgecolor=self.color, facecolor='none', linewidth=self.linewidth)
+                self.current_shape = self.scene.add('ellipse', (x, y, 0.1, 0.1), self.color)
             elif shape == 'Rectangle':
-                self.current_shape = Rectangle((self.start_x, self.start_y), 0.1, 0.1, edgecolor=self.color, facecolor='none', linewidth=self.linewidth)
-            elif shape == 'Line':
-                self.current_shape = Line2D([self.start_x, self.start_x], [self.start_y, self.start_y], color=self.color, linewidth=self.linewidth)
-                self.ax.add_line(self.current_shape)
-            elif shape == 'Arrow Line':
-                self.current_shape = Line2D([self.start_x, self.start_x], [self.start_y, self.start_y], color=self.color, linewidth=self.linewidth)
-                self.ax.add_line(self.current_shape)
+                self.current_shape = self.scene.add('rectangle', (x, y, 0.1, 0.1), self.color)
+            elif shape in ['Line', 'Arrow Line']:
+                # Arrow lines are plain lines while dragging; the head is added on release
+                self.current_shape = self.scene.add('line', (x, y, x, y), self.color)
             elif shape == 'Text':
-                self.textbox = self.ax.text(self.start_x, self.start_y, "", color=self.color, fontsize=12, bbox=dict(facecolor='white', edgecolor='none', boxstyle='round,pad=0.5'))
-                self.current_shape = self.textbox
+                self.current_shape = self.scene.add('text', (x, y), self.color, text="")
+                self.textbox = self.current_shape
                 self.canvas.get_tk_widget().focus_set()
             elif shape == 'Cone' or shape == 'Upside-down Cone':
                 # Draw a placeholder ellipse to be adjusted during motion
-                self.current_shape = Ellipse((self.start_x, self.start_y), 0.1, 0.05, edgecolor=self.color, facecolor='none', linewidth=self.linewidth)
-                self.ax.add_patch(self.current_shape)
-            if shape in ['Ellipse', 'Rectangle']:
-                self.ax.add_patch(self.current_shape)
-            self.canvas.draw()
+                self.current_shape = self.scene.add('ellipse', (x, y, 0.1, 0.05), self.color)
+            self.create_artists(self.current_shape)
+            self.begin_blit(*self.views[self.current_shape], *self.guide_lines)
 
     def on_motion(self, event):
+        if self.viewport.pan_start is not None:
+            self.viewport.pan(event)
+            self.canvas.draw_idle()
+            return
         if not event.inaxes:
             return
-        if self.is_moving and self.selected_shape:
-            dx = event.xdata - self.start_x
-            dy = event.ydata - self.start_y
-            self.move_shape(self.selected_shape, dx, dy)
-            self.start_x, self.start_y = event.xdata, event.ydata
-            self.update_selection_rectangle()
-            self.canvas.draw()
-        elif self.current_shape:
+        if self.band_start is not None:
+            x, y, _ = self.band_start
+            self.selection_outline.set_bounds(x, y, event.xdata - x, event.ydata - y)
+            self.blit_animated()
+        elif self.is_moving and self.selection:
+            # The offset from where the drag started is snapped, then applied as a step from the last one
+            x0, y0 = self.drag_origin
+            tx, ty = event.xdata - x0, event.ydata - y0
+            bx0, by0, bx1, by1 = self.drag_bounds
+            sx, sy = self.snap_box((bx0 + tx, by0 + ty, bx1 + tx, by1 + ty), self.dragged)
+            tx, ty = tx + sx, ty + sy
+            dx, dy = tx - self.drag_offset[0], ty - self.drag_offset[1]
+            self.drag_offset = (tx, ty)
+            if dx or dy:
+                self.move_shapes(self.selection, dx, dy)
+                self.history.record_move(self.selection, dx, dy)
+                outline = self.selection_outline
+                outline.set_xy((outline.get_x() + dx, outline.get_y() + dy))
+            if self.selection_renderer is not None:
+                # The batched part of the group is shifted on screen rather than rebuilt
+                self.selection_renderer.translate(tx, ty)
+            self.blit_animated()
+        elif self.stroke is not None:
+            self.stroke.add_point(event.xdata, event.ydata)
+            points = self.stroke.preview()
+            self.stroke_preview.set_data(points[:, 0], points[:, 1])
+            self.blit_animated()
+        elif self.current_shape is not None:
             if self.shape_var.get() in ['Ellipse', 'Cone', 'Upside-down Cone']:
-                width = abs(event.xdata - self.start_x)
-                height = abs(event.ydata - self.start_y)
-                self.current_shape.width = width
-                self.current_shape.height = height
-                self.current_shape.center = (self.start_x + width / 2, self.start_y)
+                end_x, end_y = self.snap_point(event.xdata, event.ydata, exclude=self.current_shape)
+                width = abs(end_x - self.start_x)
+                height = abs(end_y - self.start_y)
+                self.scene.set_values(self.current_shape, (self.start_x + width / 2, self.start_y, width, height))
             elif self.shape_var.get() == 'Rectangle':
-                width = event.xdata - self.start_x
-                height = event.ydata - self.start_y
-                self.current_shape.set_width(width)
-                self.current_shape.set_height(height)
+                end_x, end_y = self.snap_point(event.xdata, event.ydata, exclude=self.current_shape)
+                width = end_x - self.start_x
+                height = end_y - self.start_y
+                self.scene.set_values(self.current_shape, (self.start_x, self.start_y, width, height))
             elif self.shape_var.get() in ['Line', 'Arrow Line']:
-                self.current_shape.set_data([self.start_x, event.xdata], [self.start_y, event.ydata])
-            self.canvas.draw()
+                end_x, end_y = self.snap_point(event.xdata, event.ydata, exclude=self.current_shape, endpoints=True)
+                self.scene.set_values(self.current_shape, (self.start_x, self.start_y, end_x, end_y))
+            self.sync_artists(self.current_shape)
+            self.blit_animated()
 
     def on_release(self, event):
-        if self.current_shape and self.shape_var.get() in ['Cone', 'Upside-down Cone']:
-            width = abs(event.xdata - self.start_x)
-            height = abs(event.ydata - self.start_y)
+        if self.viewport.pan_start is not None:
+            self.viewport.end_pan()
+            return
+        if self.band_start is not None:
+            self.finish_band()
+        self.end_group_drag()
+        if self.stroke is not None:
+            self.current_shape = self.finish_stroke()
+
+        if self.current_shape is not None and self.shape_var.get() in ['Cone', 'Upside-down Cone']:
+            end_x, end_y = self.snap_point(event.xdata, event.ydata, exclude=self.current_shape)
+            width = abs(end_x - self.start_x)
+            height = abs(end_y - self.start_y)
 
             cx, cy = self.start_x + width / 2, self.start_y  # Center of the ellipse
 
@@ -159,350 +419,699 @@ class DrawToLatexApp:
             left_base = (cx - (width / 2) * np.cos(left_angle), cy - (height / 2) * np.sin(left_angle) if self.shape_var.get() == 'Upside-down Cone' else (height / 2) * np.sin(left_angle))
             right_base = (cx + (width / 2) * np.cos(right_angle), cy  - (height / 2) * np.sin(right_angle) if self.shape_var.get() == 'Upside-down Cone' else (height / 2) * np.sin(right_angle))
 
-            self.draw_cone(left_base, right_base, (cx, apex_y), self.color)
+            self.current_shape = self.draw_cone(self.current_shape, left_base, right_base, (cx, apex_y), self.color)
 
-        if self.current_shape and self.shape_var.get() == 'Arrow Line':
-            self.add_arrowhead(self.current_shape)
+        if self.current_shape is not None and self.shape_var.get() == 'Arrow Line':
+            self.current_shape = self.add_arrowhead(self.current_shape)
 
-        if self.current_shape and self.shape_var.get() != 'Select':
-            self.history.append(self.current_shape)
+        if self.current_shape is not None and self.shape_var.get() != 'Select':
+            self.history.push(AddCommand([self.current_shape]))
+            if self.current_shape != self.textbox:
+                self.release_artists(self.current_shape)
         self.current_shape = None
         self.is_moving = False
+        self.show_guides(None, None)
+        self.history.close()
+        self.checkpoint()
+        if self.textbox is not None:
+            # The new label stays animated while it is typed into, so keystrokes only blit its box
+            self.blit_animated()
+        else:
+            self.end_blit()
+
+    def on_scroll(self, event):
+        """Zoom in or out around the mouse pointer."""
+        if event.inaxes != self.ax:
+            return
+        self.viewport.zoom(event.xdata, event.ydata, event.step)
+        self.invalidate_background()
+        self.canvas.draw_idle()
+
+    def finish_stroke(self):
+        """Turn the pen stroke being drawn into a path shape and return its id."""
+        from freehand import fit_bezier
+        points = self.stroke.finish()
+        self.stroke = None
+        self.stroke_preview.remove()
+        self.stroke_preview = None
+        if len(points) < 2:
+            return None
+        vertices = fit_bezier(points) if self.smooth_strokes else points
+        sid = self.scene.add('path', (1 if self.smooth_strokes else 0,), self.color, vertices=vertices)
+        self.create_artists(sid)
+        return sid
+
+    def begin_blit(self, *artists):
+        """Mark artists as animated and cache the static background behind them."""
+        if not self.use_blit:
+            return
+        self.animated_artists = [artist for artist in artists if artist is not None]
+        for artist in self.animated_artists:
+            artist.set_animated(True)
+        self.capture_background()
+
+    def capture_background(self):
+        """Render everything except the animated artists and keep a copy of the pixels."""
+        self.capturing_background = True
+        try:
+            self.canvas.draw()
+        finally:
+            self.capturing_background = False
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    def blit_animated(self, bbox=None):
+        """Redraw only the animated artists on top of the cached background.
+
+        With bbox, only that region of the display is copied to the screen.
+        """
+        if not self.use_blit or not self.animated_artists:
+            self.canvas.draw()
+            return
+        if self.background is None:
+            self.capture_background()
+        self.canvas.restore_region(self.background)
+        for artist in self.animated_artists:
+            if artist.axes is not None:
+                self.ax.draw_artist(artist)
+        if self.overlay is not None:
+            self.fig.draw_artist(self.overlay)
+        self.canvas.blit(self.fig.bbox if bbox is None else bbox)
+
+    def end_blit(self):
+        """Return the animated artists to normal rendering and do one full redraw."""
+        for artist in self.animated_artists:
+            artist.set_animated(False)
+        self.animated_artists = []
+        self.background = None
         self.canvas.draw()
 
-    def draw_cone(self, left_base, right_base, apex, color):
-        line_left = Line2D([left_base[0], apex[0]], [left_base[1], apex[1]], color=color, linewidth=self.linewidth)
-        line_right = Line2D([right_base[0], apex[0]], [right_base[1], apex[1]], color=color, linewidth=self.linewidth)
-        self.ax.add_line(line_left)
-        self.ax.add_line(line_right)
-        self.history.append(line_left)
-        self.history.append(line_right)
+    def invalidate_background(self, event=None):
+        """Drop the cached background, e.g. after the window has been resized."""
+        self.background = None
+
+    def create_artists(self, sid):
+        """Create the matplotlib artists that display a scene shape."""
+        kind = self.scene.kind(sid)
+        color = self.scene.color(sid)
+        if kind in ('line', 'arrow'):
+            artists = [Line2D([0, 0], [0, 0], color=color, linewidth=self.linewidth)]
+            if kind == 'arrow':
+                artists.append(Polygon([(0, 0), (0, 0), (0, 0)], closed=True, color=color))
+        elif kind == 'ellipse':
+            artists = [Ellipse((0, 0), 0, 0, edgecolor=color, facecolor='none', linewidth=self.linewidth)]
+        elif kind == 'rectangle':
+            artists = [Rectangle((0, 0), 0, 0, edgecolor=color, facecolor='none', linewidth=self.linewidth)]
+        elif kind == 'polygon':
+            artists = [Polygon(self.scene.shape_vertices(sid), closed=True, color=color)]
+        elif kind == 'path':
+            if self.scene.values(sid)[2]:
+                artists = [PathPatch(Path([(0, 0)]), edgecolor=color, facecolor='none', linewidth=self.linewidth)]
+            else:
+                artists = [Line2D([], [], color=color, linewidth=self.linewidth)]
+        elif kind == 'text':
+            x, y = self.scene.values(sid)
+            artists = [self.ax.text(x, y, self.scene.text(sid), color=color, fontsize=self.text_extents.fontsize,
+                                    bbox=dict(facecolor='white', edgecolor='none', boxstyle='round,pad=0.5'))]
+        elif kind == 'cone':
+            artists = [Ellipse((0, 0), 0, 0, edgecolor=color, facecolor='none', linewidth=self.linewidth),
+                       Line2D([0, 0], [0, 0], color=color, linewidth=self.linewidth),
+                       Line2D([0, 0], [0, 0], color=color, linewidth=self.linewidth)]
+        for artist in artists:
+            if isinstance(artist, Line2D):
+                self.ax.add_line(artist)
+            elif kind != 'text':
+                self.ax.add_patch(artist)
+        self.views[sid] = artists
+        if self.renderer is not None:
+            self.renderer.exclude(sid)
+        self.sync_artists(sid)
+        return artists
+
+    def release_artists(self, sid):
+        """Hand a finished shape over to the batch renderer and drop its own artists."""
+        if self.renderer is None or sid not in self.views or not self.renderer.accepts(sid):
+            return
+        for artist in self.views.pop(sid):
+            artist.remove()
+        self.renderer.include(sid)
+
+    def sync_artists(self, sid):
+        """Copy a shape's geometry from the scene model onto its artists."""
+        artists = self.views.get(sid)
+        if artists is None:
+            # Batched shapes are redrawn from the scene on the next draw
+            return
+        kind = self.scene.kind(sid)
+        v = self.scene.values(sid)
+        if kind == 'line':
+            artists[0].set_data([v[0], v[2]], [v[1], v[3]])
+        elif kind == 'arrow':
+            end, head = arrow_parts(*v)
+            if end is None:
+                artists[0].set_data([v[0], v[2]], [v[1], v[3]])
+                artists[1].set_visible(False)
+            else:
+                artists[0].set_data([v[0], end[0]], [v[1], end[1]])
+                artists[1].set_xy(head)
+                artists[1].set_visible(True)
+        elif kind in ('ellipse', 'cone'):
+            artists[0].center = (v[0], v[1])
+            artists[0].width = v[2]
+            artists[0].height = v[3]
+            if kind == 'cone':
+                artists[1].set_data([v[4], v[8]], [v[5], v[9]])
+                artists[2].set_data([v[6], v[8]], [v[7], v[9]])
+        elif kind == 'rectangle':
+            artists[0].set_bounds(*v)
+        elif kind == 'polygon':
+            artists[0].set_xy(self.scene.shape_vertices(sid))
+        elif kind == 'path':
+            vertices = self.scene.shape_vertices(sid)
+            if isinstance(artists[0], PathPatch):
+                codes = [Path.MOVETO] + [Path.CURVE4] * (len(vertices) - 1)
+                artists[0].set_path(Path(vertices.copy(), codes))
+            else:
+                artists[0].set_data(vertices[:, 0], vertices[:, 1])
+        elif kind == 'text':
+            artists[0].set_position((v[0], v[1]))
+            artists[0].set_text(self.scene.text(sid))
+            # Labels are only measured once hit tested, but text_at must know how far they can reach
+            self.text_extents.expect(self.scene.text(sid))
+
+    def delete_shape(self, sid):
+        """Remove a shape from the scene along with its artists."""
+        self.scene.remove(sid)
+        for artist in self.views.pop(sid, []):
+            artist.remove()
+        if self.renderer is not None:
+            self.renderer.include(sid)
+
+    def show_loaded_shapes(self):
+        """Create artists for a scene loaded from disk.
+
+        Batched shapes need none, so only text and smooth paths get their own. The view is
+        zoomed out to fit the drawing, and the grid index is filled once the window is idle
+        rather than before it first appears.
+        """
+        ids = self.scene.ids(('text', 'path')) if self.renderer is not None else self.scene.ids()
+        for sid in ids.tolist():
+            if self.renderer is None or not self.renderer.accepts(sid):
+                self.create_artists(sid)
+        self.viewport.fit(self.scene.index.extent)
+        if self.root is not None:
+            self.root.after_idle(self.scene.index.build)
+
+    def checkpoint(self):
+        """Flush the journal at the end of an edit so a crash loses at most the edit in progress."""
+        if self.store is not None:
+            self.store.checkpoint()
+
+    def restore_shape(self, record, sid):
+        """Put a shape recorded with scene.record back under its old id."""
+        self.scene.add_record(record, sid=sid)
+        self.create_artists(sid)
+        self.release_artists(sid)
+
+    def draw_cone(self, ellipse, left_base, right_base, apex, color):
+        """Turn the placeholder ellipse into a cone with sides running to the apex."""
+        cx, cy, width, height = self.scene.values(ellipse)
+        self.delete_shape(ellipse)
+        sid = self.scene.add('cone', (cx, cy, width, height, left_base[0], left_base[1],
+                                      right_base[0], right_base[1], apex[0], apex[1]), color)
+        self.create_artists(sid)
+        return sid
+
+    def on_key_press(self, event):
+        """Scale (+/-) or rotate (r/R) the selection in Select mode, otherwise type into the text box."""
+        if self.shape_var.get() == 'Select' and self.selection and not self.is_moving:
+            if event.keysym in ('plus', 'equal'):
+                self.scale_selection(self.scale_step)
+            elif event.keysym == 'minus':
+                self.scale_selection(1 / self.scale_step)
+            elif event.keysym == 'r':
+                self.rotate_selection(self.rotate_step)
+            elif event.keysym == 'R':
+                self.rotate_selection(-self.rotate_step)
+            return
+        self.on_text_key_press(event)
 
     def on_text_key_press(self, event):
-        """Handle key press events for text input."""
-        if self.shape_var.get() == 'Text' and self.textbox:
-            if event.keysym == 'Return':
-                self.textbox = None
-            elif event.keysym == 'BackSpace':
-                self.textbox.set_text(self.textbox.get_text()[:-1])
-            else:
-                self.textbox.set_text(self.textbox.get_text() + event.char)
-            self.canvas.draw()
+        """Type into the text box, redrawing only the region its label covers."""
+        if self.shape_var.get() != 'Text' or self.textbox is None:
+            return
+        if event.keysym == 'Return':
+            self.finish_text_entry()
+            self.checkpoint()
+            return
+        old_text = self.scene.text(self.textbox)
+        text = old_text[:-1] if event.keysym == 'BackSpace' else old_text + event.char
+        if text == old_text:
+            return
+        before = self.text_display_box(self.textbox)
+        self.scene.set_text(self.textbox, text)
+        self.sync_artists(self.textbox)
+        if not self.animated_artists:
+            self.begin_blit(*self.views[self.textbox])
+        # Off-screen labels give no intersection, and fall back to blitting everything
+        self.blit_animated(Bbox.intersection(Bbox.union([before, self.text_display_box(self.textbox)]), self.fig.bbox))
+
+    def finish_text_entry(self):
+        """Stop typing into the text box and draw its label as part of the scene again."""
+        if self.textbox is None:
+            return
+        if self.textbox in self.scene:
+            self.release_artists(self.textbox)
+        self.textbox = None
+        if self.animated_artists:
+            self.end_blit()
 
     def undo_last_action(self, event=None):
         """Undo the last action performed."""
-        if self.history:
-            shape = self.history.pop()
-            shape.remove()
+        self.finish_editing()
+        if self.history.undo(self):
+            self.checkpoint()
+            self.canvas.draw()
+
+    def redo_last_action(self, event=None):
+        """Redo the last undone action."""
+        self.finish_editing()
+        if self.history.redo(self):
+            self.checkpoint()
             self.canvas.draw()
 
+    def finish_editing(self):
+        """End any selection or text entry before the history changes the scene under it."""
+        self.clear_selection()
+        self.finish_text_entry()
+
+    def select_at(self, event):
+        """Handle a click in Select mode.
+
+        A click on a shape selects it and starts dragging the selection; a click on a
+        selected shape drags the whole group. Shift-click adds or removes a shape, and
+        dragging from empty space selects the shapes inside the rubber band.
+        """
+        sid = self.shape_at(event)
+        toggle = 'shift' in (event.key or '')
+        if sid is None:
+            if not toggle:
+                self.set_selection([])
+            self.start_band(event, toggle)
+        elif toggle:
+            if sid in self.selection:
+                self.set_selection([other for other in self.selection if other != sid])
+            else:
+                self.set_selection(self.selection + [sid])
+            self.canvas.draw_idle()
+        else:
+            if sid not in self.selection:
+                self.set_selection([sid])
+            self.start_group_drag(event)
+
     def select_shape(self, event):
-        """Select a shape under the mouse pointer."""
-        self.selected_shape = None
-        min_distance = float('inf')
-        click_point = (event.xdata, event.ydata)
-
-        for shape in self.ax.patches + self.ax.lines + self.ax.texts + self.arrowheads:
-            if isinstance(shape, Ellipse):
-                distance = self.point_to_ellipse_distance(click_point, shape)
-            elif isinstance(shape, Rectangle):
-                distance = self.point_to_rectangle_distance(click_point, shape)
-            elif isinstance(shape, Line2D):
-                distance = self.point_to_line_distance(click_point, shape)
-            elif isinstance(shape, Polygon):
-                distance = self.point_to_polygon_distance(click_point, shape)
-            elif isinstance(shape, Text):
-                distance = self.point_to_text_distance(click_point, shape)
-            if distance < min_distance:
-                min_distance = distance
-                self.selected_shape = shape
-
-        if isinstance(self.selected_shape, (Ellipse, Rectangle, Line2D, Polygon)):
-            self.start_x, self.start_y = event.xdata, event.ydata
-            self.is_moving = True
-        elif isinstance(self.selected_shape, Text):
-            bbox = self.selected_shape.get_window_extent(self.canvas.get_renderer())
-            if bbox.contains(event.x, event.y):
-                self.start_x, self.start_y = event.xdata, event.ydata
-                self.is_moving = True
+        """Select only the shape under the mouse pointer, if any, and return it."""
+        sid = self.shape_at(event)
+        self.set_selection([] if sid is None else [sid])
+        return sid
+
+    def shape_at(self, event):
+        """Return the label whose box contains the mouse pointer, else the nearest shape within hit_pixels."""
+        sid = self.text_at(event.xdata, event.ydata)
+        if sid is None:
+            sid, _ = self.scene.shapes_within(event.xdata, event.ydata, self.data_distance(self.hit_pixels))
+        return sid
+
+    def text_at(self, x, y):
+        """Return the label whose box contains (x, y), the newest if several overlap, using cached extents."""
+        _, scale = view_box(self.ax)
+        reach = self.text_extents.reach * self.fig.dpi / 72 / scale
+        found = None
+        for sid in self.scene.index.query(x, y, reach):
+            if self.scene.kind(sid) != 'text' or sid in self.viewport.hidden or (found is not None and sid < found):
+                continue
+            x0, y0, x1, y1 = self.text_box(sid)
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                found = sid
+        return found
+
+    def text_box(self, sid):
+        """Return the box (x0, y0, x1, y1) a label covers in data coordinates at the current zoom."""
+        x, y = self.scene.values(sid)
+        _, scale = view_box(self.ax)
+        points = self.fig.dpi / 72 / scale
+        x0, y0, x1, y1 = self.text_extents.box(self.scene.text(sid))
+        return (x + x0 * points, y + y0 * points, x + x1 * points, y + y1 * points)
+
+    def text_display_box(self, sid):
+        """Return the display Bbox a label covers, with a pixel of slack for antialiasing."""
+        x, y = self.ax.transData.transform(self.scene.values(sid))
+        points = self.fig.dpi / 72
+        x0, y0, x1, y1 = self.text_extents.box(self.scene.text(sid))
+        return Bbox.from_extents(x + x0 * points - 2, y + y0 * points - 2, x + x1 * points + 2, y + y1 * points + 2)
+
+    def set_selection(self, ids):
+        self.selection = list(ids)
+        self.update_selection_outline()
+
+    def clear_selection(self):
+        """Deselect everything."""
+        self.end_group_drag()
+        self.band_start = None
+        self.is_moving = False
+        if self.selection or self.selection_outline.get_visible():
+            self.set_selection([])
+            self.canvas.draw_idle()
+
+    def start_band(self, event, add):
+        """Start dragging out a rubber band; with add, the shapes in it join the selection."""
+        self.band_start = (event.xdata, event.ydata, add)
+        self.selection_outline.set_bounds(event.xdata, event.ydata, 0, 0)
+        self.selection_outline.set_visible(True)
+        self.begin_blit(self.selection_outline)
+
+    def finish_band(self):
+        """Select the shapes lying entirely inside the rubber band."""
+        _, _, add = self.band_start
+        self.band_start = None
+        outline = self.selection_outline
+        x, y = outline.get_x(), outline.get_y()
+        found = sorted(self.scene.index.query_box(x, y, x + outline.get_width(), y + outline.get_height()))
+        if add:
+            chosen = set(self.selection)
+            found = self.selection + [sid for sid in found if sid not in chosen]
+        self.set_selection(found)
+
+    def start_group_drag(self, event):
+        """Animate the selection while it is dragged.
+
+        Batched shapes move from the main renderer to the selection renderer, so the group is
+        redrawn as a few collections on every motion event rather than one artist per shape.
+        """
+        self.start_x, self.start_y = event.xdata, event.ydata
+        self.drag_origin = (event.xdata, event.ydata)
+        self.drag_bounds = self.selection_bounds()
+        self.drag_offset = (0.0, 0.0)
+        # The group never aligns with its own guides
+        self.dragged = set(self.selection)
+        self.is_moving = True
+        artists = [self.selection_outline, *self.guide_lines]
+        batched = []
+        for sid in self.selection:
+            if sid in self.views:
+                artists.extend(self.views[sid])
+            else:
+                batched.append(sid)
+                self.renderer.exclude(sid)
+        if batched:
+            self.selection_renderer.set_subset(batched)
+            self.selection_renderer.refresh()
+            artists.extend(self.selection_renderer.collections())
+        self.begin_blit(*artists)
+
+    def end_group_drag(self):
+        """Hand the dragged shapes back to the main renderer."""
+        if self.selection_renderer is None or not self.selection_renderer.subset:
+            return
+        for sid in self.selection_renderer.subset:
+            self.renderer.include(sid)
+        self.selection_renderer.set_subset(())
+
+    def add_selection_outline(self):
+        """Create the outline that marks the selection, hidden while nothing is selected."""
+        outline = Rectangle((0, 0), 0, 0, edgecolor='blue', facecolor='none', linewidth=1, visible=False)
+        self.ax.add_patch(outline)
+        return outline
+
+    def add_guide_lines(self):
+        """Create the vertical and horizontal guide lines, hidden until something snaps to a guide."""
+        lines = (Line2D([0, 0], [0, 1], transform=self.ax.get_xaxis_transform()),
+                 Line2D([0, 1], [0, 0], transform=self.ax.get_yaxis_transform()))
+        for line in lines:
+            line.set(color='magenta', linewidth=0.8, linestyle='--', visible=False)
+            self.ax.add_line(line)
+        return lines
+
+    def show_guides(self, x, y):
+        """Show the guide lines at x and y; None hides a line."""
+        vertical, horizontal = self.guide_lines
+        vertical.set_visible(x is not None)
+        if x is not None:
+            vertical.set_xdata([x, x])
+        horizontal.set_visible(y is not None)
+        if y is not None:
+            horizontal.set_ydata([y, y])
+
+    def data_distance(self, pixels):
+        """Convert a distance on screen to data units at the current zoom."""
+        _, scale = view_box(self.ax)
+        return pixels / scale
+
+    def snap_box(self, box, exclude=()):
+        """Return the shift (dx, dy) that lines box up with a guide or, failing that, the grid."""
+        dx = dy = 0.0
+        guide_x = guide_y = None
+        if self.guides_var.get():
+            dx, dy, guide_x, guide_y = self.guides.align(box, self.data_distance(self.guide_pixels), exclude)
+        if self.grid_var.get():
+            if guide_x is None:
+                dx = snap_to_grid(box[0], self.grid_spacing) - box[0]
+            if guide_y is None:
+                dy = snap_to_grid(box[1], self.grid_spacing) - box[1]
+        self.show_guides(guide_x, guide_y)
+        return dx, dy
+
+    def snap_point(self, x, y, exclude=None, endpoints=False):
+        """Snap a point being drawn to guides or the grid.
+
+        With endpoints, a nearby ellipse outline or rectangle corner takes precedence.
+        """
+        if endpoints and self.snap_enabled:
+            self.snapper.threshold = self.data_distance(self.snap_pixels)
+            snapped = self.snapper.snap(x, y, exclude=exclude)
+            if snapped != (x, y):
+                self.show_guides(None, None)
+                return snapped
+        dx, dy = self.snap_box((x, y, x, y), () if exclude is None else (exclude,))
+        return x + dx, y + dy
+
+    def selection_bounds(self):
+        """Return the box (x0, y0, x1, y1) around the selection in data coordinates, text included."""
+        boxes = [self.scene.table_bounds(kind, rows) for kind, rows in self.scene.group_rows(self.selection).items()]
+        boxes.extend([self.text_box(sid)] for sid in self.selection if self.scene.kind(sid) == 'text')
+        boxes = np.vstack(boxes)
+        return (*boxes[:, :2].min(axis=0), *boxes[:, 2:].max(axis=0))
+
+    def update_selection_outline(self):
+        """Fit the outline around the selection, in place."""
+        if not self.selection:
+            self.selection_outline.set_visible(False)
+            return
+        x0, y0, x1, y1 = self.selection_bounds()
+        self.selection_outline.set_bounds(x0, y0, x1 - x0, y1 - y0)
+        self.selection_outline.set_visible(True)
 
     def erase_shape(self, event):
         """Erase a shape under the mouse pointer."""
-        min_distance = float('inf')
-        shape_to_erase = None
-        click_point = (event.xdata, event.ydata)
-
-        for shape in self.ax.patches + self.ax.lines + self.ax.texts + self.arrowheads:
-            if isinstance(shape, Ellipse):
-                distance = self.point_to_ellipse_distance(click_point, shape)
-            elif isinstance(shape, Rectangle):
-                distance = self.point_to_rectangle_distance(click_point, shape)
-            elif isinstance(shape, Line2D):
-                distance = self.point_to_line_distance(click_point, shape)
-            elif isinstance(shape, Polygon):
-                distance = self.point_to_polygon_distance(click_point, shape)
-            elif isinstance(shape, Text):
-                distance = self.point_to_text_distance(click_point, shape)
-            if distance < min_distance and distance < 0.2:
-                min_distance = distance
-                shape_to_erase = shape
-        if shape_to_erase:
-            shape_to_erase.remove()
-            if shape_to_erase in self.arrowheads:
-                self.arrowheads.remove(shape_to_erase)
+        shape_to_erase = self.shape_at(event)
+        if shape_to_erase is not None:
+            self.history.execute(DeleteCommand(self.scene, [shape_to_erase]), self)
+            self.checkpoint()
             self.canvas.draw()
 
-    def deselect_shape(self):
-        """Deselect the currently selected shape."""
-        self.selected_shape = None
-        self.is_moving = False
-        if self.selection_rectangle and self.selection_rectangle in self.ax.patches:
-            self.selection_rectangle.remove()
-            self.selection_rectangle = None
+    def move_shape(self, sid, dx, dy):
+        """Move a shape by a given delta in x and y directions."""
+        self.move_shapes([sid], dx, dy)
+
+    def move_shapes(self, ids, dx, dy):
+        """Move several shapes by the same delta."""
+        self.scene.move(ids, dx, dy)
+        for sid in ids:
+            self.sync_artists(sid)
+
+    def transform_shapes(self, ids, matrix):
+        """Apply an affine matrix to several shapes at once.
+
+        Returns the ids of the transformed shapes, which include any split off when a rotation
+        turned them into paths.
+        """
+        kinds = {sid: self.scene.kind(sid) for sid in ids}
+        ids = self.scene.transform(ids, matrix)
+        for sid in ids:
+            if kinds.get(sid) == self.scene.kind(sid):
+                self.sync_artists(sid)
+                continue
+            # Traced outlines need artists of the new kind, or go to the batch renderer
+            for artist in self.views.pop(sid, []):
+                artist.remove()
+            self.create_artists(sid)
+            self.release_artists(sid)
+        return ids
+
+    def transform_selection(self, linear):
+        """Apply a 2x2 linear map about the center of the selection as one undoable step."""
+        x0, y0, x1, y1 = self.selection_bounds()
+        center = np.array([(x0 + x1) / 2, (y0 + y1) / 2])
+        linear = np.asarray(linear, dtype=float)
+        matrix = np.column_stack([linear, center - linear @ center])
+        command = TransformCommand(self.scene, self.selection, matrix)
+        self.history.execute(command, self)
+        self.checkpoint()
+        self.set_selection(command.ids + command.created)
         self.canvas.draw_idle()
 
-    def point_to_ellipse_distance(self, point, ellipse):
-        """Calculate the distance from a point to the edge of an ellipse."""
-        px, py = point
-        cx, cy = ellipse.center
-        rx, ry = ellipse.width / 2, ellipse.height / 2
-        return np.sqrt((px - cx) ** 2 / rx ** 2 + (py - cy) ** 2 / ry ** 2)
-
-    def point_to_rectangle_distance(self, point, rect):
-        """Calculate the distance from a point to the edge of a rectangle."""
-        px, py = point
-        x0, y0 = rect.xy
-        x1, y1 = x0 + rect.get_width(), y0
-        x2, y2 = x1, y0 + rect.get_height()
-        x3, y3 = x0, y2
-        return min(abs(px - x0), abs(px - x1), abs(py - y0), abs(py - y1))
-
-    def point_to_line_distance(self, point, line):
-        """Calculate the distance from a point to a line."""
-        px, py = point
-        x0, y0 = line.get_data()[0][0], line.get_data()[1][0]
-        x1, y1 = line.get_data()[0][1], line.get_data()[1][1]
-        return np.abs(np.cross([x1 - x0, y1 - y0], [x0 - px, y0 - py]) / np.linalg.norm([x1 - x0, y1 - y0]))
-
-    def point_to_polygon_distance(self, point, polygon):
-        """Calculate the distance from a point to a polygon."""
-        poly_points = polygon.get_xy()
-        min_distance = float('inf')
-        for p1, p2 in zip(poly_points, poly_points[1:] + [poly_points[0]]):
-            line_vec = np.array(p2) - np.array(p1)
-            point_vec = np.array(point) - np.array(p1)
-            proj = np.dot(point_vec, line_vec) / np.dot(line_vec, line_vec)
-            if proj < 0:
-                closest_point = np.array(p1)
-            elif proj > 1:
-                closest_point = np.array(p2)
-            else:
-                closest_point = np.array(p1) + proj * line_vec
-            distance = np.linalg.norm(point - closest_point)
-            if distance < min_distance:
-                min_distance = distance
-        return min_distance
-
-    def point_to_text_distance(self, point, text):
-        """Calculate the distance from a point to a text object."""
-        tx, ty = text.get_position()
-        return ((point[0] - tx) ** 2 + (point[1] - ty) ** 2) ** 0.5
-
-    def move_shape(self, shape, dx, dy):
-        """Move a shape by a given delta in x and y directions."""
-        if isinstance(shape, Ellipse):
-            shape.center = (shape.center[0] + dx, shape.center[1] + dy)
-        elif isinstance(shape, Rectangle):
-            shape.set_xy((shape.xy[0] + dx, shape.xy[1] + dy))
-        elif isinstance(shape, Line2D):
-            x_data, y_data = shape.get_data()
-            shape.set_data([x_data[0] + dx, x_data[1] + dx], [y_data[0] + dy, y_data[1] + dy])
-        elif isinstance(shape, Polygon):
-            shape.set_xy([(x + dx, y + dy) for x, y in shape.get_xy()])
-        elif isinstance(shape, Text):
-            tx, ty = shape.get_position()
-            shape.set_position((tx + dx, ty + dy))
+    def scale_selection(self, factor):
+        self.transform_selection([[factor, 0], [0, factor]])
+
+    def rotate_selection(self, degrees):
+        """Rotate the selection counterclockwise by degrees."""
+        c, s = np.cos(np.radians(degrees)), np.sin(np.radians(degrees))
+        self.transform_selection([[c, -s], [s, c]])
 
     def change_selected_shape_color(self, color):
-        """Change the color of the selected shape."""
-        if isinstance(self.selected_shape, (Ellipse, Rectangle)):
-            self.selected_shape.set_edgecolor(color)
-        elif isinstance(self.selected_shape, Line2D):
-            self.selected_shape.set_color(color)
-        elif isinstance(self.selected_shape, Polygon):
-            self.selected_shape.set_color(color)
-        elif isinstance(self.selected_shape, Text):
-            self.selected_shape.set_color(color)
+        """Give every selected shape the color, as one undoable step."""
+        if not self.selection:
+            return
+        self.history.execute(RecolorCommand(self.scene, self.selection, color), self)
+        self.checkpoint()
+        self.canvas.draw_idle()
+
+    def recolor_shapes(self, ids, colors):
+        """Give each shape its color, updating the artists of those that have their own."""
+        self.scene.set_colors(ids, colors)
+        for sid, color in zip(ids, colors):
+            for artist in self.views.get(sid, []):
+                if isinstance(artist, (Ellipse, Rectangle, PathPatch)):
+                    artist.set_edgecolor(color)
+                else:
+                    artist.set_color(color)
 
     def snap_to_closest(self, line, event):
         """Snap the end of the line to the closest point on an ellipse or rectangle."""
-        snap_threshold = 0.2  # Adjust snapping sensitivity
-        closest_point = (event.xdata, event.ydata)
-        min_distance = float('inf')
-
-        # Check snapping to ellipses and rectangles
-        for shape in self.ax.patches:
-            if isinstance(shape, Ellipse):
-                points = self.get_ellipse_points(shape)
-            elif isinstance(shape, Rectangle):
-                points = self.get_rectangle_points(shape)
-            else:
-                continue
-
-            for point in points:
-                distance = ((event.xdata - point[0]) ** 2 + (event.ydata - point[1]) ** 2) ** 0.5
-                if distance < min_distance and distance < snap_threshold:
-                    min_distance = distance
-                    closest_point = point
-
-        # Update line to snap to the closest point
-        x_data, y_data = line.get_data()
-        if min_distance < snap_threshold:
-            x_data[1], y_data[1] = closest_point
-
-        line.set_data(x_data, y_data)
+        values = self.scene.values(line)
+        self.snapper.threshold = self.data_distance(self.snap_pixels)
+        values[2], values[3] = self.snapper.snap(event.xdata, event.ydata, exclude=line)
+        self.scene.set_values(line, values)
+        self.sync_artists(line)
         self.canvas.draw()
 
-    def get_ellipse_points(self, ellipse, num_points=100):
-        """Get points around the perimeter of an ellipse."""
-        angles = np.linspace(0, 2 * np.pi, num_points)
-        center_x, center_y = ellipse.center
-        width, height = ellipse.width / 2, ellipse.height / 2
-        points = [(center_x + width * np.cos(a), center_y + height * np.sin(a)) for a in angles]
-        return points
-
-    def get_rectangle_points(self, rect):
-        """Get the corner points of a rectangle."""
-        x0, y0 = rect.xy
-        x1, y1 = x0 + rect.get_width(), y0
-        x2, y2 = x1, y0 + rect.get_height()
-        x3, y3 = x0, y2
-        return [(x0, y0), (x1, y1), (x2, y2), (x3, y3)]
-
-    def draw_selection_rectangle(self):
-        """Draw a selection rectangle around the selected shape."""
-        if self.selection_rectangle and self.selection_rectangle in self.ax.patches:
-            self.selection_rectangle.remove()
-        if isinstance(self.selected_shape, Text):
-            bbox = self.selected_shape.get_window_extent(self.canvas.get_renderer())
-            self.selection_rectangle = Rectangle((bbox.x0, bbox.y0), bbox.width, bbox.height,
-                                                 transform=None, edgecolor='blue', facecolor='none', linewidth=1)
-        elif isinstance(self.selected_shape, Line2D):
-            x_data, y_data = self.selected_shape.get_data()
-            x_min, x_max = min(x_data), max(x_data)
-            y_min, y_max = min(y_data), max(y_data)
-            self.selection_rectangle = Rectangle((x_min, y_min), x_max - x_min, y_max - y_min,
-                                                 edgecolor='blue', facecolor='none', linewidth=1)
-        else:
-            bbox = self.selected_shape.get_extents()
-            self.selection_rectangle = Rectangle((bbox.x0, bbox.y0), bbox.width, bbox.height,
-                                                 transform=None, edgecolor='blue', facecolor='none', linewidth=1)
-        self.ax.add_patch(self.selection_rectangle)
-        self.canvas.draw_idle()
-
-    def update_selection_rectangle(self):
-        """Update the position of the selection rectangle."""
-        if self.selection_rectangle and self.selection_rectangle in self.ax.patches:
-            self.selection_rectangle.remove()
-        self.draw_selection_rectangle()
-
     def clear_canvas(self):
         """Clear the canvas of all shapes."""
+        if len(self.scene):
+            self.history.execute(ClearCommand(self.scene, self.scene.ids()), self)
+            self.checkpoint()
+        else:
+            self.clear_shapes()
+
+    def clear_shapes(self):
+        """Drop every shape and artist at once instead of deleting shapes one by one."""
+        xlim, ylim = self.ax.get_xlim(), self.ax.get_ylim()
         self.ax.clear()
-        self.ax.set_xlim(0, 10)
-        self.ax.set_ylim(0, 10)
-        self.ax.axis('off')
-        self.arrowheads.clear()
+        self.setup_axes()
+        # Keep the current view rather than jumping back to the initial one
+        self.ax.set_xlim(xlim)
+        self.ax.set_ylim(ylim)
+        self.scene.clear()
+        self.views.clear()
+        if self.renderer is not None:
+            self.renderer = BatchRenderer(self.ax, self.scene, self.linewidth)
+        self.viewport = Viewport(self)
+        if self.selection_renderer is not None:
+            self.selection_renderer = BatchRenderer(self.ax, self.scene, self.linewidth, subset=())
+        self.selection = []
+        self.selection_outline = self.add_selection_outline()
+        self.guide_lines = self.add_guide_lines()
+        self.band_start = None
+        self.textbox = None
+        self.stroke = None
+        self.stroke_preview = None
+        self.animated_artists = []
+        self.invalidate_background()
         self.canvas.draw()
 
     def add_arrowhead(self, line):
-        """Add a solid triangle arrowhead to the end of a line, facing backwards."""
-        x_data, y_data = line.get_data()
-        dx = x_data[-1] - x_data[-2]
-        dy = y_data[-1] - y_data[-2]
-        angle = np.arctan2(dy, dx)
-        arrow_length = 0.2
-        arrow_width = 0.1
-
-        if np.linalg.norm([dx, dy]) > arrow_length:
-            # Calculate the new end point of the line
-            end_x = x_data[-1] - arrow_length * np.cos(angle)
-            end_y = y_data[-1] - arrow_length * np.sin(angle)
-
-            # Define the vertices of the backward-facing solid triangle
-            left_vertex = (x_data[-1] - arrow_length * np.cos(angle) - arrow_width * np.sin(angle), 
-                           y_data[-1] - arrow_length * np.sin(angle) + arrow_width * np.cos(angle))
-            right_vertex = (x_data[-1] - arrow_length * np.cos(angle) + arrow_width * np.sin(angle), 
-                            y_data[-1] - arrow_length * np.sin(angle) - arrow_width * np.cos(angle))
-            tip_vertex = (x_data[-1], y_data[-1])
-            vertices = [left_vertex, right_vertex, tip_vertex]
-
-            # Create the solid triangle arrowhead
-            arrowhead = Polygon(vertices, closed=True, color=line.get_color())
-
-            self.ax.add_patch(arrowhead)
-            self.arrowheads.append(arrowhead)
-
-            # Update the line data
-            x_data[-1], y_data[-1] = end_x, end_y
-            line.set_data(x_data, y_data)
-            self.canvas.draw()
-
-    def complete_cone(self, ellipse, cone_type):
-        """Complete the drawing of a cone or upside-down cone."""
-        cx, cy = ellipse.center
-        width = ellipse.width / 2
-        height = ellipse.height / 2
-
-        # Increase the distance of the apex for more dramatic effect
-        if cone_type == 'Cone':
-            apex_y = cy + 2 * height  # Adjust this factor to change the height of the cone
-        else:
-            apex_y = cy - 2 * height  # Adjust for the upside-down cone
-
-        apex = (cx, apex_y)
-        left_base = (cx - width, cy)
-        right_base = (cx + width, cy)
-
-        # Draw the lines to form the cone
-        line_left = Line2D([left_base[0], apex[0]], [left_base[1], apex[1]], color=ellipse.get_edgecolor(), linewidth=self.linewidth)
-        line_right = Line2D([right_base[0], apex[0]], [right_base[1], apex[1]], color=ellipse.get_edgecolor(), linewidth=self.linewidth)
-
-        self.ax.add_line(line_left)
-        self.ax.add_line(line_right)
-        self.history.append(line_left)
-        self.history.append(line_right)
-        self.canvas.draw()
+        """Turn a finished line into an arrow with a solid triangle head at its end."""
+        values = self.scene.values(line)
+        self.delete_shape(line)
+        sid = self.scene.add('arrow', values, self.color)
+        self.create_artists(sid)
+        return sid
 
     def generate_latex(self):
-        """Generate LaTeX code for the drawn shapes."""
-        latex_code = "\\begin{tikzpicture}\n"
-        for shape in self.ax.patches:
-            color = shape.get_edgecolor() if isinstance(shape, (Ellipse, Rectangle)) else shape.get_facecolor()
-            color_name = self.color_var.get()
-            if isinstance(shape, Ellipse):
-                latex_code += f"\\draw [color={color_name}] ({shape.center[0]}, {shape.center[1]}) ellipse ({shape.width / 2} and {shape.height / 2});\n"
-            elif isinstance(shape, Rectangle):
-                latex_code += f"\\draw [color={color_name}] ({shape.xy[0]}, {shape.xy[1]}) rectangle ({shape.xy[0] + shape.get_width()}, {shape.xy[1] + shape.get_height()});\n"
-            elif isinstance(shape, Polygon):
-                vertices = shape.get_xy()
-                latex_code += f"\\fill [color={color_name}] "
-                latex_code += " -- ".join([f"({x}, {y})" for x, y in vertices])
-                latex_code += " -- cycle;\n"
-        for line in self.ax.lines:
-            x_data, y_data = line.get_data()
-            color_name = self.color_var.get()
-            if isinstance(line, Line2D):
-                if line in self.arrowheads:
-                    latex_code += f"\\draw [->,color={color_name}] ({x_data[0]}, {y_data[0]}) -- ({x_data[1]}, {y_data[1]});\n"
-                else:
-                    latex_code += f"\\draw [color={color_name}] ({x_data[0]}, {y_data[0]}) -- ({x_data[1]}, {y_data[1]});\n"
-        for text in self.ax.texts:
-            color_name = self.color_var.get()
-            latex_code += f"\\node at ({text.get_position()[0]}, {text.get_position()[1]}) [{color_name}] {{{text.get_text()}}};\n"
-        latex_code += "\\end{tikzpicture}"
-
-        self.show_latex_code(latex_code)
+        """Generate LaTeX code for the drawn shapes on a worker thread, over a snapshot of the scene."""
+        if self.latex_window is not None:
+            # Closing the previous window also cancels an export still running for it
+            self.latex_window.close()
+        from export_job import ExportJob
+        # The snapshot shares the exporter's cache, so unchanged shapes are not formatted again
+        self.export_job = ExportJob(self.scene.snapshot(), self.exporter.cache, precision=self.latex_precision)
+        self.start_export(self.export_job)
+
+    def start_export(self, job):
+        """Run an export job and poll it from the Tk event loop."""
+        if self.latex_window is None:
+            self.latex_window = LatexWindow(self.root, on_close=self.close_latex_window)
+        job.start()
+        self.root.after(50, self.poll_export, job)
+
+    def poll_export(self, job):
+        """Pass the worker's progress and result to the window."""
+        if job is not self.export_job:
+            return
+        for message, value in job.poll():
+            if message == 'progress':
+                if self.latex_window is not None:
+                    self.latex_window.set_progress(*value)
+                continue
+            self.export_job = None
+            if message == 'done':
+                if self.profiler is not None:
+                    # The export ran on the worker, so its time is only known once it is done
+                    self.profiler.record('export', job.seconds)
+                self.show_latex_code(value)
+            elif message == 'failed' and self.latex_window is not None:
+                self.latex_window.set_status(f"Export failed: {value}")
+            return
+        self.root.after(50, self.poll_export, job)
+
+    def cancel_export(self):
+        if self.export_job is not None:
+            self.export_job.cancel()
+            self.export_job = None
+
+    def close_latex_window(self):
+        self.cancel_export()
+        self.latex_window = None
+
+    def save_drawing(self):
+        """Save the drawing as a JSON shape list that batch_convert.py can turn into TikZ."""
+        path = filedialog.asksaveasfilename(defaultextension='.json', filetypes=[("Drawings", "*.json")])
+        if path:
+            from batch_convert import save_scene
+            save_scene(self.scene, path)
+
+    def import_tikz(self):
+        """Add the shapes of the first tikzpicture in a .tex file to the drawing."""
+        path = filedialog.askopenfilename(filetypes=[("TikZ", "*.tex"), ("All files", "*")])
+        if path:
+            from tikz_import import load_tikz
+            self.import_records(load_tikz(path))
+
+    def import_records(self, records):
+        """Add shape records in one batch: a single undo step, journal flush and redraw."""
+        if not records:
+            return []
+        self.finish_editing()
+        ids = [self.scene.add_record(record) for record in records]
+        for sid in ids:
+            if self.renderer is None or not self.renderer.accepts(sid):
+                self.create_artists(sid)
+        self.history.push(AddCommand(ids))
+        self.checkpoint()
+        boxes = np.vstack([self.scene.table_bounds(kind, rows)
+                           for kind, rows in self.scene.group_rows(ids).items()])
+        self.viewport.fit((*boxes[:, :2].min(axis=0), *boxes[:, 2:].max(axis=0)))
+        self.canvas.draw()
+        return ids
 
     def color_to_latex(self, color):
         """Map placeholder colors to LaTeX-compatible colors."""
@@ -521,18 +1130,54 @@ class DrawToLatexApp:
         return color_map.get(color, 'black')
 
     def show_latex_code(self, latex_code):
-        """Display the generated LaTeX code in a new window."""
-        code_window = tk.Toplevel(self.root)
-        code_window.title("Generated LaTeX Code")
-
-        text_widget = tk.Text(code_window, wrap='word')
-        text_widget.insert('1.0', latex_code)
-        text_widget.config(state=tk.DISABLED)
-        text_widget.pack(expand=True, fill=tk.BOTH)
-
-        tk.Button(code_window, text="Close", command=code_window.destroy).pack(pady=5)
+        """Display the generated LaTeX code."""
+        if self.latex_window is None:
+            self.latex_window = LatexWindow(self.root, on_close=self.close_latex_window)
+        self.latex_window.show(latex_code)
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Draw shapes with the mouse and export them as TikZ.")
+    parser.add_argument('drawing', nargs='?', help="drawing file to open or create; every edit is saved to it as it happens")
+    parser.add_argument('--profile', metavar='PATH', help="record handler and redraw latencies and write them to PATH (.json or .csv) on exit")
+    parser.add_argument('--profile-overlay', action='store_true', help="show FPS and latency percentiles on the canvas")
+    parser.add_argument('--history-budget', type=float, default=4, metavar='MB', help="memory the undo history may use (default 4)")
+    parser.add_argument('--startup-profile', action='store_true', help="time the phases of startup up to the first frame, print them and exit")
+    parser.add_argument('--startup-budget', type=float, default=1000, metavar='MS',
+                        help="with --startup-profile, exit with a nonzero status if the first frame takes longer (default 1000)")
+    args = parser.parse_args()
+
+    timer = None
+    if args.startup_profile:
+        from profiling import StartupTimer
+        timer = StartupTimer(STARTED)
+        timer.mark('imports')
     root = tk.Tk()
-    app = DrawToLatexApp(root)
-    root.mainloop()
+    profiler = None
+    if args.profile or args.profile_overlay:
+        from profiling import LatencyRecorder
+        profiler = LatencyRecorder()
+    if timer is not None:
+        timer.mark('window')
+    app = DrawToLatexApp(root, profiler=profiler, profile_path=args.profile, show_overlay=args.profile_overlay,
+                         history_budget=int(args.history_budget * (1 << 20)), drawing_path=args.drawing)
+    if timer is None:
+        root.mainloop()
+    else:
+        timer.mark('app')
+
+        def first_frame(event):
+            timer.mark('first frame')
+            root.quit()
+        app.canvas.mpl_connect('draw_event', first_frame)
+        # Give up on a window that never maps rather than hang
+        root.after(int(10 * args.startup_budget), root.quit)
+        root.mainloop()
+        print(timer.report(), file=sys.stderr)
+        total = timer.total_ms()
+        within = timer.marks[-1][0] == 'first frame' and total <= args.startup_budget
+        print(f"startup {total:.1f} ms, budget {args.startup_budget:.0f} ms: {'ok' if within else 'over'}", file=sys.stderr)
+        if app.store is not None:
+            app.store.close()
+        root.destroy()
+        sys.exit(0 if within else 1)
@@ -0,0 +1,97 @@
+"""Freehand strokes: point capture with online simplification and Bezier fitting."""
+import numpy as np
+
+
+class StrokeBuffer:
+    """Growable point buffer that simplifies a stroke while it is being drawn.
+
+    Points are kept with an opening-window simplification: the raw points since the last
+    kept point are held in a window, and as soon as one of them strays further than
+    tolerance from the chord to the newest point, the previous point is kept and the
+    window restarts there. Every kept point is final, so memory stays proportional to
+    the simplified stroke rather than the number of motion events.
+    """
+
+    def __init__(self, tolerance=0.05, max_window=256):
+        self.tolerance = tolerance
+        self.max_window = max_window
+        self.kept = np.zeros((64, 2))
+        self.kept_count = 0
+        self.window = np.zeros((max_window + 1, 2))
+        self.window_count = 0
+
+    def __len__(self):
+        return self.kept_count
+
+    def keep(self, point):
+        if self.kept_count == len(self.kept):
+            self.kept = np.concatenate([self.kept, np.zeros_like(self.kept)])
+        self.kept[self.kept_count] = point
+        self.kept_count += 1
+
+    def add_point(self, x, y):
+        """Feed one motion event into the stroke."""
+        point = (x, y)
+        if self.kept_count == 0:
+            self.keep(point)
+            return
+        anchor = self.kept[self.kept_count - 1]
+        last = self.window[self.window_count - 1] if self.window_count else anchor
+        if np.hypot(x - last[0], y - last[1]) < self.tolerance / 4:
+            # Jitter between motion events carries no shape information
+            return
+        window = self.window[:self.window_count]
+        if self.window_count and chord_deviation(anchor, point, window) > self.tolerance:
+            self.keep(window[-1])
+            self.window[0] = point
+            self.window_count = 1
+            return
+        if self.window_count == self.max_window:
+            self.keep(window[-1])
+            self.window_count = 0
+        self.window[self.window_count] = point
+        self.window_count += 1
+
+    def preview(self):
+        """Return the points to show while drawing: the kept points plus the open window's end."""
+        if self.window_count:
+            return np.concatenate([self.kept[:self.kept_count], self.window[self.window_count - 1:self.window_count]])
+        return self.kept[:self.kept_count].copy()
+
+    def finish(self):
+        """Close the stroke and return its simplified points."""
+        if self.window_count:
+            self.keep(self.window[self.window_count - 1])
+            self.window_count = 0
+        return self.kept[:self.kept_count].copy()
+
+
+def chord_deviation(start, end, points):
+    """Largest distance from points to the segment start-end."""
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    length2 = dx * dx + dy * dy
+    px, py = points[:, 0] - start[0], points[:, 1] - start[1]
+    if length2 == 0:
+        return np.hypot(px, py).max()
+    t = np.clip((px * dx + py * dy) / length2, 0, 1)
+    return np.hypot(px - t * dx, py - t * dy).max()
+
+
+def fit_bezier(points):
+    """Turn a polyline into cubic Bezier control points P0 C1 C2 P1 C1 C2 P2 ...
+
+    Uses the Catmull-Rom tangents at each point, so the curve passes through every
+    simplified point and stays smooth across them.
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) < 2:
+        return points
+    # Repeat the end points so the first and last segments have a tangent on both sides
+    padded = np.concatenate([points[:1], points, points[-1:]])
+    c1 = padded[1:-2] + (padded[2:-1] - padded[:-3]) / 6
+    c2 = padded[2:-1] - (padded[3:] - padded[1:-2]) / 6
+    controls = np.empty((3 * (len(points) - 1) + 1, 2))
+    controls[0::3] = points
+    controls[1::3] = c1
+    controls[2::3] = c2
+    return controls
@@ -0,0 +1,221 @@
+"""Undo/redo as a log of small invertible commands, bounded by a memory budget.
+
+Commands act on an editor object that provides restore_shape(record, sid),
+delete_shape(sid), move_shapes(ids, dx, dy), transform_shapes(ids, matrix),
+recolor_shapes(ids, colors) and clear_shapes(); DrawToLatexApp implements these
+so the artists stay in step.
+"""
+from collections import deque
+
+
+def record_size(record):
+    """Rough number of bytes a shape record keeps alive."""
+    size = 200 + 24 * len(record)
+    size += 32 * len(record.get('vertices', ()))
+    size += len(record.get('text', ''))
+    return size
+
+
+class AddCommand:
+    """Shapes were added. Their records are captured when undone, so later edits are kept."""
+
+    def __init__(self, ids):
+        self.ids = tuple(ids)
+        self.records = None
+
+    def undo(self, editor):
+        self.records = [editor.scene.record(sid) for sid in self.ids]
+        for sid in self.ids:
+            editor.delete_shape(sid)
+
+    def redo(self, editor):
+        for sid, record in zip(self.ids, self.records):
+            editor.restore_shape(record, sid)
+        self.records = None
+
+    def nbytes(self):
+        return 64 + 8 * len(self.ids) + sum(record_size(r) for r in self.records or ())
+
+
+class DeleteCommand:
+    """Shapes were removed; their records are kept so they can be restored under the same ids."""
+
+    def __init__(self, scene, ids):
+        self.ids = tuple(int(sid) for sid in ids)
+        self.records = [scene.record(sid) for sid in self.ids]
+
+    def do(self, editor):
+        for sid in self.ids:
+            editor.delete_shape(sid)
+
+    def undo(self, editor):
+        for sid, record in zip(self.ids, self.records):
+            editor.restore_shape(record, sid)
+
+    redo = do
+
+    def nbytes(self):
+        return 64 + 8 * len(self.ids) + sum(record_size(r) for r in self.records)
+
+
+class ClearCommand(DeleteCommand):
+    """The whole canvas was cleared in one step."""
+
+    def do(self, editor):
+        editor.clear_shapes()
+
+    redo = do
+
+
+class MoveCommand:
+    """Shapes were translated by (dx, dy)."""
+
+    def __init__(self, ids, dx, dy):
+        self.ids = tuple(ids)
+        self.dx = dx
+        self.dy = dy
+        # A move stays open while its drag is in progress so later deltas merge into it
+        self.open = True
+
+    def undo(self, editor):
+        editor.move_shapes(self.ids, -self.dx, -self.dy)
+
+    def redo(self, editor):
+        editor.move_shapes(self.ids, self.dx, self.dy)
+
+    def nbytes(self):
+        return 96 + 8 * len(self.ids)
+
+
+class TransformCommand:
+    """Shapes were scaled or rotated by an affine matrix.
+
+    A rotation can turn rectangles, ellipses and cones into paths, and split a cone's sides
+    off as a shape of its own, so the shapes are recorded beforehand and restored from the
+    records on undo, after the split-off shapes are deleted.
+    """
+
+    def __init__(self, scene, ids, matrix):
+        self.ids = tuple(int(sid) for sid in ids)
+        self.records = [scene.record(sid) for sid in self.ids]
+        self.matrix = matrix
+        self.created = ()
+
+    def do(self, editor):
+        self.created = tuple(editor.transform_shapes(self.ids, self.matrix)[len(self.ids):])
+
+    def undo(self, editor):
+        for sid in self.created:
+            editor.delete_shape(sid)
+        for sid, record in zip(self.ids, self.records):
+            editor.delete_shape(sid)
+            editor.restore_shape(record, sid)
+        self.created = ()
+
+    redo = do
+
+    def nbytes(self):
+        return 160 + 8 * (len(self.ids) + len(self.created)) + sum(record_size(r) for r in self.records)
+
+
+class RecolorCommand:
+    """Shapes changed color; the previous color of each shape is kept."""
+
+    def __init__(self, scene, ids, color):
+        self.ids = tuple(ids)
+        self.old_colors = [scene.color(sid) for sid in self.ids]
+        self.color = color
+
+    def do(self, editor):
+        editor.recolor_shapes(self.ids, [self.color] * len(self.ids))
+
+    def undo(self, editor):
+        editor.recolor_shapes(self.ids, self.old_colors)
+
+    redo = do
+
+    def nbytes(self):
+        return 96 + 16 * len(self.ids)
+
+
+class CommandHistory:
+    """Undo and redo stacks whose combined size is kept under budget_bytes."""
+
+    def __init__(self, budget_bytes=4 << 20):
+        self.budget_bytes = budget_bytes
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.undo_stack)
+
+    def push(self, command):
+        """Record a command that has already been carried out."""
+        self.close()
+        self.undo_stack.append(command)
+        self.nbytes += command.nbytes()
+        self.clear_redo()
+        self.trim()
+
+    def execute(self, command, editor):
+        """Carry out a command and record it."""
+        command.do(editor)
+        self.push(command)
+
+    def record_move(self, ids, dx, dy):
+        """Record a drag step, merging it into the open move of the same shapes if there is one."""
+        ids = tuple(ids)
+        last = self.undo_stack[-1] if self.undo_stack else None
+        if isinstance(last, MoveCommand) and last.open and last.ids == ids:
+            last.dx += dx
+            last.dy += dy
+            self.clear_redo()
+            return
+        self.push(MoveCommand(ids, dx, dy))
+
+    def clear_redo(self):
+        """Forget the undone commands once a new one makes them unreachable."""
+        self.nbytes -= sum(command.nbytes() for command in self.redo_stack)
+        self.redo_stack.clear()
+
+    def close(self):
+        """End the current drag so the next move starts a new undo step."""
+        if self.undo_stack and isinstance(self.undo_stack[-1], MoveCommand):
+            self.undo_stack[-1].open = False
+
+    def undo(self, editor):
+        """Undo the most recent command; returns False if there is nothing to undo."""
+        if not self.undo_stack:
+            return False
+        self.close()
+        command = self.undo_stack.pop()
+        self.nbytes -= command.nbytes()
+        command.undo(editor)
+        self.redo_stack.append(command)
+        self.nbytes += command.nbytes()
+        self.trim()
+        return True
+
+    def redo(self, editor):
+        """Redo the most recently undone command; returns False if there is nothing to redo."""
+        if not self.redo_stack:
+            return False
+        command = self.redo_stack.pop()
+        self.nbytes -= command.nbytes()
+        command.redo(editor)
+        self.undo_stack.append(command)
+        self.nbytes += command.nbytes()
+        command.open = False
+        self.trim()
+        return True
+
+    def trim(self):
+        """Forget the furthest redo steps, then the oldest undo steps, until the history fits in its budget.
+
+        The most recent step of each kind is always kept.
+        """
+        while self.nbytes > self.budget_bytes and len(self.redo_stack) > 1:
+            self.nbytes -= self.redo_stack.pop(0).nbytes()
+        while self.nbytes > self.budget_bytes and len(self.undo_stack) > 1:
+            self.nbytes -= self.undo_stack.popleft().nbytes()
@@ -0,0 +1,295 @@
+"""Crash-safe storage for drawings: columnar snapshots plus an append-only edit journal.
+
+A drawing saved at PATH is two files. PATH is a snapshot: a JSON header followed by the
+scene's NumPy columns, 64-byte aligned so they can be memory-mapped. PATH.journal lists
+every scene edit made since that snapshot as checksummed binary records, written as they
+happen. Loading maps the snapshot and replays the journal over it; a record cut short by
+a crash is dropped, so at most the edit in progress is lost.
+"""
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from scene import COLUMNS, KINDS, VERTEX_KINDS, SceneModel
+
+SNAPSHOT_MAGIC = b'LTXSNAP1'
+JOURNAL_MAGIC = b'LTXJRNL1'
+ALIGN = 64
+
+OP_ADD, OP_REMOVE, OP_VALUES, OP_COLOR, OP_TEXT, OP_MOVE, OP_CLEAR, OP_TRANSFORM = range(1, 9)
+
+# Every journal record starts with its payload length, opcode and a CRC32 of both
+RECORD = struct.Struct('<IBI')
+GENERATION = struct.Struct('<Q')
+
+
+def aligned(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+def pack_text(text):
+    data = text.encode('utf-8')
+    return struct.pack('<I', len(data)) + data
+
+
+def replace_file(path, data):
+    """Write data to path atomically: a crash leaves either the old file or the new one."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for part in data:
+            f.write(part)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_snapshot(scene, path, generation=0):
+    """Write a scene to path as a columnar snapshot."""
+    columns = scene.to_columns()
+    arrays = columns.pop('arrays')
+    header = dict(columns, generation=generation, arrays={})
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+        arrays[name] = array
+        header['arrays'][name] = [offset, array.dtype.str, list(array.shape)]
+        offset += aligned(array.nbytes)
+    header = json.dumps(header).encode('utf-8')
+    start = len(SNAPSHOT_MAGIC) + 4 + len(header)
+    parts = [SNAPSHOT_MAGIC, struct.pack('<I', len(header)), header, bytes(aligned(start) - start)]
+    for array in arrays.values():
+        parts += [array.tobytes(), bytes(aligned(array.nbytes) - array.nbytes)]
+    replace_file(path, parts)
+
+
+def read_snapshot(path, cell_size=1.0):
+    """Load a snapshot written by write_snapshot. Returns (scene, generation)."""
+    with open(path, 'rb') as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a drawing snapshot")
+        (length,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length))
+    start = aligned(len(SNAPSHOT_MAGIC) + 4 + length)
+    mapped = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {name: np.ndarray(tuple(shape), np.dtype(dtype), buffer=mapped, offset=start + offset)
+              for name, (offset, dtype, shape) in header['arrays'].items()}
+    scene = SceneModel.from_columns(arrays, header['palette'], header['strings'], header['next_id'], cell_size)
+    return scene, header['generation']
+
+
+class Reader:
+    """Sequential decoder for one journal record's payload."""
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def floats(self, n):
+        values = np.frombuffer(self.data, dtype='<f8', count=n, offset=self.offset)
+        self.offset += 8 * n
+        return values
+
+    def text(self):
+        (length,) = self.unpack('<I')
+        self.offset += length
+        return bytes(self.data[self.offset - length:self.offset]).decode('utf-8')
+
+
+def apply_record(scene, op, payload):
+    """Apply one journal record to a scene."""
+    reader = Reader(payload)
+    if op == OP_CLEAR:
+        scene.clear()
+    elif op == OP_MOVE:
+        dx, dy, n = reader.unpack('<ddI')
+        scene.move(np.frombuffer(payload, dtype='<i8', count=n, offset=reader.offset).tolist(), dx, dy)
+    elif op == OP_TRANSFORM:
+        matrix = reader.floats(6)
+        (n,) = reader.unpack('<I')
+        scene.transform(np.frombuffer(payload, dtype='<i8', count=n, offset=reader.offset).tolist(), matrix)
+    else:
+        (sid,) = reader.unpack('<q')
+        if op == OP_ADD:
+            (code,) = reader.unpack('<B')
+            kind = KINDS[code]
+            color = reader.text()
+            if kind in VERTEX_KINDS:
+                values = reader.floats(len(COLUMNS[kind]) - 2)
+                (count,) = reader.unpack('<I')
+                scene.add(kind, values, color, vertices=reader.floats(2 * count).reshape(-1, 2), sid=sid)
+            else:
+                values = reader.floats(len(COLUMNS[kind]))
+                text = reader.text() if kind == 'text' else None
+                scene.add(kind, values, color, text=text, sid=sid)
+        elif op == OP_REMOVE:
+            scene.remove(sid)
+        elif op == OP_VALUES:
+            kind = scene.kind(sid)
+            if kind in VERTEX_KINDS:
+                values = scene.values(sid)
+                values[2:] = reader.floats(len(values) - 2)
+            else:
+                values = reader.floats(len(COLUMNS[kind]))
+            scene.set_values(sid, values)
+        elif op == OP_COLOR:
+            scene.set_color(sid, reader.text())
+        elif op == OP_TEXT:
+            scene.set_text(sid, reader.text())
+        else:
+            raise ValueError(f"unknown journal opcode {op}")
+
+
+def replay(scene, data):
+    """Apply the records in a journal's bytes. Returns the offset just past the last intact record."""
+    offset = len(JOURNAL_MAGIC) + GENERATION.size
+    view = memoryview(data)
+    while offset + RECORD.size <= len(data):
+        length, op, crc = RECORD.unpack_from(data, offset)
+        end = offset + RECORD.size + length
+        payload = view[offset + RECORD.size:end]
+        if end > len(data) or zlib.crc32(payload, zlib.crc32(bytes([op]))) != crc:
+            break
+        apply_record(scene, op, payload)
+        offset = end
+    return offset
+
+
+class Journal:
+    """Appends scene edits to a file as they happen; attach it with scene.journal = journal."""
+
+    def __init__(self, path):
+        self.path = path
+        # Unbuffered, so every record reaches the operating system as soon as it is written
+        self.file = open(path, 'ab', buffering=0)
+        self.nbytes = self.file.tell()
+
+    @staticmethod
+    def create(path, generation):
+        """Start an empty journal that belongs to the snapshot of the given generation."""
+        replace_file(path, [JOURNAL_MAGIC, GENERATION.pack(generation)])
+
+    def write(self, op, payload=b''):
+        crc = zlib.crc32(payload, zlib.crc32(bytes([op])))
+        self.file.write(RECORD.pack(len(payload), op, crc) + payload)
+        self.nbytes += RECORD.size + len(payload)
+
+    def sync(self):
+        """Make the records written so far durable."""
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    def record_add(self, scene, sid):
+        kind = scene.kind(sid)
+        values = scene.values(sid).astype('<f8')
+        parts = [struct.pack('<qB', sid, KINDS.index(kind)), pack_text(scene.color(sid))]
+        if kind in VERTEX_KINDS:
+            vertices = scene.shape_vertices(sid).astype('<f8')
+            parts += [values[2:].tobytes(), struct.pack('<I', len(vertices)), vertices.tobytes()]
+        else:
+            parts.append(values.tobytes())
+        if kind == 'text':
+            parts.append(pack_text(scene.text(sid)))
+        self.write(OP_ADD, b''.join(parts))
+
+    def record_remove(self, sid):
+        self.write(OP_REMOVE, struct.pack('<q', sid))
+
+    def record_values(self, scene, sid):
+        values = scene.values(sid).astype('<f8')
+        if scene.kind(sid) in VERTEX_KINDS:
+            # Vertex offsets change when a snapshot compacts the buffer, so they are not journaled
+            values = values[2:]
+        self.write(OP_VALUES, struct.pack('<q', sid) + values.tobytes())
+
+    def record_color(self, sid, color):
+        self.write(OP_COLOR, struct.pack('<q', sid) + pack_text(color))
+
+    def record_text(self, sid, text):
+        self.write(OP_TEXT, struct.pack('<q', sid) + pack_text(text))
+
+    def record_move(self, ids, dx, dy):
+        ids = np.asarray(ids, dtype='<i8')
+        self.write(OP_MOVE, struct.pack('<ddI', dx, dy, len(ids)) + ids.tobytes())
+
+    def record_transform(self, ids, matrix):
+        ids = np.asarray(ids, dtype='<i8')
+        self.write(OP_TRANSFORM, np.asarray(matrix, dtype='<f8').tobytes() + struct.pack('<I', len(ids)) + ids.tobytes())
+
+    def record_clear(self):
+        self.write(OP_CLEAR)
+
+
+class DrawingStore:
+    """A drawing on disk: loads the snapshot and journal, journals new edits, compacts periodically.
+
+    The snapshot and journal share a generation number. A journal whose generation does not
+    match the snapshot was already folded into it by a compaction that crashed before the
+    journal could be reset, and is ignored.
+    """
+
+    def __init__(self, path, compact_bytes=1 << 20):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.compact_bytes = compact_bytes
+        self.scene = None
+        self.journal = None
+        self.generation = 0
+
+    def load(self, cell_size=1.0):
+        """Open the drawing, creating it if needed, and return its scene with journaling enabled."""
+        if os.path.exists(self.path):
+            scene, self.generation = read_snapshot(self.path, cell_size)
+        else:
+            scene = SceneModel(cell_size=cell_size)
+        header = JOURNAL_MAGIC + GENERATION.pack(self.generation)
+        data = b''
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as f:
+                data = f.read()
+        if data[:len(header)] == header:
+            end = replay(scene, data)
+            if end < len(data):
+                # Drop the torn record left by a crash so new records follow intact ones
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(end)
+        else:
+            Journal.create(self.journal_path, self.generation)
+        self.scene = scene
+        self.attach(Journal(self.journal_path))
+        return scene
+
+    def attach(self, journal):
+        self.journal = journal
+        self.scene.journal = journal
+
+    def checkpoint(self):
+        """Make the edits so far durable, compacting into a new snapshot once the journal is large."""
+        self.journal.sync()
+        if self.journal.nbytes > self.compact_bytes:
+            self.compact()
+
+    def compact(self):
+        """Write a fresh snapshot of the scene and start an empty journal."""
+        generation = self.generation + 1
+        write_snapshot(self.scene, self.path, generation)
+        self.journal.close()
+        Journal.create(self.journal_path, generation)
+        self.generation = generation
+        self.attach(Journal(self.journal_path))
+
+    def close(self):
+        """Compact any outstanding edits and stop journaling."""
+        if self.journal.nbytes > len(JOURNAL_MAGIC) + GENERATION.size or not os.path.exists(self.path):
+            self.compact()
+        self.journal.close()
+        self.scene.journal = None
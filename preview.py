@@ -0,0 +1,220 @@
+"""Render saved drawings to PNG, SVG or PDF previews without a GUI or a LaTeX install.
+
+Usage:
+    python preview.py drawings/ "more/*.json" -o previews/ --format png svg -j 4
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib import rc_context
+from matplotlib.figure import Figure
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
+
+from batch_convert import duplicate_outputs, load_scene, named_inputs, output_path
+from batch_render import BatchRenderer
+from text_extents import TextExtents
+
+# Bump when the rendering changes so cached previews are redrawn
+FORMAT_VERSION = 1
+FORMATS = ('png', 'svg', 'pdf')
+CM_PER_INCH = 2.54
+# Matplotlib writes a creation date into vector files and salts SVG ids at random;
+# without either, a drawing's preview is identical from run to run
+METADATA = {'svg': {'Date': None}, 'pdf': {'CreationDate': None}}
+RC = {'svg.hashsalt': 'preview'}
+
+
+class PreviewOptions:
+    """Everything besides the scene that affects a preview.
+
+    Like TikZ, one drawing unit is scale centimetres on the page, labels are centered on
+    their anchor, and fontsize is in points. margin is in drawing units.
+    """
+
+    def __init__(self, dpi=150, scale=1.0, margin=0.2, linewidth=1.0, fontsize=10, background='white'):
+        self.dpi = dpi
+        self.scale = scale
+        self.margin = margin
+        self.linewidth = linewidth
+        self.fontsize = fontsize
+        self.background = background
+
+    def key(self):
+        return {'dpi': self.dpi, 'scale': self.scale, 'margin': self.margin, 'linewidth': self.linewidth,
+                'fontsize': self.fontsize, 'background': self.background}
+
+
+def preview_key(scene, fmt, options):
+    """Hash the shapes together with the format and options, so equal drawings share a preview."""
+    digest = hashlib.sha256(f"{FORMAT_VERSION}:{fmt}:".encode())
+    digest.update(json.dumps(options.key(), sort_keys=True).encode())
+    digest.update(json.dumps(scene.to_records(), sort_keys=True, separators=(',', ':')).encode())
+    return digest.hexdigest()
+
+
+def scene_extent(scene, options, extents):
+    """Return the box (x0, y0, x1, y1) in drawing units that holds every shape and label."""
+    boxes = [scene.table_bounds(kind, table.live_rows()) for kind, table in scene.tables.items()
+             if kind != 'text' and table.size]
+    units_per_point = CM_PER_INCH / 72 / options.scale
+    for sid in scene.ids(('text',)):
+        x, y = scene.values(sid)
+        width, height, _ = extents.measure(scene.text(sid))
+        rx, ry = width / 2 * units_per_point, height / 2 * units_per_point
+        boxes.append(np.array([[x - rx, y - ry, x + rx, y + ry]]))
+    boxes = np.concatenate(boxes) if boxes else np.zeros((0, 4))
+    if not len(boxes):
+        return (0.0, 0.0, 1.0, 1.0)
+    m = options.margin
+    return (boxes[:, 0].min() - m, boxes[:, 1].min() - m, boxes[:, 2].max() + m, boxes[:, 3].max() + m)
+
+
+def draw_scene(scene, options=None):
+    """Return a Figure showing the scene, sized so the drawing prints at options.scale."""
+    options = options or PreviewOptions()
+    extents = TextExtents(fontsize=options.fontsize, pad=0)
+    x0, y0, x1, y1 = scene_extent(scene, options, extents)
+    inches = options.scale / CM_PER_INCH
+    fig = Figure(figsize=(max(x1 - x0, 1e-3) * inches, max(y1 - y0, 1e-3) * inches), dpi=options.dpi,
+                 facecolor=options.background)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    ax.set_xlim(x0, x1)
+    ax.set_ylim(y0, y1)
+    # Everything is in view and vector output may be zoomed, so nothing is culled or simplified
+    renderer = BatchRenderer(ax, scene, linewidth=options.linewidth, min_pixels=0, min_head_pixels=0)
+    # The collections are created by the first refresh, which must come before the axes list what to draw
+    renderer.refresh()
+    # Smooth paths and labels are not batched, and get artists of their own as in the editor
+    for sid in scene.ids(('path',)):
+        if scene.values(sid)[2]:
+            vertices = scene.shape_vertices(sid)
+            codes = [Path.MOVETO] + [Path.CURVE4] * (len(vertices) - 1)
+            ax.add_patch(PathPatch(Path(vertices.copy(), codes), edgecolor=scene.color(sid), facecolor='none',
+                                   linewidth=options.linewidth))
+    for sid in scene.ids(('text',)):
+        x, y = scene.values(sid)
+        ax.text(x, y, scene.text(sid), color=scene.color(sid), fontsize=options.fontsize,
+                ha='center', va='center')
+    return fig
+
+
+def render_scene(scene, target, fmt='png', options=None):
+    """Draw a scene to target, a path or a binary file object, through the Agg, SVG or PDF backend."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown preview format {fmt!r}")
+    options = options or PreviewOptions()
+    with rc_context(RC):
+        draw_scene(scene, options).savefig(target, format=fmt, dpi=options.dpi,
+                                           facecolor=options.background, metadata=METADATA.get(fmt))
+
+
+class PreviewCache:
+    """Previews on disk under directory, named by the hash of what they show.
+
+    A preview is only drawn if no file exists for its hash, and is written to a temporary
+    file first, so parallel builds sharing the directory never see half-written files.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key, fmt):
+        return os.path.join(self.directory, key[:2], f"{key}.{fmt}")
+
+    def render(self, scene, fmt='png', options=None):
+        """Return (path of the preview, whether it had to be drawn)."""
+        options = options or PreviewOptions()
+        path = self.path(preview_key(scene, fmt, options), fmt)
+        if os.path.exists(path):
+            return path, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                render_scene(scene, f, fmt, options)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path, True
+
+
+def preview_file(path, out_paths, cache_dir, options):
+    """Preview one drawing in every requested format. Returns (status, seconds, message).
+
+    out_paths maps each format to the file the preview is copied to.
+    """
+    start = time.perf_counter()
+    try:
+        scene = load_scene(path)
+        cache = PreviewCache(cache_dir)
+        drawn = 0
+        for fmt, out_path in out_paths.items():
+            cached_path, rendered = cache.render(scene, fmt, options)
+            drawn += rendered
+            shutil.copyfile(cached_path, out_path)
+        status = 'rendered' if drawn else 'cached'
+        return status, time.perf_counter() - start, f"{len(scene)} shapes"
+    except Exception as e:
+        return 'failed', time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def output_paths(path, name, out_dir, formats):
+    return {fmt: output_path(path, name, out_dir, f".{fmt}") for fmt in formats}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render saved drawings to PNG, SVG or PDF previews.")
+    parser.add_argument('inputs', nargs='+', help="drawing files, directories or glob patterns")
+    parser.add_argument('-o', '--out-dir', help="write previews here instead of next to the inputs, mirroring their layout")
+    parser.add_argument('-f', '--format', nargs='+', choices=FORMATS, default=['png'], help="formats to write (default png)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument('--cache-dir', default='.preview-cache', help="where rendered previews are kept (default .preview-cache)")
+    parser.add_argument('--dpi', type=float, default=150, help="resolution of PNG previews (default 150)")
+    parser.add_argument('--scale', type=float, default=1.0, help="centimetres per drawing unit, as in TikZ (default 1)")
+    parser.add_argument('--fontsize', type=float, default=10, help="label size in points (default 10)")
+    args = parser.parse_args(argv)
+
+    inputs = named_inputs(args.inputs)
+    if not inputs:
+        print("no drawings found", file=sys.stderr)
+        return 1
+    options = PreviewOptions(dpi=args.dpi, scale=args.scale, fontsize=args.fontsize)
+    jobs = [(path, output_paths(path, name, args.out_dir, args.format), args.cache_dir, options) for path, name in inputs]
+    duplicates = duplicate_outputs((path, out_path) for path, out_paths, *_ in jobs for out_path in out_paths.values())
+    if duplicates:
+        for message in duplicates:
+            print(message, file=sys.stderr)
+        return 1
+    for directory in {os.path.dirname(out_path) for _, out_paths, *_ in jobs for out_path in out_paths.values()}:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    start = time.perf_counter()
+    if args.jobs <= 1 or len(jobs) == 1:
+        results = [preview_file(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(pool.map(preview_file, *zip(*jobs), chunksize=max(1, len(jobs) // (4 * args.jobs))))
+
+    counts = {'rendered': 0, 'cached': 0, 'failed': 0}
+    for (path, out_paths, *_), (status, seconds, message) in zip(jobs, results):
+        counts[status] += 1
+        stream = sys.stderr if status == 'failed' else sys.stdout
+        print(f"{status:8} {path} -> {', '.join(out_paths.values())} ({seconds * 1000:.1f} ms, {message})", file=stream)
+    print(f"{counts['rendered']} rendered, {counts['cached']} cached, {counts['failed']} failed "
+          f"in {time.perf_counter() - start:.2f} s")
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
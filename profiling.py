@@ -0,0 +1,106 @@
+"""Opt-in latency instrumentation for the editor's event handlers and redraws."""
+import csv
+import functools
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+
+class LatencyRecorder:
+    """Keeps a rolling window of wall times per named operation and reports percentiles."""
+
+    def __init__(self, window=2000):
+        self.window = window
+        self.samples = {}
+        self.totals = {}
+        self.frames = deque(maxlen=240)
+
+    def record(self, name, seconds):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+            self.totals[name] = 0
+        samples.append(seconds)
+        self.totals[name] += 1
+
+    def record_frame(self):
+        """Note that a frame reached the screen, for the FPS readout."""
+        self.frames.append(time.perf_counter())
+
+    def wrap(self, name, func, frame=False):
+        """Return func wrapped so every call is timed under name."""
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - start)
+                if frame:
+                    self.record_frame()
+        return timed
+
+    def fps(self, horizon=1.0):
+        """Frames drawn per second over the last horizon seconds."""
+        now = time.perf_counter()
+        return sum(1 for t in self.frames if now - t <= horizon) / horizon
+
+    def stats(self, name):
+        """Return count, mean and p50/p95/p99/max in milliseconds for one operation."""
+        samples = np.asarray(self.samples.get(name, ())) * 1000
+        if not len(samples):
+            return {'count': 0}
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return {'count': self.totals[name], 'mean_ms': float(samples.mean()), 'p50_ms': float(p50),
+                'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(samples.max())}
+
+    def summary(self):
+        return {name: self.stats(name) for name in sorted(self.samples)}
+
+    def overlay_text(self, names=('on_motion', 'draw', 'blit')):
+        """Short status line for the on-canvas overlay."""
+        parts = [f"{self.fps():.0f} fps"]
+        for name in names:
+            stats = self.stats(name)
+            if stats['count']:
+                parts.append(f"{name} p50 {stats['p50_ms']:.1f} / p95 {stats['p95_ms']:.1f} ms")
+        return " | ".join(parts)
+
+    def dump(self, path):
+        """Write the summary to path as CSV if it ends in .csv, otherwise as JSON."""
+        summary = self.summary()
+        if path.endswith('.csv'):
+            fields = ['count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['operation'] + fields)
+                for name, stats in summary.items():
+                    writer.writerow([name] + [stats.get(field, '') for field in fields])
+        else:
+            with open(path, 'w') as f:
+                json.dump(summary, f, indent=2)
+
+
+class StartupTimer:
+    """Marks the phases of a cold start, measured from when the process began importing."""
+
+    def __init__(self, started):
+        self.started = started
+        self.marks = []
+
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter()))
+
+    def total_ms(self):
+        return (self.marks[-1][1] - self.started) * 1000 if self.marks else 0.0
+
+    def report(self):
+        """One line per phase: time since start and time spent in the phase, in milliseconds."""
+        lines = []
+        previous = self.started
+        for name, at in self.marks:
+            lines.append(f"{name:<12} {(at - self.started) * 1000:8.1f} ms  (+{(at - previous) * 1000:.1f})")
+            previous = at
+        return "\n".join(lines)
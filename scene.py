@@ -0,0 +1,562 @@
+"""Headless scene model: one NumPy table per primitive type, independent of matplotlib."""
+import numpy as np
+
+from snapping import ellipse_nearest_points
+from spatial_index import GridIndex
+
+# Numeric columns stored for each primitive type
+COLUMNS = {
+    'line': ('x0', 'y0', 'x1', 'y1'),
+    'arrow': ('x0', 'y0', 'x1', 'y1'),
+    'ellipse': ('cx', 'cy', 'width', 'height'),
+    'rectangle': ('x', 'y', 'width', 'height'),
+    'polygon': ('start', 'count'),
+    'text': ('x', 'y'),
+    'cone': ('cx', 'cy', 'width', 'height', 'lx', 'ly', 'rx', 'ry', 'ax', 'ay'),
+    # Freehand strokes: a polyline, or cubic Bezier control points P0 C1 C2 P1 C1 C2 P2 ... when smooth
+    'path': ('start', 'count', 'smooth'),
+}
+
+# Kinds whose points live in the shared vertex buffer rather than in their own columns
+VERTEX_KINDS = ('polygon', 'path')
+
+# Which columns hold x and y coordinates, used by translations
+X_COLUMNS = {
+    'line': [0, 2], 'arrow': [0, 2], 'ellipse': [0], 'rectangle': [0],
+    'polygon': [], 'text': [0], 'cone': [0, 4, 6, 8], 'path': [],
+}
+Y_COLUMNS = {
+    'line': [1, 3], 'arrow': [1, 3], 'ellipse': [1], 'rectangle': [1],
+    'polygon': [], 'text': [1], 'cone': [1, 5, 7, 9], 'path': [],
+}
+
+KINDS = tuple(COLUMNS)
+
+ARROW_LENGTH = 0.2
+ARROW_WIDTH = 0.1
+
+
+class ShapeTable:
+    """Growable column table holding every shape of one primitive type."""
+
+    def __init__(self, ncols, capacity=16):
+        self.values = np.zeros((capacity, ncols))
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.colors = np.zeros(capacity, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.size = 0
+
+    def append(self, sid, values, color):
+        """Store a new row and return its index."""
+        if self.size == len(self.ids):
+            self.grow(2 * len(self.ids))
+        row = self.size
+        self.values[row] = values
+        self.ids[row] = sid
+        self.colors[row] = color
+        self.alive[row] = True
+        self.size += 1
+        return row
+
+    def grow(self, capacity):
+        """Reallocate the columns with room for capacity rows."""
+        extra = capacity - len(self.ids)
+        self.values = np.concatenate([self.values, np.zeros((extra, self.values.shape[1]))])
+        self.ids = np.concatenate([self.ids, np.full(extra, -1, dtype=np.int64)])
+        self.colors = np.concatenate([self.colors, np.zeros(extra, dtype=np.int32)])
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+
+    def live_rows(self):
+        """Indices of rows that have not been removed."""
+        return np.flatnonzero(self.alive[:self.size])
+
+
+class SceneModel:
+    """Source of truth for a drawing; matplotlib artists are only a view over it."""
+
+    def __init__(self, cell_size=1.0):
+        self.tables = {kind: ShapeTable(len(columns)) for kind, columns in COLUMNS.items()}
+        self.vertices = np.zeros((16, 2))
+        self.vertex_count = 0
+        self.strings = {}
+        self.palette = []
+        self.palette_index = {}
+        self.rows = {}
+        self.next_id = 0
+        self.index = GridIndex(cell_size=cell_size)
+        # Every mutation stamps the shape with a new revision so caches can tell what changed
+        self.revision = 0
+        self.stamps = {}
+        # Optional journal.Journal that every mutation is reported to, for crash-safe storage
+        self.journal = None
+        # Optional snapping.AlignmentGuides told which shapes moved, so it can re-sort them
+        self.guides = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, sid):
+        return sid in self.rows
+
+    def color_code(self, color):
+        """Intern a color name and return its palette index."""
+        code = self.palette_index.get(color)
+        if code is None:
+            code = len(self.palette)
+            self.palette.append(color)
+            self.palette_index[color] = code
+        return code
+
+    def add(self, kind, values=(), color='black', text=None, vertices=None, sid=None):
+        """Add a shape and return its id. Pass sid to restore a removed shape under its old id."""
+        if sid is None:
+            sid = self.next_id
+        elif sid in self.rows:
+            raise ValueError(f"shape id {sid} is already in use")
+        self.next_id = max(self.next_id, sid + 1)
+        if kind in VERTEX_KINDS:
+            values = (self.store_vertices(vertices), len(vertices)) + tuple(values)
+        row = self.tables[kind].append(sid, values, self.color_code(color))
+        self.rows[sid] = (kind, row)
+        if kind == 'text':
+            self.strings[sid] = text or ''
+        self.index.insert(sid, self.bounds(sid))
+        self.touch(sid)
+        if self.guides is not None:
+            self.guides.update(sid)
+        if self.journal is not None:
+            self.journal.record_add(self, sid)
+        return sid
+
+    def touch(self, sid):
+        """Record that a shape changed."""
+        self.revision += 1
+        self.stamps[sid] = self.revision
+
+    def stamp(self, sid):
+        """Return the revision at which a shape last changed."""
+        return self.stamps[sid]
+
+    def store_vertices(self, vertices):
+        """Append polygon vertices to the shared vertex buffer and return the start offset."""
+        vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+        needed = self.vertex_count + len(vertices)
+        if needed > len(self.vertices):
+            grown = np.zeros((max(needed, 2 * len(self.vertices)), 2))
+            grown[:self.vertex_count] = self.vertices[:self.vertex_count]
+            self.vertices = grown
+        start = self.vertex_count
+        self.vertices[start:needed] = vertices
+        self.vertex_count = needed
+        return start
+
+    def remove(self, sid):
+        """Remove a shape from the scene."""
+        kind, row = self.rows.pop(sid)
+        self.tables[kind].alive[row] = False
+        self.strings.pop(sid, None)
+        self.stamps.pop(sid, None)
+        self.index.remove(sid)
+        self.revision += 1
+        if self.guides is not None:
+            self.guides.update(sid)
+        if self.journal is not None:
+            self.journal.record_remove(sid)
+
+    def clear(self):
+        """Remove every shape."""
+        # Ids and revisions keep counting so caches never confuse a new shape with an old one
+        next_id, revision, journal, guides = self.next_id, self.revision + 1, self.journal, self.guides
+        self.__init__(cell_size=self.index.cell_size)
+        self.next_id, self.revision, self.journal, self.guides = next_id, revision, journal, guides
+        if self.guides is not None:
+            self.guides.clear()
+        if self.journal is not None:
+            self.journal.record_clear()
+
+    def kind(self, sid):
+        return self.rows[sid][0]
+
+    def values(self, sid):
+        """Return a copy of the numeric columns of a shape."""
+        kind, row = self.rows[sid]
+        return self.tables[kind].values[row].copy()
+
+    def set_values(self, sid, values):
+        """Overwrite the numeric columns of a shape."""
+        kind, row = self.rows[sid]
+        self.tables[kind].values[row] = values
+        self.index.update(sid, self.bounds(sid))
+        self.touch(sid)
+        if self.guides is not None:
+            self.guides.update(sid)
+        if self.journal is not None:
+            self.journal.record_values(self, sid)
+
+    def shape_vertices(self, sid):
+        """Return the vertex array of a polygon or path (a view into the shared buffer)."""
+        start, count = self.values(sid)[:2].astype(int)
+        return self.vertices[start:start + count]
+
+    def color(self, sid):
+        kind, row = self.rows[sid]
+        return self.palette[self.tables[kind].colors[row]]
+
+    def set_color(self, sid, color):
+        kind, row = self.rows[sid]
+        self.tables[kind].colors[row] = self.color_code(color)
+        self.touch(sid)
+        if self.journal is not None:
+            self.journal.record_color(sid, color)
+
+    def set_colors(self, ids, colors):
+        """Give each shape its color, one vectorized assignment per primitive type."""
+        codes = {sid: self.color_code(color) for sid, color in zip(ids, colors)}
+        for kind, rows in self.group_rows(codes).items():
+            self.tables[kind].colors[rows] = [codes[sid] for sid in self.tables[kind].ids[rows].tolist()]
+        for sid, color in zip(ids, colors):
+            self.touch(sid)
+            if self.journal is not None:
+                self.journal.record_color(sid, color)
+
+    def text(self, sid):
+        return self.strings[sid]
+
+    def set_text(self, sid, text):
+        self.strings[sid] = text
+        self.touch(sid)
+        if self.journal is not None:
+            self.journal.record_text(sid, text)
+
+    def ids(self, kinds=KINDS):
+        """Return the ids of live shapes of the given kinds in creation order."""
+        found = [self.tables[kind].ids[self.tables[kind].live_rows()] for kind in kinds]
+        return np.sort(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def group_rows(self, ids):
+        """Group shape ids into {kind: row index array}."""
+        groups = {}
+        for sid in ids:
+            kind, row = self.rows[sid]
+            groups.setdefault(kind, []).append(row)
+        return {kind: np.asarray(rows, dtype=np.int64) for kind, rows in groups.items()}
+
+    def move(self, ids, dx, dy):
+        """Translate shapes by (dx, dy), one vectorized update per primitive type."""
+        groups = self.group_rows(ids)
+        for kind, rows in groups.items():
+            values = self.tables[kind].values
+            if kind in VERTEX_KINDS:
+                self.vertices[self.vertex_index(values[rows])] += (dx, dy)
+            else:
+                values[np.ix_(rows, X_COLUMNS[kind])] += dx
+                values[np.ix_(rows, Y_COLUMNS[kind])] += dy
+        self.reindex(groups)
+        if self.journal is not None:
+            self.journal.record_move(ids, dx, dy)
+
+    def transform(self, ids, matrix):
+        """Apply an affine map [[a, b, tx], [c, d, ty]] to shapes, one vectorized update per primitive type.
+
+        Ellipses, rectangles and cones have no rotation column, so a map that does not keep the
+        axes (any rotation but a quarter turn) first turns them into paths tracing the same
+        outline. Returns the ids of the transformed shapes, including any split off that way.
+        """
+        matrix = np.asarray(matrix, dtype=float).reshape(2, 3)
+        linear, offset = matrix[:, :2], matrix[:, 2]
+        tolerance = 1e-12 * np.abs(linear).max()
+        if np.abs(linear.diagonal()).max() > tolerance and np.abs(linear[[0, 1], [1, 0]]).max() > tolerance:
+            ids = self.trace_outlines(ids)
+        groups = self.group_rows(ids)
+        for kind, rows in groups.items():
+            values = self.tables[kind].values
+            if kind in VERTEX_KINDS:
+                index = self.vertex_index(values[rows])
+                self.vertices[index] = self.vertices[index] @ linear.T + offset
+                continue
+            v = values[rows]
+            if kind == 'rectangle':
+                x0, y0 = v[:, 0], v[:, 1]
+                x1, y1 = x0 + v[:, 2], y0 + v[:, 3]
+                corners = np.stack([np.column_stack([x0, y0]), np.column_stack([x1, y1])], axis=1)
+                corners = corners @ linear.T + offset
+                low, high = corners.min(axis=1), corners.max(axis=1)
+                values[rows] = np.column_stack([low, high - low])
+                continue
+            xs, ys = X_COLUMNS[kind], Y_COLUMNS[kind]
+            x, y = v[:, xs], v[:, ys]
+            v[:, xs] = linear[0, 0] * x + linear[0, 1] * y + offset[0]
+            v[:, ys] = linear[1, 0] * x + linear[1, 1] * y + offset[1]
+            if kind in ('ellipse', 'cone'):
+                w, h = v[:, 2].copy(), v[:, 3].copy()
+                v[:, 2] = np.hypot(linear[0, 0] * w, linear[0, 1] * h)
+                v[:, 3] = np.hypot(linear[1, 0] * w, linear[1, 1] * h)
+            values[rows] = v
+        self.reindex(groups)
+        if self.journal is not None:
+            self.journal.record_transform(ids, matrix)
+        return ids
+
+    def trace_outlines(self, ids):
+        """Replace rectangles, ellipses and cones among ids by paths along their outlines.
+
+        Each shape keeps its id; a cone's sides become a second path with a new id. Returns
+        ids followed by the new ones.
+        """
+        created = []
+        for sid in ids:
+            if self.kind(sid) not in ('rectangle', 'ellipse', 'cone'):
+                continue
+            records = self.outline_records(sid)
+            self.remove(sid)
+            self.add_record(records[0], sid=sid)
+            created.extend(self.add_record(record) for record in records[1:])
+        return list(ids) + created
+
+    def outline_records(self, sid):
+        """Return path records that draw a rectangle, ellipse or cone."""
+        kind, color, v = self.kind(sid), self.color(sid), self.values(sid)
+        if kind == 'rectangle':
+            x0, y0, x1, y1 = v[0], v[1], v[0] + v[2], v[1] + v[3]
+            return [{'kind': 'path', 'color': color, 'smooth': 0.0,
+                     'vertices': [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]}]
+        # Four cubic arcs, one per quadrant, with the usual control distance 4/3 (sqrt 2 - 1)
+        k = 4 / 3 * (np.sqrt(2) - 1)
+        unit = np.array([[1, 0], [1, k], [k, 1], [0, 1], [-k, 1], [-1, k], [-1, 0],
+                         [-1, -k], [-k, -1], [0, -1], [k, -1], [1, -k], [1, 0]])
+        base = unit * (v[2] / 2, v[3] / 2) + (v[0], v[1])
+        records = [{'kind': 'path', 'color': color, 'smooth': 1.0, 'vertices': base.tolist()}]
+        if kind == 'cone':
+            sides = [[v[4], v[5]], [v[8], v[9]], [v[6], v[7]]]
+            records.append({'kind': 'path', 'color': color, 'smooth': 0.0, 'vertices': sides})
+        return records
+
+    def reindex(self, groups):
+        """Update the index entries and stamps of shapes whose rows, grouped by kind, were changed in place."""
+        for kind, rows in groups.items():
+            ids = self.tables[kind].ids[rows].tolist()
+            self.index.update_many(ids, self.table_bounds(kind, rows))
+            for sid in ids:
+                self.touch(sid)
+            if self.guides is not None:
+                self.guides.update_many(ids)
+
+    def bounds(self, sid):
+        """Return the bounding box (x0, y0, x1, y1) of a shape."""
+        kind, row = self.rows[sid]
+        if kind in VERTEX_KINDS:
+            # For smooth paths the control polygon's box contains the curve
+            xy = self.shape_vertices(sid)
+            return (xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max())
+        return tuple(self.table_bounds(kind, np.array([row]))[0])
+
+    def table_bounds(self, kind, rows):
+        """Vectorized bounding boxes for rows of one table, shape (n, 4)."""
+        v = self.tables[kind].values[rows]
+        if kind in VERTEX_KINDS:
+            xy, offsets = self.gather_vertices(v)
+            return np.column_stack([np.minimum.reduceat(xy, offsets), np.maximum.reduceat(xy, offsets)])
+        if kind in ('ellipse', 'cone'):
+            rx, ry = np.abs(v[:, 2]) / 2, np.abs(v[:, 3]) / 2
+            boxes = np.column_stack([v[:, 0] - rx, v[:, 1] - ry, v[:, 0] + rx, v[:, 1] + ry])
+            if kind == 'cone':
+                xs, ys = v[:, [4, 6, 8]], v[:, [5, 7, 9]]
+                boxes[:, 0] = np.minimum(boxes[:, 0], xs.min(axis=1))
+                boxes[:, 1] = np.minimum(boxes[:, 1], ys.min(axis=1))
+                boxes[:, 2] = np.maximum(boxes[:, 2], xs.max(axis=1))
+                boxes[:, 3] = np.maximum(boxes[:, 3], ys.max(axis=1))
+            return boxes
+        if kind == 'rectangle':
+            x1, y1 = v[:, 0] + v[:, 2], v[:, 1] + v[:, 3]
+            return np.column_stack([np.minimum(v[:, 0], x1), np.minimum(v[:, 1], y1),
+                                    np.maximum(v[:, 0], x1), np.maximum(v[:, 1], y1)])
+        if kind == 'text':
+            return np.column_stack([v[:, 0], v[:, 1], v[:, 0], v[:, 1]])
+        return np.column_stack([np.minimum(v[:, 0], v[:, 2]), np.minimum(v[:, 1], v[:, 3]),
+                                np.maximum(v[:, 0], v[:, 2]), np.maximum(v[:, 1], v[:, 3])])
+
+    def gather_vertices(self, v):
+        """Concatenate the vertices of vertex-kind rows v; returns (xy, offset of each row in xy)."""
+        counts = v[:, 1].astype(np.int64)
+        return self.vertices[self.vertex_index(v)], np.cumsum(counts) - counts
+
+    def vertex_index(self, v):
+        """Positions in the vertex buffer of the vertices of vertex-kind rows v, in row order."""
+        starts, counts = v[:, 0].astype(np.int64), v[:, 1].astype(np.int64)
+        offsets = np.cumsum(counts) - counts
+        return np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+
+    def table_distances(self, kind, rows, x, y):
+        """Vectorized distance from (x, y) to the shapes in rows of one table."""
+        v = self.tables[kind].values[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if kind in ('line', 'arrow'):
+                return segment_distance(x, y, v[:, 0], v[:, 1], v[:, 2], v[:, 3])
+            if kind == 'ellipse':
+                return ellipse_distance(x, y, v)
+            if kind == 'rectangle':
+                return np.min(np.abs([x - v[:, 0], x - (v[:, 0] + v[:, 2]),
+                                      y - v[:, 1], y - (v[:, 1] + v[:, 3])]), axis=0)
+            if kind == 'text':
+                return np.hypot(x - v[:, 0], y - v[:, 1])
+            if kind == 'cone':
+                return np.min([ellipse_distance(x, y, v),
+                               segment_distance(x, y, v[:, 4], v[:, 5], v[:, 8], v[:, 9]),
+                               segment_distance(x, y, v[:, 6], v[:, 7], v[:, 8], v[:, 9])], axis=0)
+            distances = []
+            for start, count in v[:, :2].astype(int):
+                xy = self.vertices[start:start + count]
+                if kind == 'polygon':
+                    nxt = np.roll(xy, -1, axis=0)
+                elif count > 1:
+                    # Open path: measure against the polyline through its (control) points
+                    xy, nxt = xy[:-1], xy[1:]
+                else:
+                    nxt = xy
+                distances.append(segment_distance(x, y, xy[:, 0], xy[:, 1], nxt[:, 0], nxt[:, 1]).min())
+            return np.asarray(distances)
+
+    def nearest(self, x, y, ids):
+        """Return the id among ids closest to (x, y) and its distance, or (None, inf)."""
+        best, best_distance = None, float('inf')
+        for kind, rows in self.group_rows(ids).items():
+            distances = np.nan_to_num(self.table_distances(kind, rows, x, y), nan=np.inf)
+            i = int(np.argmin(distances))
+            if distances[i] < best_distance:
+                best_distance = float(distances[i])
+                best = int(self.tables[kind].ids[rows[i]])
+        return best, best_distance
+
+    def shapes_within(self, x, y, radius):
+        """Return the shape nearest to (x, y) if it lies within radius, else (None, inf)."""
+        best, distance = self.nearest(x, y, self.index.query(x, y, radius))
+        if distance < radius:
+            return best, distance
+        return None, float('inf')
+
+    def record(self, sid):
+        """Return a plain dict describing a shape, suitable for JSON."""
+        kind = self.kind(sid)
+        record = {'kind': kind, 'color': self.color(sid)}
+        if kind in VERTEX_KINDS:
+            record['vertices'] = self.shape_vertices(sid).tolist()
+            record.update(zip(COLUMNS[kind][2:], self.values(sid)[2:].tolist()))
+        else:
+            record.update(zip(COLUMNS[kind], self.values(sid).tolist()))
+        if kind == 'text':
+            record['text'] = self.text(sid)
+        return record
+
+    def to_records(self):
+        """Return every shape as a list of dicts in creation order."""
+        return [self.record(int(sid)) for sid in self.ids()]
+
+    def add_record(self, record, sid=None):
+        """Add a shape described by a dict produced by record()."""
+        kind = record['kind']
+        if kind not in COLUMNS:
+            raise ValueError(f"unknown shape kind {kind!r}")
+        color = record.get('color', 'black')
+        if kind in VERTEX_KINDS:
+            values = [float(record[column]) for column in COLUMNS[kind][2:]]
+            return self.add(kind, values, color, vertices=record['vertices'], sid=sid)
+        values = [float(record[column]) for column in COLUMNS[kind]]
+        return self.add(kind, values, color, text=record.get('text'), sid=sid)
+
+    @classmethod
+    def from_records(cls, records, cell_size=1.0):
+        """Build a scene from a list of shape dicts."""
+        scene = cls(cell_size=cell_size)
+        for record in records:
+            scene.add_record(record)
+        return scene
+
+    def to_columns(self):
+        """Return the live shapes as flat arrays, with the vertex buffer compacted.
+
+        The result is a dict with 'arrays' ({'<kind>.ids', '<kind>.colors', '<kind>.values',
+        'vertices'}), 'palette', 'strings' and 'next_id'; from_columns reverses it.
+        """
+        arrays = {}
+        vertex_parts, vertex_count = [], 0
+        for kind, table in self.tables.items():
+            rows = table.live_rows()
+            if not len(rows):
+                continue
+            values = table.values[rows]
+            if kind in VERTEX_KINDS:
+                xy, offsets = self.gather_vertices(values)
+                vertex_parts.append(xy)
+                values[:, 0] = offsets + vertex_count
+                vertex_count += len(xy)
+            arrays[f'{kind}.ids'] = table.ids[rows]
+            arrays[f'{kind}.colors'] = table.colors[rows]
+            arrays[f'{kind}.values'] = values
+        arrays['vertices'] = np.concatenate(vertex_parts) if vertex_parts else np.zeros((0, 2))
+        return {'arrays': arrays, 'palette': list(self.palette), 'strings': dict(self.strings),
+                'next_id': self.next_id}
+
+    def snapshot(self):
+        """Return an independent copy of the scene, with the same ids and stamps, e.g. for a worker thread."""
+        columns = self.to_columns()
+        copy = SceneModel.from_columns(columns['arrays'], columns['palette'], columns['strings'],
+                                       columns['next_id'], cell_size=self.index.cell_size)
+        copy.stamps = dict(self.stamps)
+        copy.revision = self.revision
+        return copy
+
+    @classmethod
+    def from_columns(cls, arrays, palette, strings, next_id, cell_size=1.0):
+        """Build a scene from the output of to_columns without adding shapes one by one."""
+        scene = cls(cell_size=cell_size)
+        scene.palette = list(palette)
+        scene.palette_index = {color: code for code, color in enumerate(scene.palette)}
+        vertices = np.array(arrays.get('vertices', np.zeros((0, 2))), dtype=float).reshape(-1, 2)
+        scene.vertices = np.concatenate([vertices, np.zeros((16, 2))])
+        scene.vertex_count = len(vertices)
+        scene.revision = 1
+        for kind, table in scene.tables.items():
+            ids = arrays.get(f'{kind}.ids')
+            if ids is None or not len(ids):
+                continue
+            n = len(ids)
+            table.grow(max(16, 2 * n))
+            table.values[:n] = arrays[f'{kind}.values']
+            table.ids[:n] = ids
+            table.colors[:n] = arrays[f'{kind}.colors']
+            table.alive[:n] = True
+            table.size = n
+            scene.rows.update(zip(table.ids[:n].tolist(), ((kind, row) for row in range(n))))
+            scene.index.insert_many(table.ids[:n], scene.table_bounds(kind, np.arange(n)))
+        scene.strings = {int(sid): text for sid, text in strings.items()}
+        scene.stamps = dict.fromkeys(scene.rows, scene.revision)
+        scene.next_id = max(next_id, max(scene.rows, default=-1) + 1)
+        return scene
+
+
+def segment_distance(px, py, x0, y0, x1, y1):
+    """Distance from a point to line segments given as coordinate arrays."""
+    dx, dy = x1 - x0, y1 - y0
+    length2 = dx * dx + dy * dy
+    t = np.where(length2 > 0, ((px - x0) * dx + (py - y0) * dy) / np.where(length2 > 0, length2, 1), 0)
+    t = np.clip(t, 0, 1)
+    return np.hypot(px - (x0 + t * dx), py - (y0 + t * dy))
+
+
+def ellipse_distance(px, py, v):
+    """Distance from (px, py) to the outlines of ellipses given as rows of cx, cy, width, height."""
+    xs, ys = ellipse_nearest_points(px, py, v[:, 0], v[:, 1], v[:, 2] / 2, v[:, 3] / 2)
+    return np.hypot(px - xs, py - ys)
+
+
+def arrow_parts(x0, y0, x1, y1):
+    """Return the shortened shaft end and arrowhead vertices, or (None, None) for short arrows."""
+    dx, dy = x1 - x0, y1 - y0
+    if np.hypot(dx, dy) <= ARROW_LENGTH:
+        return None, None
+    angle = np.arctan2(dy, dx)
+    cos, sin = np.cos(angle), np.sin(angle)
+    end = (x1 - ARROW_LENGTH * cos, y1 - ARROW_LENGTH * sin)
+    left = (end[0] - ARROW_WIDTH * sin, end[1] + ARROW_WIDTH * cos)
+    right = (end[0] + ARROW_WIDTH * sin, end[1] - ARROW_WIDTH * cos)
+    return end, [left, right, (x1, y1)]
@@ -0,0 +1,229 @@
+"""Endpoint snapping to ellipse outlines and rectangle corners, alignment guides and grid snapping."""
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+# Shape kinds that offer snap targets
+SNAP_KINDS = ('ellipse', 'rectangle', 'cone')
+# Shape kinds whose edges and centers are alignment guides
+GUIDE_KINDS = ('line', 'arrow', 'ellipse', 'rectangle', 'cone')
+
+
+class Snapper:
+    """Finds the nearest snap target using the scene's grid index, so lookups only touch nearby shapes."""
+
+    def __init__(self, scene, threshold=0.2):
+        self.scene = scene
+        self.threshold = threshold
+
+    def candidates(self, x, y, exclude=None):
+        """Group the snappable shapes near (x, y) into {kind: row index array}."""
+        ids = [sid for sid in self.scene.index.query(x, y, self.threshold)
+               if sid != exclude and self.scene.kind(sid) in SNAP_KINDS]
+        return self.scene.group_rows(ids)
+
+    def nearest_target(self, x, y, exclude=None):
+        """Return the closest snap target to (x, y) and its distance, or (None, inf)."""
+        best, best_distance = None, float('inf')
+        for kind, rows in self.candidates(x, y, exclude).items():
+            v = self.scene.tables[kind].values[rows]
+            if kind == 'rectangle':
+                xs = np.stack([v[:, 0], v[:, 0] + v[:, 2], v[:, 0] + v[:, 2], v[:, 0]], axis=1).ravel()
+                ys = np.stack([v[:, 1], v[:, 1], v[:, 1] + v[:, 3], v[:, 1] + v[:, 3]], axis=1).ravel()
+            else:
+                xs, ys = ellipse_nearest_points(x, y, v[:, 0], v[:, 1], v[:, 2] / 2, v[:, 3] / 2)
+            distances = np.hypot(xs - x, ys - y)
+            i = int(np.argmin(distances))
+            if distances[i] < best_distance:
+                best_distance = float(distances[i])
+                best = (float(xs[i]), float(ys[i]))
+        return best, best_distance
+
+    def snap(self, x, y, exclude=None):
+        """Return (x, y) moved onto the nearest target within the threshold, or unchanged."""
+        target, distance = self.nearest_target(x, y, exclude)
+        if target is not None and distance < self.threshold:
+            return target
+        return x, y
+
+
+class SortedCoordinates:
+    """Coordinates along one axis kept sorted, each with the shape it belongs to."""
+
+    def __init__(self):
+        self.values = []
+        self.owners = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def load(self, values, owners):
+        """Replace the contents with unsorted coordinates and their owners."""
+        order = np.argsort(values, kind='stable')
+        self.values = np.asarray(values)[order].tolist()
+        self.owners = np.asarray(owners)[order].tolist()
+
+    def insert(self, value, owner):
+        i = bisect_right(self.values, value)
+        self.values.insert(i, value)
+        self.owners.insert(i, owner)
+
+    def remove(self, value, owner):
+        i = bisect_left(self.values, value)
+        while self.owners[i] != owner:
+            i += 1
+        del self.values[i]
+        del self.owners[i]
+
+    def nearest(self, value, tolerance, exclude=()):
+        """Return the coordinate closest to value within tolerance, skipping excluded owners, or None.
+
+        Walks outwards from value in both directions, stopping at the first coordinate on each
+        side that is not excluded, so only excluded entries are ever stepped over.
+        """
+        values, owners = self.values, self.owners
+        above = bisect_left(values, value)
+        below = above - 1
+        while above < len(values) and owners[above] in exclude:
+            above += 1
+        while below >= 0 and owners[below] in exclude:
+            below -= 1
+        best = None
+        for j in (below, above):
+            if 0 <= j < len(values) and abs(values[j] - value) <= tolerance:
+                if best is None or abs(values[j] - value) < abs(best - value):
+                    best = values[j]
+        return best
+
+
+class AlignmentGuides:
+    """Left, center and right x and bottom, center and top y of every line, arrow, ellipse,
+    rectangle and cone, in one sorted list per axis, so a lookup is two bisections.
+
+    The scene reports which shapes changed and they are re-sorted lazily, at the next lookup
+    that does not exclude them: shapes being dragged are excluded from their own guides, so
+    they cost nothing per motion event and are put back in place once. When many shapes
+    changed at once, both lists are rebuilt from the scene tables instead, as they are on
+    the first lookup, so opening a drawing does not wait for them.
+    """
+
+    def __init__(self, scene, rebuild_fraction=0.05):
+        self.scene = scene
+        self.rebuild_fraction = rebuild_fraction
+        self.xs = SortedCoordinates()
+        self.ys = SortedCoordinates()
+        # Coordinates each shape currently has in the lists, to find and remove them;
+        # None until the lists are first built
+        self.keys = None
+        self.dirty = set()
+        scene.guides = self
+
+    def update(self, sid):
+        self.dirty.add(sid)
+
+    def update_many(self, ids):
+        self.dirty.update(ids)
+
+    def clear(self):
+        self.xs = SortedCoordinates()
+        self.ys = SortedCoordinates()
+        self.keys = {}
+        self.dirty = set()
+
+    def rebuild(self):
+        """Refill both lists from the scene tables, vectorized."""
+        ids, boxes = [], []
+        for kind in GUIDE_KINDS:
+            rows = self.scene.tables[kind].live_rows()
+            if len(rows):
+                ids.append(self.scene.tables[kind].ids[rows])
+                boxes.append(self.scene.table_bounds(kind, rows))
+        self.clear()
+        if not ids:
+            return
+        ids, boxes = np.concatenate(ids), np.concatenate(boxes)
+        xs = np.column_stack([boxes[:, 0], (boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 2]])
+        ys = np.column_stack([boxes[:, 1], (boxes[:, 1] + boxes[:, 3]) / 2, boxes[:, 3]])
+        self.xs.load(xs.ravel(), np.repeat(ids, 3))
+        self.ys.load(ys.ravel(), np.repeat(ids, 3))
+        self.keys = dict(zip(ids.tolist(), zip(map(tuple, xs.tolist()), map(tuple, ys.tolist()))))
+
+    def sync(self, exclude=()):
+        """Re-sort the changed shapes that are not excluded."""
+        if self.keys is None:
+            self.rebuild()
+        if not self.dirty:
+            return
+        changed = self.dirty.difference(exclude)
+        if len(changed) > self.rebuild_fraction * len(self.keys) + 64:
+            self.rebuild()
+            return
+        for sid in changed:
+            old = self.keys.pop(sid, None)
+            if old is not None:
+                for x in old[0]:
+                    self.xs.remove(x, sid)
+                for y in old[1]:
+                    self.ys.remove(y, sid)
+            if sid in self.scene and self.scene.kind(sid) in GUIDE_KINDS:
+                x0, y0, x1, y1 = (float(c) for c in self.scene.bounds(sid))
+                xs, ys = (x0, (x0 + x1) / 2, x1), (y0, (y0 + y1) / 2, y1)
+                for x in xs:
+                    self.xs.insert(x, sid)
+                for y in ys:
+                    self.ys.insert(y, sid)
+                self.keys[sid] = (xs, ys)
+        self.dirty.difference_update(changed)
+
+    def align(self, box, tolerance, exclude=()):
+        """Find the shift that lines up an edge or the center of box with the nearest guide.
+
+        Returns (dx, dy, guide_x, guide_y); an axis with no guide within tolerance gets a
+        shift of 0 and a guide of None.
+        """
+        self.sync(exclude)
+        x0, y0, x1, y1 = box
+        dx, guide_x = align_axis(self.xs, (x0, (x0 + x1) / 2, x1), tolerance, exclude)
+        dy, guide_y = align_axis(self.ys, (y0, (y0 + y1) / 2, y1), tolerance, exclude)
+        return dx, dy, guide_x, guide_y
+
+
+def align_axis(coordinates, features, tolerance, exclude):
+    """Return (shift, guide) bringing the feature closest to a guide onto it, or (0.0, None)."""
+    best_shift, best_guide = 0.0, None
+    for value in features:
+        guide = coordinates.nearest(value, tolerance, exclude)
+        if guide is not None and (best_guide is None or abs(guide - value) < abs(best_shift)):
+            best_shift, best_guide = guide - value, guide
+    return best_shift, best_guide
+
+
+def snap_to_grid(value, spacing):
+    """Round a coordinate to the nearest multiple of spacing."""
+    return round(value / spacing) * spacing
+
+
+def ellipse_nearest_points(px, py, cx, cy, a, b, iterations=10):
+    """Nearest point on axis-aligned ellipses to (px, py), vectorized over the ellipses.
+
+    Works in the first quadrant and iterates on the point's evolute (curvature centre),
+    which converges far below drawing precision in ten steps without sampling the outline.
+    """
+    a, b = np.abs(a), np.abs(b)
+    x, y = np.abs(px - cx), np.abs(py - cy)
+    tx = np.full(np.shape(a), np.sqrt(0.5))
+    ty = np.full(np.shape(a), np.sqrt(0.5))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(iterations):
+            ex = (a * a - b * b) * tx ** 3 / a
+            ey = (b * b - a * a) * ty ** 3 / b
+            rx, ry = a * tx - ex, b * ty - ey
+            qx, qy = x - ex, y - ey
+            scale = np.hypot(rx, ry) / np.hypot(qx, qy)
+            tx = np.clip((qx * scale + ex) / a, 0, 1)
+            ty = np.clip((qy * scale + ey) / b, 0, 1)
+            norm = np.hypot(tx, ty)
+            tx, ty = tx / norm, ty / norm
+    nx = np.nan_to_num(a * tx, nan=0.0)
+    ny = np.nan_to_num(b * ty, nan=0.0)
+    return cx + np.copysign(nx, px - cx), cy + np.copysign(ny, py - cy)
@@ -0,0 +1,198 @@
+"""Uniform grid index over shape bounding boxes, used for hit testing."""
+import math
+from collections import defaultdict
+
+import numpy as np
+
+
+class GridIndex:
+    def __init__(self, cell_size=1.0, max_cells=64):
+        self.cell_size = cell_size
+        self.cells = defaultdict(set)
+        self.bounds = {}
+        # Boxes covering more than max_cells cells are kept aside and checked directly,
+        # so one long line does not cost thousands of cell updates every time it moves
+        self.max_cells = max_cells
+        self.large = set()
+        # Grows as keys are inserted; never shrinks on removal, so it is only an upper bound
+        self.extent = None
+        # Keys and boxes handed to insert_many, added to the cells the first time they are needed
+        self.pending = None
+        # New boxes of keys moved by update_many, applied the same way
+        self.stale = {}
+
+    def __len__(self):
+        self.build()
+        return len(self.bounds)
+
+    def __contains__(self, key):
+        self.build()
+        return key in self.bounds
+
+    def cell_range(self, x0, y0, x1, y1):
+        """Return the integer cell ranges covered by a bounding box."""
+        size = self.cell_size
+        return (range(math.floor(x0 / size), math.floor(x1 / size) + 1),
+                range(math.floor(y0 / size), math.floor(y1 / size) + 1))
+
+    def insert(self, key, bbox):
+        """Add a key with bounding box (x0, y0, x1, y1), replacing any previous entry."""
+        self.build()
+        if key in self.bounds:
+            self.remove(key)
+        x0, y0, x1, y1 = bbox
+        bbox = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        self.bounds[key] = bbox
+        if self.extent is None:
+            self.extent = bbox
+        else:
+            self.extent = (min(self.extent[0], bbox[0]), min(self.extent[1], bbox[1]),
+                           max(self.extent[2], bbox[2]), max(self.extent[3], bbox[3]))
+        cols, rows = self.cell_range(*bbox)
+        if len(cols) * len(rows) > self.max_cells:
+            self.large.add(key)
+            return
+        for i in cols:
+            for j in rows:
+                self.cells[(i, j)].add(key)
+
+    def insert_many(self, keys, boxes):
+        """Add many new keys at once from an (n, 4) array of boxes.
+
+        The cells are filled lazily, by build(), so a large drawing can be loaded
+        without waiting for its index.
+        """
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        if not len(boxes):
+            return
+        boxes = np.column_stack([np.minimum(boxes[:, 0], boxes[:, 2]), np.minimum(boxes[:, 1], boxes[:, 3]),
+                                 np.maximum(boxes[:, 0], boxes[:, 2]), np.maximum(boxes[:, 1], boxes[:, 3])])
+        extent = (*boxes[:, :2].min(axis=0).tolist(), *boxes[:, 2:].max(axis=0).tolist())
+        if self.extent is not None:
+            extent = (min(self.extent[0], extent[0]), min(self.extent[1], extent[1]),
+                      max(self.extent[2], extent[2]), max(self.extent[3], extent[3]))
+        self.extent = extent
+        keys = np.asarray(keys)
+        if self.pending is not None:
+            keys = np.concatenate([self.pending[0], keys])
+            boxes = np.concatenate([self.pending[1], boxes])
+        self.pending = (keys, boxes)
+
+    def build(self):
+        """Add the keys from insert_many to the cells, vectorized over the whole batch, then apply update_many."""
+        if self.pending is None:
+            if self.stale:
+                stale, self.stale = self.stale, {}
+                for key, bbox in stale.items():
+                    self.insert(key, bbox)
+            return
+        keys, boxes = self.pending
+        self.pending = None
+        self.bounds.update(zip(keys.tolist(), map(tuple, boxes.tolist())))
+        lo = np.floor(boxes[:, :2] / self.cell_size).astype(np.int64)
+        span = np.floor(boxes[:, 2:] / self.cell_size).astype(np.int64) - lo + 1
+        counts = span[:, 0] * span[:, 1]
+        large = counts > self.max_cells
+        self.large.update(keys[large].tolist())
+        # One (cell, key) pair per covered cell, sorted so each cell's keys are contiguous
+        small = np.flatnonzero(~large)
+        counts = counts[small]
+        owner = np.repeat(small, counts)
+        k = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        i = lo[owner, 0] + k // span[owner, 1]
+        j = lo[owner, 1] + k % span[owner, 1]
+        order = np.lexsort((j, i))
+        i, j, owners = i[order], j[order], keys[owner[order]].tolist()
+        starts = np.flatnonzero(np.r_[True, (i[1:] != i[:-1]) | (j[1:] != j[:-1])])
+        ends = np.r_[starts[1:], len(i)]
+        for start, end, ci, cj in zip(starts.tolist(), ends.tolist(), i[starts].tolist(), j[starts].tolist()):
+            self.cells[(ci, cj)].update(owners[start:end])
+        self.build()
+
+    def update(self, key, bbox):
+        """Move a key to a new bounding box."""
+        self.insert(key, bbox)
+
+    def update_many(self, keys, boxes):
+        """Move many keys at once, e.g. a dragged group.
+
+        Only the extent is updated now; the cells are updated by build(), so a drag through
+        many motion events costs one reindex when the index is next queried.
+        """
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        if not len(boxes):
+            return
+        low = np.minimum(boxes[:, :2], boxes[:, 2:]).min(axis=0).tolist()
+        high = np.maximum(boxes[:, :2], boxes[:, 2:]).max(axis=0).tolist()
+        if self.extent is not None:
+            low = [min(low[0], self.extent[0]), min(low[1], self.extent[1])]
+            high = [max(high[0], self.extent[2]), max(high[1], self.extent[3])]
+        self.extent = (*low, *high)
+        self.stale.update(zip(keys, map(tuple, boxes.tolist())))
+
+    def remove(self, key):
+        """Remove a key from the index; unknown keys are ignored."""
+        self.build()
+        bbox = self.bounds.pop(key, None)
+        if bbox is None:
+            return
+        if key in self.large:
+            self.large.discard(key)
+            return
+        cols, rows = self.cell_range(*bbox)
+        for i in cols:
+            for j in rows:
+                cell = self.cells.get((i, j))
+                if cell is not None:
+                    cell.discard(key)
+                    if not cell:
+                        del self.cells[(i, j)]
+
+    def clear(self):
+        """Remove every key."""
+        self.pending = None
+        self.stale.clear()
+        self.cells.clear()
+        self.bounds.clear()
+        self.large.clear()
+        self.extent = None
+
+    def candidates(self, x0, y0, x1, y1):
+        """Return the keys in the cells a box covers, plus the large ones."""
+        self.build()
+        found = set(self.large)
+        cols, rows = self.cell_range(x0, y0, x1, y1)
+        if len(cols) * len(rows) > len(self.cells):
+            # Large box: walking the occupied cells is cheaper than walking the range
+            for (i, j), cell in self.cells.items():
+                if i in cols and j in rows:
+                    found.update(cell)
+        else:
+            for i in cols:
+                for j in rows:
+                    cell = self.cells.get((i, j))
+                    if cell:
+                        found.update(cell)
+        return found
+
+    def query(self, x, y, radius=0.0):
+        """Return the keys whose bounding box lies within radius of the point (x, y)."""
+        found = self.candidates(x - radius, y - radius, x + radius, y + radius)
+        return {key for key in found if self.box_distance(self.bounds[key], x, y) <= radius}
+
+    def query_box(self, x0, y0, x1, y1):
+        """Return the keys whose bounding box lies entirely inside the box (x0, y0, x1, y1)."""
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        found = self.candidates(x0, y0, x1, y1)
+        bounds = self.bounds
+        return {key for key in found
+                if bounds[key][0] >= x0 and bounds[key][1] >= y0 and bounds[key][2] <= x1 and bounds[key][3] <= y1}
+
+    @staticmethod
+    def box_distance(bbox, x, y):
+        """Distance from a point to a bounding box (zero when inside)."""
+        x0, y0, x1, y1 = bbox
+        dx = max(x0 - x, 0.0, x - x1)
+        dy = max(y0 - y, 0.0, y - y1)
+        return math.hypot(dx, dy)
@@ -0,0 +1,56 @@
+"""Cached size of text labels, for hit testing and partial redraws without a layout pass."""
+from matplotlib import cbook
+from matplotlib.backends.backend_agg import RendererAgg
+from matplotlib.font_manager import FontProperties
+
+
+class TextExtents:
+    """Measures strings once per (text, font, size) and reuses the result.
+
+    Sizes are in points relative to the text's anchor, laid out the way the editor draws
+    labels: left aligned on the baseline, inside a bbox padded by pad times the font size.
+    Multiply by dpi / 72 for pixels; the same cached box serves every zoom level and dpi.
+    """
+
+    def __init__(self, fontsize=12, family=None, pad=0.5):
+        self.fontsize = fontsize
+        self.pad = pad
+        # Without a family, labels use matplotlib's default font, as the editor's text artists do
+        self.prop = FontProperties(family=family, size=fontsize)
+        self.family = tuple(self.prop.get_family())
+        # Agg reports whole pixels, so strings are measured at ten pixels per point
+        self.renderer = RendererAgg(1, 1, 720)
+        self.cache = {}
+        # Largest size of any label seen so far, so hit tests know how far from an anchor to look
+        self.reach = 0.0
+        # Like matplotlib, every line is at least as tall as "lp"
+        _, height, descent = self.measure('lp')
+        self.line_ascent, self.line_descent = height - descent, descent
+
+    def measure(self, text):
+        """Return (width, height, descent) of a string in points."""
+        key = (text, self.family, self.fontsize)
+        size = self.cache.get(key)
+        if size is None:
+            if text:
+                size = self.renderer.get_text_width_height_descent(text, self.prop, cbook.is_math_text(text))
+                size = tuple(float(x) / 10 for x in size)
+            else:
+                size = (0.0, 0.0, 0.0)
+            self.cache[key] = size
+        return size
+
+    def expect(self, text):
+        """Widen reach to cover a label without measuring it yet; no glyph is wider than an em."""
+        pad = self.pad * self.fontsize
+        self.reach = max(self.reach, len(text) * self.fontsize + 2 * pad)
+
+    def box(self, text):
+        """Return (x0, y0, x1, y1), the padded box of a label in points from its anchor."""
+        width, height, descent = self.measure(text)
+        ascent = max(height - descent, self.line_ascent)
+        descent = max(descent, self.line_descent)
+        pad = self.pad * self.fontsize
+        box = (-pad, -descent - pad, width + pad, ascent + pad)
+        self.reach = max(self.reach, box[2] - box[0], box[3] - box[1])
+        return box
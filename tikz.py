@@ -0,0 +1,248 @@
+"""TikZ emission for a SceneModel; needs neither Tk nor matplotlib."""
+from scene import arrow_parts
+
+
+def point(x, y):
+    return f"({float(x)}, {float(y)})"
+
+
+def number(x, precision):
+    """Format x rounded to precision decimals, without trailing zeros."""
+    text = f"{float(x):.{precision}f}"
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+
+def short_point(x, y, precision):
+    return f"({number(x, precision)},{number(y, precision)})"
+
+
+def shape_pieces(scene, sid, precision):
+    """Break one shape into colorless pieces for the optimized output.
+
+    Returns a list of (kind, data): ('chain', [points]) for polylines that may be joined
+    with others, ('draw', subpath) for other stroked subpaths, ('fill', subpath) for
+    filled ones and ('node', text) for labels. Points are already rounded to text.
+    """
+    kind = scene.kind(sid)
+    v = scene.values(sid)
+
+    def p(x, y):
+        return short_point(x, y, precision)
+
+    def ellipse(v):
+        return f"{p(v[0], v[1])} ellipse ({number(abs(v[2]) / 2, precision)} and {number(abs(v[3]) / 2, precision)})"
+
+    if kind == 'line':
+        return [('chain', [p(v[0], v[1]), p(v[2], v[3])])]
+    elif kind == 'arrow':
+        end, head = arrow_parts(*v)
+        if end is None:
+            return [('chain', [p(v[0], v[1]), p(v[2], v[3])])]
+        return [('chain', [p(v[0], v[1]), p(*end)]),
+                ('fill', " -- ".join(p(x, y) for x, y in head) + " -- cycle")]
+    elif kind == 'ellipse':
+        return [('draw', ellipse(v))]
+    elif kind == 'rectangle':
+        return [('draw', f"{p(v[0], v[1])} rectangle {p(v[0] + v[2], v[1] + v[3])}")]
+    elif kind == 'polygon':
+        return [('fill', " -- ".join(p(x, y) for x, y in scene.shape_vertices(sid)) + " -- cycle")]
+    elif kind == 'path':
+        vertices = scene.shape_vertices(sid)
+        if v[2] and len(vertices) >= 4:
+            segments = [f" .. controls {p(*vertices[i + 1])} and {p(*vertices[i + 2])} .. {p(*vertices[i + 3])}"
+                        for i in range(0, len(vertices) - 3, 3)]
+            return [('draw', p(*vertices[0]) + "".join(segments))]
+        return [('chain', [p(x, y) for x, y in vertices])]
+    elif kind == 'text':
+        return [('node', f"at {p(v[0], v[1])} {{{scene.text(sid)}}}")]
+    elif kind == 'cone':
+        # The base ellipse and both sides are one path
+        return [('draw', f"{ellipse(v)} {p(v[4], v[5])} -- {p(v[8], v[9])} -- {p(v[6], v[7])}")]
+    return []
+
+
+def join_chains(chains):
+    """Join polylines that share endpoints into as few polylines as possible; closed ones end in cycle."""
+    ends = {}
+    for i, chain in enumerate(chains):
+        ends.setdefault(chain[0], set()).add(i)
+        ends.setdefault(chain[-1], set()).add(i)
+    used = [False] * len(chains)
+
+    def take(point):
+        # Return an unused chain touching point, oriented to start there
+        for i in ends.get(point, ()):
+            if not used[i]:
+                used[i] = True
+                chain = chains[i]
+                return chain if chain[0] == point else chain[::-1]
+        return None
+
+    joined = []
+    for i, chain in enumerate(chains):
+        if used[i]:
+            continue
+        used[i] = True
+        path = list(chain)
+        while (following := take(path[-1])) is not None:
+            path.extend(following[1:])
+        while (preceding := take(path[0])) is not None:
+            path[:0] = preceding[::-1][:-1]
+        if len(path) > 2 and path[0] == path[-1]:
+            path[-1] = 'cycle'
+        joined.append(path)
+    return joined
+
+
+def shape_to_tikz(scene, sid, color=None):
+    """Return the TikZ lines for one shape. color overrides the shape's own color when given."""
+    kind = scene.kind(sid)
+    color_name = color or scene.color(sid)
+    v = scene.values(sid)
+    if kind == 'line':
+        return [f"\\draw [color={color_name}] {point(v[0], v[1])} -- {point(v[2], v[3])};"]
+    elif kind == 'arrow':
+        end, head = arrow_parts(*v)
+        if end is None:
+            return [f"\\draw [color={color_name}] {point(v[0], v[1])} -- {point(v[2], v[3])};"]
+        return [f"\\draw [color={color_name}] {point(v[0], v[1])} -- {point(*end)};",
+                f"\\fill [color={color_name}] " + " -- ".join(point(x, y) for x, y in head) + " -- cycle;"]
+    elif kind == 'ellipse':
+        return [f"\\draw [color={color_name}] {point(v[0], v[1])} ellipse ({float(v[2]) / 2} and {float(v[3]) / 2});"]
+    elif kind == 'rectangle':
+        return [f"\\draw [color={color_name}] {point(v[0], v[1])} rectangle {point(v[0] + v[2], v[1] + v[3])};"]
+    elif kind == 'polygon':
+        vertices = scene.shape_vertices(sid)
+        return [f"\\fill [color={color_name}] " + " -- ".join(point(x, y) for x, y in vertices) + " -- cycle;"]
+    elif kind == 'path':
+        vertices = scene.shape_vertices(sid)
+        if v[2] and len(vertices) >= 4:
+            segments = [f" .. controls {point(*vertices[i + 1])} and {point(*vertices[i + 2])} .. {point(*vertices[i + 3])}"
+                        for i in range(0, len(vertices) - 3, 3)]
+            return [f"\\draw [color={color_name}] {point(*vertices[0])}" + "".join(segments) + ";"]
+        return [f"\\draw [color={color_name}] " + " -- ".join(point(x, y) for x, y in vertices) + ";"]
+    elif kind == 'text':
+        return [f"\\node at {point(v[0], v[1])} [{color_name}] {{{scene.text(sid)}}};"]
+    elif kind == 'cone':
+        return [f"\\draw [color={color_name}] {point(v[0], v[1])} ellipse ({float(v[2]) / 2} and {float(v[3]) / 2});",
+                f"\\draw [color={color_name}] {point(v[4], v[5])} -- {point(v[8], v[9])};",
+                f"\\draw [color={color_name}] {point(v[6], v[7])} -- {point(v[8], v[9])};"]
+    return []
+
+
+class TikzExporter:
+    """Caches each shape's TikZ fragment until the shape changes.
+
+    With optimize, consecutive shapes of one color share a scope instead of repeating
+    their color, coordinates are rounded to precision decimals, polylines that meet
+    are joined, and all stroked subpaths of a scope go into one \\draw. Shapes keep
+    their creation order across colors, so overlaps render as before. Without optimize
+    every shape becomes its own commands at full precision.
+    """
+
+    def __init__(self, scene, cache=None, optimize=True, precision=3, max_run=1000):
+        self.scene = scene
+        # Exporters over snapshots of the same scene can share one cache, since stamps carry over
+        self.cache = {} if cache is None else cache
+        self.optimize = optimize
+        self.precision = precision
+        # Longer runs of one color are split so progress can be reported between them
+        self.max_run = max_run
+        self.done = 0
+
+    def fragment(self, sid, color=None):
+        """Return the TikZ text for one shape, reusing the cached copy when it is still current."""
+        key = (self.scene.stamp(sid), color)
+        entry = self.cache.get(sid)
+        if entry is None or entry[0] != key:
+            entry = (key, "\n".join(shape_to_tikz(self.scene, sid, color)))
+            self.cache[sid] = entry
+        return entry[1]
+
+    def pieces(self, sid):
+        """Return the cached shape_pieces of a shape."""
+        key = (self.scene.stamp(sid), 'pieces', self.precision)
+        entry = self.cache.get(sid)
+        if entry is None or entry[0] != key:
+            entry = (key, shape_pieces(self.scene, sid, self.precision))
+            self.cache[sid] = entry
+        return entry[1]
+
+    def run_to_tikz(self, ids, color):
+        """Emit a run of shapes of one color as a scope, or a single styled command."""
+        chains, draws, fills, nodes = [], [], [], []
+        for sid in ids:
+            for kind, data in self.pieces(sid):
+                if kind == 'chain':
+                    chains.append(data)
+                elif kind == 'draw':
+                    draws.append(data)
+                elif kind == 'fill':
+                    fills.append(data)
+                else:
+                    nodes.append(data)
+        draws = [" -- ".join(chain) for chain in join_chains(chains)] + draws
+        # Fills stay separate: under the nonzero rule, overlapping subpaths of one \fill can cancel out
+        commands = ([("\\draw", "\n  ".join(draws))] if draws else []) + \
+            [("\\fill", fill) for fill in fills] + [("\\node", node) for node in nodes]
+        if len(commands) == 1:
+            command, body = commands[0]
+            return f"{command} [color={color}] {body};\n"
+        lines = "".join(f"{command} {body};\n" for command, body in commands)
+        return f"\\begin{{scope}}[color={color}]\n{lines}\\end{{scope}}\n"
+
+    def iter_runs(self, color=None):
+        """Yield (color, ids) for consecutive shapes sharing a color, at most max_run at a time."""
+        run, run_color = [], None
+        for sid in self.scene.ids().tolist():
+            shape_color = color or self.scene.color(sid)
+            if run and (shape_color != run_color or len(run) >= self.max_run):
+                yield run_color, run
+                run = []
+            run.append(sid)
+            run_color = shape_color
+        if run:
+            yield run_color, run
+
+    def prune(self):
+        """Forget fragments of shapes that are no longer in the scene."""
+        for sid in [sid for sid in self.cache if sid not in self.scene]:
+            del self.cache[sid]
+
+    def iter_chunks(self, color=None):
+        """Yield the tikzpicture piece by piece: one shape, or with optimize one run, at a time.
+
+        self.done counts the shapes emitted so far, for progress reporting.
+        """
+        if len(self.cache) > len(self.scene):
+            self.prune()
+        self.done = 0
+        yield "\\begin{tikzpicture}\n"
+        if self.optimize:
+            for run_color, ids in self.iter_runs(color):
+                text = self.run_to_tikz(ids, run_color)
+                self.done += len(ids)
+                yield text
+        else:
+            for sid in self.scene.ids():
+                text = self.fragment(int(sid), color)
+                self.done += 1
+                if text:
+                    yield text + "\n"
+        yield "\\end{tikzpicture}"
+
+    def to_string(self, color=None):
+        """Assemble the whole tikzpicture with a single join."""
+        return "".join(self.iter_chunks(color))
+
+    def write(self, stream, color=None):
+        """Stream the tikzpicture to a file-like object without building it in memory."""
+        for chunk in self.iter_chunks(color):
+            stream.write(chunk)
+
+
+def scene_to_tikz(scene, color=None, optimize=True, precision=3):
+    """Generate a complete tikzpicture for every shape in the scene."""
+    return TikzExporter(scene, optimize=optimize, precision=precision).to_string(color)
@@ -0,0 +1,485 @@
+"""Read tikzpicture code in the format TikzExporter writes back into shape records.
+
+Usage:
+    python tikz_import.py figures/ "chapters/**/*.tex" -j 4
+
+Files are tokenized as a stream, so large documents are never held in memory whole.
+Supported are \\draw and \\fill paths built from --, .. controls .. and .., ellipse,
+rectangle and cycle, \\node at ... {text}, colors given as [color=...] or [name], arrows
+given as [->] or [<-], and color scopes. Other statements are skipped and counted. Run from the command line it
+checks that every picture in a .tex tree survives a round trip through the editor's
+exporter unchanged.
+"""
+import argparse
+import glob
+import io
+import math
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from scene import ARROW_LENGTH, ARROW_WIDTH, SceneModel
+from tikz import TikzExporter
+
+TOKEN = re.compile(r"""
+    (?P<space>\s+|(?<!\\)%[^\n]*)
+  | (?P<command>\\[A-Za-z]+)
+  | (?P<coord>\([^()]*\))
+  | (?P<options>\[[^\]]*\])
+  | (?P<group>\{(?:[^{}]|\{[^{}]*\})*\})
+  | (?P<op>--|\.\.|;)
+  | (?P<word>[A-Za-z]+)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+CLOSERS = {'(': ')', '[': ']', '{': '}'}
+
+COLOR_OPTION = re.compile(r'(?:^|,)\s*(?:color\s*=\s*)?([A-Za-z][\w!.]*)\s*(?:,|$)')
+
+# An arrow option such as ->, <-, -latex or -{Stealth}, split into its start and end tips
+TIP = r'(<|>|\||latex|stealth|to|\{[^{}]*\})?'
+ARROW_OPTION = re.compile(TIP + '-' + TIP)
+
+# Tolerance for recognising arrowheads in coordinates rounded by the exporter
+ARROW_TOLERANCE = 0.01
+
+
+def tokenize(stream, chunk_size=1 << 16):
+    """Yield (kind, text) tokens from a file-like object, reading it a chunk at a time."""
+    buffer = ''
+    eof = False
+    while True:
+        if not eof:
+            data = stream.read(chunk_size)
+            eof = not data
+            buffer += data
+        position = 0
+        while position < len(buffer):
+            match = TOKEN.match(buffer, position)
+            kind = match.lastgroup
+            # A token touching the end of the buffer, or an opener whose closer is not in it yet,
+            # may continue in the next chunk
+            if not eof and (match.end() == len(buffer) or
+                            (kind == 'other' and match.group() in CLOSERS and
+                             buffer.find(CLOSERS[match.group()], position) < 0)):
+                break
+            if kind != 'space':
+                yield kind, match.group()
+            position = match.end()
+        buffer = buffer[position:]
+        if eof:
+            return
+
+
+def parse_point(text):
+    """Turn '(x, y)' into a float pair; None for anything else, e.g. polar or named coordinates."""
+    parts = text[1:-1].split(',')
+    if len(parts) != 2:
+        return None
+    try:
+        return float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+
+
+def parse_radii(text):
+    """Turn '(a and b)' into a float pair."""
+    parts = text[1:-1].split(' and ')
+    if len(parts) != 2:
+        return None
+    try:
+        return float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+
+
+def option_color(options, default):
+    """Return the color named in an options string such as [color=red, thick] or [red]."""
+    match = COLOR_OPTION.search(options[1:-1])
+    return match.group(1) if match else default
+
+
+def option_tip(options):
+    """Return which end of the path an options string puts an arrowhead on: 'start', 'end', 'both' or None."""
+    for option in options[1:-1].split(','):
+        match = ARROW_OPTION.fullmatch(option.strip())
+        if match and any(match.groups()):
+            start, end = match.groups()
+            return 'both' if start and end else 'start' if start else 'end'
+    return None
+
+
+def parse_path(tokens):
+    """Parse the body of a \\draw or \\fill into primitives.
+
+    Returns a list of ('chain', points, closed, smooth), ('ellipse', center, radii) and
+    ('rectangle', corner, corner), or None if the path uses anything unsupported.
+    """
+    primitives = []
+    chain = None
+    i = 0
+    n = len(tokens)
+
+    def close_chain():
+        if chain is not None and len(chain[1]) > 1:
+            primitives.append(tuple(chain))
+
+    while i < n:
+        kind, text = tokens[i]
+        if kind == 'coord':
+            point = parse_point(text)
+            if point is None:
+                return None
+            close_chain()
+            chain = ['chain', [point], False, False]
+            i += 1
+        elif text == '--' and chain is not None and i + 1 < n:
+            kind, text = tokens[i + 1]
+            if text == 'cycle':
+                chain[2] = True
+            elif kind == 'coord' and parse_point(text) is not None:
+                chain[1].append(parse_point(text))
+            else:
+                return None
+            i += 2
+        elif text == '..' and chain is not None and i + 6 < n:
+            # .. controls (c1) and (c2) .. (p)
+            words = [tokens[i + 1][1], tokens[i + 3][1], tokens[i + 5][1]]
+            points = [parse_point(tokens[i + k][1]) for k in (2, 4, 6)]
+            if words != ['controls', 'and', '..'] or None in points:
+                return None
+            chain[1].extend(points)
+            chain[3] = True
+            i += 7
+        elif text in ('ellipse', 'rectangle') and chain is not None and i + 1 < n:
+            center = chain[1][-1]
+            chain[1].pop()
+            if text == 'ellipse':
+                radii = parse_radii(tokens[i + 1][1])
+                if radii is None:
+                    return None
+                close_chain()
+                primitives.append(('ellipse', center, radii))
+                chain = None
+            else:
+                corner = parse_point(tokens[i + 1][1])
+                if corner is None:
+                    return None
+                close_chain()
+                primitives.append(('rectangle', center, corner))
+                chain = ['chain', [corner], False, False]
+            i += 2
+        else:
+            return None
+    close_chain()
+    return primitives
+
+
+def draw_records(primitives, color, tip=None):
+    """Records for the primitives of a \\draw; a cone is an ellipse followed by a three-point chain.
+
+    With tip 'end' or 'start', from [->] or [<-], the last or first segment of the path becomes
+    an arrow. Returns None if that segment is not a straight one the editor can draw as an arrow.
+    """
+    arrow = None
+    if tip is not None:
+        index = -1 if tip == 'end' else 0
+        if tip not in ('start', 'end') or not primitives or primitives[index][0] != 'chain' or any(primitives[index][2:]):
+            return None
+        points = primitives[index][1] if tip == 'end' else primitives[index][1][::-1]
+        (x0, y0), (x1, y1) = points[-2:]
+        arrow = {'kind': 'arrow', 'color': color, 'x0': x0, 'y0': y0, 'x1': x1, 'y1': y1}
+        rest = points[:-1] if tip == 'end' else points[:-1][::-1]
+        primitives = list(primitives)
+        if len(rest) > 1:
+            primitives[index] = ('chain', rest, False, False)
+        else:
+            del primitives[index]
+    records = []
+    i = 0
+    while i < len(primitives):
+        primitive = primitives[i]
+        if primitive[0] == 'ellipse':
+            (cx, cy), (a, b) = primitive[1], primitive[2]
+            following = primitives[i + 1] if i + 1 < len(primitives) else None
+            if following and following[0] == 'chain' and len(following[1]) == 3 and not (following[2] or following[3]):
+                (lx, ly), (ax, ay), (rx, ry) = following[1]
+                records.append({'kind': 'cone', 'color': color, 'cx': cx, 'cy': cy, 'width': 2 * a, 'height': 2 * b,
+                                'lx': lx, 'ly': ly, 'rx': rx, 'ry': ry, 'ax': ax, 'ay': ay})
+                i += 2
+                continue
+            records.append({'kind': 'ellipse', 'color': color, 'cx': cx, 'cy': cy, 'width': 2 * a, 'height': 2 * b})
+        elif primitive[0] == 'rectangle':
+            (x0, y0), (x1, y1) = primitive[1], primitive[2]
+            records.append({'kind': 'rectangle', 'color': color, 'x': x0, 'y': y0, 'width': x1 - x0, 'height': y1 - y0})
+        else:
+            _, points, closed, smooth = primitive
+            if closed and not smooth:
+                points = points + [points[0]]
+            if len(points) == 2:
+                (x0, y0), (x1, y1) = points
+                records.append({'kind': 'line', 'color': color, 'x0': x0, 'y0': y0, 'x1': x1, 'y1': y1})
+            else:
+                records.append({'kind': 'path', 'color': color, 'vertices': [list(p) for p in points],
+                                'smooth': 1.0 if smooth else 0.0})
+        i += 1
+    if arrow is not None:
+        records.insert(len(records) if tip == 'end' else 0, arrow)
+    return records
+
+
+def fill_records(primitives, color):
+    """Records for the primitives of a \\fill: each closed chain is a polygon."""
+    records = []
+    for primitive in primitives:
+        if primitive[0] != 'chain' or primitive[3]:
+            return None
+        points = primitive[1]
+        if len(points) > 2 and points[0] == points[-1]:
+            points = points[:-1]
+        records.append({'kind': 'polygon', 'color': color, 'vertices': [list(p) for p in points]})
+    return records
+
+
+def node_record(tokens, color):
+    """Record for \\node [options] at (x, y) [options] {text}."""
+    point, text = None, None
+    for i, (kind, value) in enumerate(tokens):
+        if kind == 'options':
+            color = option_color(value, color)
+        elif kind == 'word' and value == 'at' and i + 1 < len(tokens):
+            point = parse_point(tokens[i + 1][1])
+        elif kind == 'group':
+            text = value[1:-1]
+    if point is None or text is None:
+        return None
+    return {'kind': 'text', 'color': color, 'x': point[0], 'y': point[1], 'text': text}
+
+
+def recognise_shapes(records):
+    """Rebuild arrows and old-style cones that the exporter wrote as separate commands."""
+    # Cones from the unoptimized exporter: an ellipse, then one line from each base point to the apex
+    merged = []
+    i = 0
+    while i < len(records):
+        r = records[i]
+        if r['kind'] == 'ellipse' and i + 2 < len(records):
+            left, right = records[i + 1], records[i + 2]
+            if (left['kind'] == right['kind'] == 'line' and left['color'] == right['color'] == r['color']
+                    and (left['x1'], left['y1']) == (right['x1'], right['y1'])):
+                merged.append({'kind': 'cone', 'color': r['color'], 'cx': r['cx'], 'cy': r['cy'],
+                               'width': r['width'], 'height': r['height'], 'lx': left['x0'], 'ly': left['y0'],
+                               'rx': right['x0'], 'ry': right['y0'], 'ax': left['x1'], 'ay': left['y1']})
+                i += 3
+                continue
+        merged.append(r)
+        i += 1
+    records = merged
+
+    # Arrowheads: a filled triangle whose base midpoint is the end of a line or straight path
+    ends = {}
+    for index, r in enumerate(records):
+        if r['kind'] == 'line':
+            points = [(r['x0'], r['y0']), (r['x1'], r['y1'])]
+        elif r['kind'] == 'path' and not r['smooth']:
+            points = [tuple(r['vertices'][0]), tuple(r['vertices'][-1])]
+        else:
+            continue
+        for end, point in enumerate(points):
+            ends.setdefault(grid_key(*point), []).append((index, end))
+    removed = set()
+    for index, r in enumerate(records):
+        if r['kind'] != 'polygon' or len(r['vertices']) != 3:
+            continue
+        (lx, ly), (rx, ry), (tx, ty) = r['vertices']
+        mx, my = (lx + rx) / 2, (ly + ry) / 2
+        if (abs(math.hypot(tx - mx, ty - my) - ARROW_LENGTH) > ARROW_TOLERANCE
+                or abs(math.hypot(lx - rx, ly - ry) - 2 * ARROW_WIDTH) > ARROW_TOLERANCE):
+            continue
+        shaft = find_end(records, ends, removed, mx, my, r['color'])
+        if shaft is None:
+            continue
+        line_index, end = shaft
+        line = records[line_index]
+        if line['kind'] == 'line':
+            start = (line['x1'], line['y1']) if end == 0 else (line['x0'], line['y0'])
+            removed.add(line_index)
+        else:
+            # The shaft was joined with other lines into a polyline: split it off the end
+            vertices = line['vertices'] if end == 1 else line['vertices'][::-1]
+            start = tuple(vertices[-2])
+            if len(vertices) == 2:
+                removed.add(line_index)
+            elif len(vertices) == 3:
+                (x0, y0), (x1, y1) = vertices[:2]
+                records[line_index] = {'kind': 'line', 'color': line['color'], 'x0': x0, 'y0': y0, 'x1': x1, 'y1': y1}
+            else:
+                line['vertices'] = vertices[:-1]
+            # The new end may carry the shaft of another arrow
+            ends.setdefault(grid_key(*start), []).append((line_index, 1))
+        records[index] = {'kind': 'arrow', 'color': r['color'], 'x0': start[0], 'y0': start[1], 'x1': tx, 'y1': ty}
+    return [r for index, r in enumerate(records) if index not in removed]
+
+
+def grid_key(x, y):
+    return (round(x / ARROW_TOLERANCE), round(y / ARROW_TOLERANCE))
+
+
+def find_end(records, ends, removed, x, y, color):
+    """Find a line or path end of the given color within ARROW_TOLERANCE of (x, y)."""
+    kx, ky = grid_key(x, y)
+    for i in (kx - 1, kx, kx + 1):
+        for j in (ky - 1, ky, ky + 1):
+            for index, end in ends.get((i, j), ()):
+                r = records[index]
+                if index in removed or r['color'] != color or r['kind'] not in ('line', 'path'):
+                    continue
+                if r['kind'] == 'line':
+                    px, py = (r['x0'], r['y0']) if end == 0 else (r['x1'], r['y1'])
+                else:
+                    px, py = r['vertices'][0] if end == 0 else r['vertices'][-1]
+                if math.hypot(px - x, py - y) <= ARROW_TOLERANCE:
+                    return index, end
+    return None
+
+
+def read_pictures(stream):
+    """Yield (records, skipped) for each tikzpicture in a stream, where skipped counts unsupported statements."""
+    tokens = tokenize(stream)
+    pushed = []
+
+    def take():
+        return pushed.pop() if pushed else next(tokens, None)
+
+    records, skipped, colors = None, 0, []
+    while (token := take()) is not None:
+        kind, text = token
+        if kind == 'command' and text in ('\\begin', '\\end'):
+            name = take() or (None, '')
+            if name[1] == '{tikzpicture}':
+                if text == '\\begin':
+                    records, skipped, colors = [], 0, ['black']
+                    options = take()
+                    if options is not None and options[0] != 'options':
+                        pushed.append(options)
+                elif records is not None:
+                    yield recognise_shapes(records), skipped
+                    records = None
+            elif name[1] == '{scope}' and records is not None:
+                if text == '\\begin':
+                    options = take()
+                    if options is not None and options[0] == 'options':
+                        colors.append(option_color(options[1], colors[-1]))
+                    else:
+                        colors.append(colors[-1])
+                        if options is not None:
+                            pushed.append(options)
+                elif len(colors) > 1:
+                    colors.pop()
+            continue
+        if records is None:
+            continue
+        # Collect the statement up to its semicolon, stopping early at an environment boundary
+        statement = [token]
+        while (token := take()) is not None and token[1] != ';':
+            if token[1] in ('\\begin', '\\end'):
+                pushed.append(token)
+                break
+            statement.append(token)
+        command, body = statement[0][1], statement[1:]
+        color, tip = colors[-1], None
+        if body and body[0][0] == 'options':
+            color = option_color(body[0][1], color)
+            tip = option_tip(body[0][1])
+            body = body[1:]
+        found = None
+        if command in ('\\draw', '\\fill'):
+            primitives = parse_path(body)
+            if primitives is not None:
+                found = draw_records(primitives, color, tip) if command == '\\draw' else fill_records(primitives, color)
+        elif command == '\\node':
+            record = node_record(statement[1:], colors[-1])
+            found = [record] if record else None
+        if found is None:
+            skipped += 1
+        else:
+            records.extend(found)
+
+
+def load_tikz(path, picture=0):
+    """Return the shape records of one tikzpicture in a .tex file."""
+    with open(path, encoding='utf-8') as f:
+        for index, (records, _) in enumerate(read_pictures(f)):
+            if index == picture:
+                return records
+    raise ValueError(f"{path} has no tikzpicture number {picture}")
+
+
+def check_file(path, precision=3):
+    """Parse every picture in a file and check it survives export and re-import unchanged.
+
+    Returns (status, seconds, message) like batch_convert.convert_file.
+    """
+    start = time.perf_counter()
+    try:
+        pictures = shapes = skipped = mismatched = 0
+        with open(path, encoding='utf-8') as f:
+            for records, picture_skipped in read_pictures(f):
+                pictures += 1
+                shapes += len(records)
+                skipped += picture_skipped
+                first = TikzExporter(SceneModel.from_records(records), precision=precision).to_string()
+                again = next(read_pictures(io.StringIO(first)))[0]
+                second = TikzExporter(SceneModel.from_records(again), precision=precision).to_string()
+                mismatched += first != second
+        message = f"{pictures} pictures, {shapes} shapes, {skipped} skipped statements"
+        if mismatched:
+            return 'failed', time.perf_counter() - start, f"{message}, {mismatched} pictures changed on round trip"
+        return 'ok', time.perf_counter() - start, message
+    except Exception as e:
+        return 'failed', time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def find_inputs(patterns):
+    """Expand directories and glob patterns into a sorted list of .tex files."""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.update(glob.glob(os.path.join(pattern, '**', '*.tex'), recursive=True))
+        else:
+            paths.update(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+    return sorted(paths)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parse tikzpictures in .tex files and check they round-trip.")
+    parser.add_argument('inputs', nargs='+', help=".tex files, directories or glob patterns")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument('--precision', type=int, default=3, help="decimal places used by the round trip export")
+    args = parser.parse_args(argv)
+
+    paths = find_inputs(args.inputs)
+    if not paths:
+        print("no .tex files found", file=sys.stderr)
+        return 1
+    start = time.perf_counter()
+    precisions = [args.precision] * len(paths)
+    if args.jobs <= 1 or len(paths) == 1:
+        results = list(map(check_file, paths, precisions))
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(pool.map(check_file, paths, precisions, chunksize=max(1, len(paths) // (4 * args.jobs))))
+
+    failed = 0
+    for path, (status, seconds, message) in zip(paths, results):
+        failed += status == 'failed'
+        stream = sys.stderr if status == 'failed' else sys.stdout
+        print(f"{status:6} {path} ({seconds * 1000:.1f} ms, {message})", file=stream)
+    print(f"{len(paths) - failed} ok, {failed} failed in {time.perf_counter() - start:.2f} s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Mouse-wheel zoom, drag-to-pan and culling of the shapes that have their own artists."""
+from batch_render import RefreshHook, boxes_overlap, view_box
+
+
+class Viewport:
+    """Zoom and pan state of the editor's axes.
+
+    Before every full draw, artists of shapes outside the view are hidden, and text is
+    hidden altogether once the view is zoomed out below text_min_scale pixels per data
+    unit, where it would only cover the drawing. Batched shapes are culled by the
+    BatchRenderer itself.
+    """
+
+    def __init__(self, editor, zoom_step=1.2, text_min_scale=10.0, margin_pixels=100):
+        self.editor = editor
+        self.zoom_step = zoom_step
+        self.text_min_scale = text_min_scale
+        # Text extends to the right of its anchor, so artists are culled against a padded view
+        self.margin_pixels = margin_pixels
+        self.hidden = set()
+        self.pan_start = None
+        editor.ax.add_artist(RefreshHook(self))
+
+    def zoom(self, x, y, steps):
+        """Zoom in (steps > 0) or out around the data point (x, y)."""
+        factor = self.zoom_step ** steps
+        ax = self.editor.ax
+        x0, x1 = ax.get_xlim()
+        y0, y1 = ax.get_ylim()
+        ax.set_xlim(x - (x - x0) / factor, x + (x1 - x) / factor)
+        ax.set_ylim(y - (y - y0) / factor, y + (y1 - y) / factor)
+
+    def start_pan(self, event):
+        self.pan_start = (event.x, event.y, self.editor.ax.get_xlim(), self.editor.ax.get_ylim())
+
+    def pan(self, event):
+        """Shift the view so the data point under the mouse at start_pan follows it."""
+        px, py, (x0, x1), (y0, y1) = self.pan_start
+        _, scale = view_box(self.editor.ax)
+        dx, dy = (event.x - px) / scale, (event.y - py) / scale
+        self.editor.ax.set_xlim(x0 - dx, x1 - dx)
+        self.editor.ax.set_ylim(y0 - dy, y1 - dy)
+
+    def end_pan(self):
+        self.pan_start = None
+
+    def fit(self, bounds, padding=0.05):
+        """Zoom out, keeping the aspect ratio, until bounds (x0, y0, x1, y1) is in view."""
+        (vx0, vy0, vx1, vy1), _ = view_box(self.editor.ax)
+        x0, y0, x1, y1 = bounds
+        if x0 >= vx0 and y0 >= vy0 and x1 <= vx1 and y1 <= vy1:
+            return
+        factor = (1 + 2 * padding) * max((x1 - x0) / (vx1 - vx0), (y1 - y0) / (vy1 - vy0), 1.0)
+        cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+        half_w, half_h = factor * (vx1 - vx0) / 2, factor * (vy1 - vy0) / 2
+        self.editor.ax.set_xlim(cx - half_w, cx + half_w)
+        self.editor.ax.set_ylim(cy - half_h, cy + half_h)
+
+    def refresh(self):
+        """Hide the artists of shapes that are off screen or below their level of detail."""
+        editor = self.editor
+        scene, views = editor.scene, editor.views
+        self.hidden &= views.keys()
+        _, scale = view_box(editor.ax)
+        box, _ = view_box(editor.ax, self.margin_pixels / scale)
+        shown = set()
+        for kind, rows in scene.group_rows([sid for sid in views if sid in scene]).items():
+            if kind == 'text' and scale < self.text_min_scale:
+                continue
+            ids = scene.tables[kind].ids[rows]
+            shown.update(ids[boxes_overlap(scene.table_bounds(kind, rows), box)].tolist())
+        for sid in views.keys() - shown - self.hidden:
+            for artist in views[sid]:
+                artist.set_visible(False)
+            self.hidden.add(sid)
+        for sid in self.hidden & shown:
+            for artist in views[sid]:
+                artist.set_visible(True)
+            # Let the editor reapply per-shape visibility, e.g. of a head on a short arrow
+            editor.sync_artists(sid)
+            self.hidden.discard(sid)
+